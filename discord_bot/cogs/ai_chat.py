@@ -11,13 +11,20 @@ from discord.ext import commands, tasks
 from PIL import Image
 from io import BytesIO
 import base64
-from bs4 import BeautifulSoup
 import re
-from youtube_comment_downloader import YoutubeCommentDownloader, SORT_BY_POPULAR
+from youtube_comment_downloader import YoutubeCommentDownloader
 import itertools
 import hashlib
 from google import genai
 from google.genai import types
+from utils.chat_session import SessionRegistry
+from utils.token_counter import estimate_message_tokens
+from utils.consolidation_queue import ConsolidationQueue
+from utils.tool_metrics import ToolMetrics
+from utils.reply_streamer import ReplyStreamer
+from utils.prompt_cache import StaticPromptCache, ContextCacheManager
+from utils.media_cache import MediaCache
+from utils.link_preview import LinkPreviewer, extract_urls
 
 
 # --- 設定檔路徑 ---
@@ -63,22 +70,68 @@ class AIChat(commands.Cog):
         
         # 狀態 (Local Runtime State)
         self.is_override_active = False
-        self.history = [] 
         self.user_message_timestamps = {} 
         self.message_count = 0
         
-        # Debounce / Interrupt System
-        self.response_task: Optional[asyncio.Task] = None
-        self.message_buffer: list[discord.Message] = []
+        # 頻道對話狀態 (每個頻道獨立的 history / debounce buffer / 回覆 task / token 預算)
+        self.sessions = SessionRegistry(
+            max_sessions=int(os.getenv("AI_MAX_SESSIONS", "20")),
+            token_limit=int(os.getenv("AI_TOKEN_LIMIT", "8000"))
+        )
+        # 背景情節記憶整合 (摘要不再卡住回覆流程)
+        self.consolidation_queue = ConsolidationQueue(
+            self._run_consolidation_job,
+            concurrency=int(os.getenv("AI_CONSOLIDATION_CONCURRENCY", "2"))
+        )
+        # 精確 token 計數 (呼叫 count_tokens 端點校正估算值，結果有快取)
+        self.exact_token_count = os.getenv("AI_EXACT_TOKEN_COUNT", "0") == "1"
+
+        # 工具執行：同一步驟內互不相依的工具並行，單一工具逾時 + 整個步驟的期限
+        self.tool_timeout = float(os.getenv("AI_TOOL_TIMEOUT", "15"))
+        self.tool_step_deadline = float(os.getenv("AI_TOOL_STEP_DEADLINE", "30"))
+        self.tool_metrics = ToolMetrics()
+
+        # 串流回覆：先送出訊息再逐步編輯 (AI_STREAM_REPLIES=0 改回一次送出)
+        self.stream_replies = os.getenv("AI_STREAM_REPLIES", "1") == "1"
+        self.stream_edit_interval = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.2"))
+        self.stream_stats = {"replies": 0, "edits": 0, "coalesced": 0, "rate_limited": 0, "last_first_token_ms": None}
 
         # 載入靜態/設定檔
         self.emojis = self._load_json(EMOJI_FILE, {})
         self.emoji_meanings_file = os.path.join(DATA_DIR, 'emoji_meanings.json')
         self.emoji_meanings = self._load_json(self.emoji_meanings_file, {})
         self.core_memory_text = self._load_text(CORE_MEMORY_FILE, "System Core Missing.")
+
+        # System Prompt 靜態前綴 (核心記憶 + 表情資料庫 + 固定協議)：來源檔案變更時才重建
+        self._agent_tools = None
+        self.static_prompt = StaticPromptCache(
+            [EMOJI_FILE, self.emoji_meanings_file, CORE_MEMORY_FILE],
+            self._build_static_prompt
+        )
+        # 伺服器端 Context Cache (選用)：靜態前綴 + 工具宣告上傳一次，之後以 cache name 引用
+        self.context_cache = None
+        if os.getenv("AI_CONTEXT_CACHE", "0") == "1" and self.client:
+            self.context_cache = ContextCacheManager(
+                self.client, self.model_name,
+                ttl_seconds=int(os.getenv("AI_CONTEXT_CACHE_TTL", "3600"))
+            )
         
         # 工具初始化
         self.yt_downloader = YoutubeCommentDownloader()
+        # 連結預覽 (串流下載上限 + 執行緒解析 + TTL / 負快取 + 每網域併發上限)
+        self.link_previewer = LinkPreviewer(
+            lambda: self.bot.http_clients.session("web_preview"),
+            yt_downloader=self.yt_downloader,
+            max_bytes=int(os.getenv("AI_LINK_MAX_KB", "256")) * 1024,
+            ttl=float(os.getenv("AI_LINK_CACHE_TTL", "3600")),
+            per_domain=int(os.getenv("AI_LINK_PER_DOMAIN", "2")),
+            max_links=int(os.getenv("AI_LINK_MAX_PER_BATCH", "3"))
+        )
+        # 圖片 / 貼圖快取 (縮圖 + 依內容雜湊快取，歷史中的圖片換成佔位文字)
+        self.media_cache = MediaCache(
+            max_side=int(os.getenv("AI_IMAGE_MAX_SIDE", "1024")),
+            jpeg_quality=int(os.getenv("AI_IMAGE_JPEG_QUALITY", "85"))
+        )
 
         # 初始化記憶管理器 (Azure PostgreSQL)
         db_url = os.getenv("DATABASE_URL")
@@ -92,14 +145,21 @@ class AIChat(commands.Cog):
 
         # 啟動背景任務
         self.ice_breaker_task.start()
+        self.chat_maintenance_task.start()
         # Initialize AI Async
         self.bot.loop.create_task(self._init_ai())
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.ice_breaker_task.cancel()
+        self.chat_maintenance_task.cancel()
+        self.sessions.cancel_all()
+        # 等待背景整合寫完 (需要連線池，所以要在關閉前)
+        await self.consolidation_queue.drain(timeout=60)
+        if self.context_cache:
+            await self.context_cache.close()
         # 關閉連線池
         if self.memory_manager:
-            asyncio.create_task(self.memory_manager.close_pool())
+            await self.memory_manager.close_pool()
 
     async def _init_ai(self):
         # 初始化連線池
@@ -109,33 +169,36 @@ class AIChat(commands.Cog):
             except Exception as e:
                 print(f"❌ [DB] 連線池初始化失敗: {e}")
 
-        # 載入歷史 (從 DB) 並轉換為 Gemini API 格式
-        if self.memory_manager:
-            try:
-                raw_history = await self.memory_manager.get_recent_chat_history(limit=10)
-                if raw_history:
-                    # DB 格式: {"role": ..., "content": ...}
-                    # Gemini 格式: {"role": ..., "parts": [{"text": ...}]}
-                    self.history = []
-                    for msg in raw_history:
-                        role = msg.get("role", "user")
-                        content = msg.get("content", "")
-                        # 如果已經是正確格式 (有 parts)，直接用
-                        if "parts" in msg:
-                            self.history.append(msg)
-                        else:
-                            self.history.append({"role": role, "parts": [{"text": content}]})
-                    
-                    # Gemini API 要求第一條歷史必須是 user 角色
-                    while self.history and self.history[0].get("role") != "user":
-                        self.history.pop(0)
-                    
-                    print(f"📖 [Memory] 成功從 DB 載入 {len(self.history)} 條近期對話 (已轉換格式)")
-            except Exception as e:
-                print(f"⚠️ [Memory] DB 載入歷史失敗: {e}")
+        # 各頻道歷史改為延遲載入 (見 _load_session_history)
         
         print(f"✅ [AIChat] 初始化完成 (REST API Mode: {self.model_name})")
 
+    async def _load_session_history(self, session_id):
+        """從 DB 載入單一頻道的近期對話，並轉換為 Gemini API 格式"""
+        if not self.memory_manager:
+            return []
+
+        raw_history = await self.memory_manager.get_recent_chat_history(limit=10, session_id=session_id)
+        # DB 格式: {"role": ..., "content": ...}
+        # Gemini 格式: {"role": ..., "parts": [{"text": ...}]}
+        history = []
+        for msg in raw_history:
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+            # 如果已經是正確格式 (有 parts)，直接用
+            if "parts" in msg:
+                history.append(msg)
+            else:
+                history.append({"role": role, "parts": [{"text": content}]})
+        
+        # Gemini API 要求第一條歷史必須是 user 角色
+        while history and history[0].get("role") != "user":
+            history.pop(0)
+        
+        if history:
+            print(f"📖 [Memory] {session_id}: 從 DB 載入 {len(history)} 條近期對話 (已轉換格式)")
+        return history
+
     # --- Tool Definitions (Gemini Function Calling) ---
     def _get_tools(self):
         return [
@@ -196,6 +259,12 @@ class AIChat(commands.Cog):
         
         return tools
 
+    def _get_agent_tools(self):
+        """工具宣告只轉換一次 (types.Tool)"""
+        if self._agent_tools is None:
+            self._agent_tools = [types.Tool(function_declarations=self._get_tools())]
+        return self._agent_tools
+
     async def _execute_tool(self, tool_name, args):
         """執行工具並回傳結果"""
         if not self.memory_manager:
@@ -208,7 +277,8 @@ class AIChat(commands.Cog):
                 user_name = args.get("user_name")
                 content = args.get("content")
                 importance = args.get("importance", 5)
-                await self.memory_manager.add_memory(user_name, content, importance)
+                if await self.memory_manager.add_memory(user_name, content, importance) is None:
+                    return "Error: Failed to save memory."
                 return f"✅ 已儲存記憶: {content}"
             
             elif tool_name == "manage_fact":
@@ -251,28 +321,118 @@ class AIChat(commands.Cog):
         except Exception as e:
             return f"❌ Tool Error: {e}"
 
+    @staticmethod
+    def _tool_conflict_key(tool_name, args):
+        """
+        相同 key 的工具呼叫必須依序執行 (例如同一人的事實先 add 再 delete)；
+        回傳 None 代表可與其他呼叫並行。
+        """
+        args = args or {}
+        if tool_name == "manage_fact":
+            return ("fact", str(args.get("user_id", "")))
+        if tool_name == "learn_knowledge":
+            return ("knowledge", str(args.get("term", "")))
+        return None
+
+    async def _run_tool_timed(self, tool_name, args, timeout):
+        """執行單一工具 (有逾時)，並記錄延遲"""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            result = await asyncio.wait_for(self._execute_tool(tool_name, args), timeout=timeout)
+            if isinstance(result, str) and result.startswith("❌ Tool Error"):
+                outcome = "error"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            result = f"⏱️ Tool Timeout: {tool_name} 超過 {timeout:.1f} 秒未完成"
+            print(f"⏱️ [Agent] {tool_name} 逾時 ({timeout:.1f}s)")
+        finally:
+            self.tool_metrics.observe(tool_name, (time.perf_counter() - start) * 1000, outcome)
+        return result
+
+    async def _execute_tool_calls(self, function_calls):
+        """
+        並行執行同一步驟的工具呼叫，回傳結果 list (順序與 function_calls 相同)。
+        有衝突 key 的呼叫串成一條鏈依序執行；整個步驟超過期限後，尚未開始的呼叫直接回報逾時。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.tool_step_deadline
+        results = [None] * len(function_calls)
+
+        chains = {}
+        for i, fc in enumerate(function_calls):
+            key = self._tool_conflict_key(fc.name, fc.args)
+            chains.setdefault(key if key is not None else ("solo", i), []).append(i)
+
+        async def run_chain(indices):
+            for i in indices:
+                fc = function_calls[i]
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self.tool_metrics.observe(fc.name, 0.0, "timeout")
+                    results[i] = f"⏱️ Tool Timeout: 本步驟已超過 {self.tool_step_deadline:.0f} 秒，{fc.name} 未執行"
+                    continue
+                results[i] = await self._run_tool_timed(fc.name, fc.args, min(self.tool_timeout, remaining))
+
+        await asyncio.gather(*(run_chain(indices) for indices in chains.values()))
+        self.tool_metrics.observe_step(len(function_calls))
+        return results
+
     # --- Agent Loop ---
 
-    async def _call_gemini_agent(self, history_messages, system_instruction):
+    async def _stream_step(self, contents, config, on_text, on_reset):
+        """
+        以串流 API 執行單一步驟，回傳收集到的所有 parts (與非串流版相同的後續處理)。
+        只有在這一步還沒出現 function_call 時才把文字往外送。
+        """
+        parts = []
+        saw_call = False
+        streamed = False
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model_name,
+            contents=contents,
+            config=config
+        )
+        async for chunk in stream:
+            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                parts.append(part)
+                if part.function_call:
+                    if streamed and on_reset:
+                        on_reset()
+                    saw_call = True
+                    streamed = False
+                elif part.text and not part.thought and not saw_call:
+                    on_text(part.text)
+                    streamed = True
+        return parts
+
+    async def _call_gemini_agent(self, history_messages, system_instruction, on_text=None, on_reset=None,
+                                 cached_content=None):
         """
         Agentic Loop: 思考 -> 執行工具 -> 觀察 -> 再思考 -> 回應
         Uses google.genai SDK
+        on_text(delta): 有提供時改用串流 API，最終回覆的文字片段會即時傳出
+        on_reset(): 已傳出文字後才發現這一步是工具呼叫時呼叫 (清掉預覽)
+        cached_content: Context Cache name (靜態前綴 + 工具已在快取中，system_instruction 只含本回合動態資訊)
         """
         if not self.client: return "😵 (AI Client Not Initialized)"
 
-        # Prepare Tools Config
-        # SDK expects: config={'tools': [{'function_declarations': [...]}]}
-        tools_list = self._get_tools()
-        # Ensure parameters are correctly formatted schema (API v1beta/v1 compatible)
-        # The existing _get_tools returns compatible JSON schema.
-        
-        config = types.GenerateContentConfig(
-            temperature=0.7,
-            tools=[types.Tool(function_declarations=tools_list)],
-            system_instruction=system_instruction
-        )
-
-        current_messages = history_messages.copy()
+        if cached_content:
+            # 使用 Context Cache 時請求不能再帶 system_instruction / tools，
+            # 本回合的動態資訊改成對話最前面的一則 user 訊息
+            config = types.GenerateContentConfig(temperature=0.7, cached_content=cached_content)
+            current_messages = [{"role": "user", "parts": [{"text": system_instruction}]}] + list(history_messages)
+        else:
+            # Prepare Tools Config
+            # SDK expects: config={'tools': [{'function_declarations': [...]}]}
+            config = types.GenerateContentConfig(
+                temperature=0.7,
+                tools=self._get_agent_tools(),
+                system_instruction=system_instruction
+            )
+            current_messages = history_messages.copy()
         
         MAX_STEPS = 5 
         
@@ -281,22 +441,26 @@ class AIChat(commands.Cog):
                 print("⚠️ Agent Loop Reached Max Steps!")
 
             try:
-                # Call generate_content (Async)
-                # contents expects list of dicts or Content objects
-                response = await self.client.aio.models.generate_content(
-                    model=self.model_name,
-                    contents=current_messages,
-                    config=config
-                )
-                
-                # Parse Response
-                # SDK response has candidates[0].content...
-                # Iterate parts to find text or function calls
-                
-                if not response.candidates: return "..."
-                
-                content = response.candidates[0].content
-                parts = content.parts
+                if on_text is None:
+                    # Call generate_content (Async)
+                    # contents expects list of dicts or Content objects
+                    response = await self.client.aio.models.generate_content(
+                        model=self.model_name,
+                        contents=current_messages,
+                        config=config
+                    )
+
+                    # Parse Response
+                    # SDK response has candidates[0].content...
+                    # Iterate parts to find text or function calls
+
+                    if not response.candidates: return "..."
+
+                    content = response.candidates[0].content
+                    parts = content.parts
+                else:
+                    parts = await self._stream_step(current_messages, config, on_text, on_reset)
+                    if not parts: return "..."
                 
                 function_calls = []
                 text_response = ""
@@ -341,15 +505,12 @@ class AIChat(commands.Cog):
                         "parts": model_parts
                     })
 
-                    # Execute Tools and Append Function Responses
+                    # Execute Tools (並行) and Append Function Responses (依原始順序)
                     # 注意：function response 的 role 必須是 "user" (Gemini 3 API 規範)
-                    for fc in function_calls:
+                    tool_results = await self._execute_tool_calls(function_calls)
+                    for fc, tool_result in zip(function_calls, tool_results):
                         tool_name = fc.name
-                        tool_args = fc.args
-                        
-                        # Execute
-                        tool_result = await self._execute_tool(tool_name, tool_args)
-                        
+
                         # Append Function Response (Observation)
                         # role 使用 "user" 而非 "function"，符合 Gemini 3 API 規範
                         current_messages.append({
@@ -371,6 +532,8 @@ class AIChat(commands.Cog):
 
             except Exception as e:
                 print(f"❌ [Agent] API Error: {e}")
+                if cached_content and self.context_cache and "cache" in str(e).lower():
+                    self.context_cache.invalidate()  # 快取可能已過期，下回合重建
                 import traceback
                 traceback.print_exc()
                 return f"😵 (腦袋當機: {e})"
@@ -401,7 +564,15 @@ class AIChat(commands.Cog):
         with open(path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
-    async def _get_system_prompt(self, facts_context="", location_context="", knowledge_context="", self_identity=""):
+    def _build_static_prompt(self):
+        """
+        組出 System Prompt 的靜態前綴 (StaticPromptCache 在來源檔案變更時呼叫)。
+        同時重新載入表情與核心記憶，讓 [emoji] 替換也跟著更新。
+        """
+        self.emojis = self._load_json(EMOJI_FILE, {})
+        self.emoji_meanings = self._load_json(self.emoji_meanings_file, {})
+        self.core_memory_text = self._load_text(CORE_MEMORY_FILE, "System Core Missing.")
+
         # Emoji List
         emoji_list = []
         for k, code in self.emojis.items():
@@ -409,43 +580,22 @@ class AIChat(commands.Cog):
             if k.startswith("UI_") or "載入中" in desc: continue
             emoji_list.append(f"- [{k}]: {desc} (Code: `{code}`)")
         emoji_docs = "\n".join(emoji_list)
-        
-        # 組裝完整 System Prompt
+
         return f"""
 {self.core_memory_text}
 
-# ==========================================
-# 【我的自我認知 (Self Identity)】
-# ==========================================
-{self_identity if self_identity else "(無特殊身分)"}
-
 # ==========================================
 # 【表情資料庫 (Emoji Database)】
 # ==========================================
 請自然地在對話中使用以下表情代碼：
 {emoji_docs}
 
-# ==========================================
-# 【相關知識 (Relevant Knowledge)】
-# ==========================================
-{knowledge_context if knowledge_context else "(無相關知識)"}
-
-# ==========================================
-# 【所在位置 (Current Location)】
-# ==========================================
-{location_context}
-
 # ==========================================
 # 【通訊協定 (Protocol)】
 # ==========================================
 - 格式：[名稱 (username) | 關係狀態 | 時間]
 - 請直接用名稱稱呼對方。
 
-# ==========================================
-# 【已知事實 (Known Facts)】
-# ==========================================
-{facts_context if facts_context else "(目前沒有已知事實)"}
-
 # ==========================================
 # 【保密協定 (Confidentiality)】
 # ==========================================
@@ -497,19 +647,52 @@ class AIChat(commands.Cog):
 3. 如果規則和「有趣」衝突，請優先選擇「有趣」(但絕不能違反保密協定)。
 """
 
+    def _get_dynamic_prompt(self, facts_context="", location_context="", knowledge_context="", self_identity=""):
+        """每回合變動的段落 (接在靜態前綴之後)"""
+        return f"""
+# ==========================================
+# 【我的自我認知 (Self Identity)】
+# ==========================================
+{self_identity if self_identity else "(無特殊身分)"}
+
+# ==========================================
+# 【相關知識 (Relevant Knowledge)】
+# ==========================================
+{knowledge_context if knowledge_context else "(無相關知識)"}
+
+# ==========================================
+# 【所在位置 (Current Location)】
+# ==========================================
+{location_context}
+
+# ==========================================
+# 【已知事實 (Known Facts)】
+# ==========================================
+{facts_context if facts_context else "(目前沒有已知事實)"}
+"""
+
+    async def _get_system_prompt(self, facts_context="", location_context="", knowledge_context="", self_identity=""):
+        """
+        回傳 (system_instruction, cached_content)：
+        - 一般模式：靜態前綴 (快取) + 本回合動態段落，cached_content 為 None
+          (靜態內容固定放最前面，也讓模型端的隱式前綴快取更容易命中)
+        - Context Cache 模式：靜態前綴 + 工具已在伺服器端，system_instruction 只有動態段落
+        """
+        static_prompt = self.static_prompt.get()
+        dynamic_prompt = self._get_dynamic_prompt(facts_context, location_context, knowledge_context, self_identity)
+
+        if self.context_cache:
+            cache_name = await self.context_cache.get_name(
+                self.static_prompt.version, static_prompt, self._get_agent_tools()
+            )
+            if cache_name:
+                return dynamic_prompt, cache_name
+
+        return static_prompt + dynamic_prompt, None
+
     async def fetch_url_content(self, url):
-        # ... (unchanged) ...
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.get(url, timeout=5) as resp:
-                    if resp.status != 200: return None
-                    html = await resp.text()
-                    soup = BeautifulSoup(html, 'html.parser')
-                    title = soup.title.string if soup.title else "Link"
-                    text = soup.get_text()[:500].strip()
-                    return f"[Link Content] Title: {title}\nBody: {text}..."
-        except: return None
+        """單一網址預覽 (快取 / 大小上限 / 網域併發上限見 utils/link_preview.py)"""
+        return await self.link_previewer.preview(url)
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -518,75 +701,93 @@ class AIChat(commands.Cog):
         if message.author.bot and message.author.id != CONCH_BOT_ID: return
         if message.channel.id not in self.active_channel_ids and not self.is_override_active: return
         
+        session = self.sessions.get(message.channel.id)
+
         # 如果是神奇嗨螺的訊息，只加入 buffer 但不觸發回覆
         if message.author.bot and message.author.id == CONCH_BOT_ID:
-            self.message_buffer.append(message)
+            session.message_buffer.append(message)
             print(f"🐚 [Buffer] Conch bot message added (passive): {message.content[:30]}...")
             return
         
         # 🔍 DEBUG
         print(f"📨 [Buffer] New message from {message.author.display_name}: {message.content[:20]}...")
 
-        # 2. Cancel Pending Task (Interrupt)
-        if self.response_task and not self.response_task.done():
-            self.response_task.cancel()
-            print(f"🛑 [Buffer] Interrupted previous thought process!")
+        # 2. Cancel Pending Task (Interrupt) — 只中斷同一個頻道的回覆
+        if session.response_task and not session.response_task.done():
+            session.response_task.cancel()
+            print(f"🛑 [Buffer] Interrupted previous thought process! ({session.session_id})")
         
         # 3. Add to Buffer
-        self.message_buffer.append(message)
+        session.message_buffer.append(message)
         
         # 4. Start New Task (Debounce 0.5s)
-        self.response_task = asyncio.create_task(self._process_buffer_task(message.channel))
+        session.response_task = asyncio.create_task(self._process_buffer_task(message.channel, session))
 
-    async def _process_buffer_task(self, channel):
+    async def _process_buffer_task(self, channel, session):
         try:
             # Debounce Wait
             await asyncio.sleep(0.5)
             
             # --- START PROCESSING ---
-            if not self.message_buffer: return
+            if not session.message_buffer: return
+
+            # 第一次使用此頻道 → 從 DB 載入歷史 (需在本回合寫入 chat_history 之前)
+            await session.ensure_loaded(self._load_session_history)
+            if not session.message_buffer: return
 
             # Snapshot & Clear
-            messages_to_process = list(self.message_buffer)
-            self.message_buffer.clear()
+            messages_to_process = list(session.message_buffer)
+            session.message_buffer.clear()
             
             print(f"🧠 [Agent] Processing batch of {len(messages_to_process)} messages...")
             
             # Use the last message for context (Channel/Guild)
             last_message = messages_to_process[-1]
             
-            # 1. Log to DB (Log each message individually)
-            if self.memory_manager:
-                for msg in messages_to_process:
-                    log_content = msg.content
-                    if not log_content and msg.attachments:
-                        log_content = f"[Sent {len(msg.attachments)} images]"
-                    await self.memory_manager.log_chat(role="user", content=log_content, session_id=f"discord_{channel.id}")
-
             self.last_message_time = time.time()
             
-            # 2. Context Building (Similar to before)
-            # Fact Injection
+            # 1~2. Log to DB + Context Building (Facts / RAG / Chat Log 單次並行查詢)
+            target_users = {}
+            for msg in messages_to_process:
+                target_users[msg.author.name] = msg.author
+                for user in msg.mentions:
+                    if not user.bot: target_users[user.name] = user
+
+            combined_text = "\n".join([m.content for m in messages_to_process if m.content])
+
+            # 連結預覽：整批網址並行抓取，與下面的 DB 查詢同時進行
+            # (被新訊息打斷也不取消 — 結果會留在快取給下一輪用)
+            urls = extract_urls(combined_text)
+            preview_task = asyncio.create_task(self.link_previewer.preview_many(urls)) if urls else None
+
+            log_rows = []
+            for msg in messages_to_process:
+                log_content = msg.content
+                if not log_content and msg.attachments:
+                    log_content = f"[Sent {len(msg.attachments)} images]"
+                log_rows.append({"role": "user", "content": log_content, "author": msg.author.name})
+
             facts_context = ""
+            knowledge_context = ""
             if self.memory_manager:
                 try:
-                    target_users = set()
-                    for msg in messages_to_process:
-                        target_users.add(msg.author)
-                        for user in msg.mentions:
-                            if not user.bot: target_users.add(user)
-                    
+                    turn_context = await self.memory_manager.build_turn_context(
+                        list(target_users.keys()), combined_text, log_rows,
+                        session_id=f"discord_{channel.id}"
+                    )
+                    knowledge_context = turn_context["knowledge"]
+
+                    # Fact Injection
                     facts_lines = []
-                    for user in target_users:
-                        user_key = user.name 
-                        user_facts = await self.memory_manager.get_facts(user_key)
+                    for user_key, user in target_users.items():
+                        user_facts = turn_context["facts"].get(user_key)
                         if user_facts:
                             facts_lines.append(f"- {user.display_name} ({user.name}):")
                             for f in user_facts:
                                 facts_lines.append(f"  * {f}")
                     if facts_lines:
                         facts_context = "[已知事實 (Known Facts)]\n" + "\n".join(facts_lines)
-                except Exception as e: print(f"⚠️ Fact Injection Error: {e}")
+                except Exception as e: print(f"⚠️ Context Building Error: {e}")
 
             # Location Info
             try:
@@ -595,14 +796,6 @@ class AIChat(commands.Cog):
                 location_info = f"- 伺服器 (Server): {guild_name}\n- 頻道 (Channel): {channel_name}"
             except: location_info = "- 位置未知"
 
-            # RAG (Use combined text)
-            combined_text = "\n".join([m.content for m in messages_to_process if m.content])
-            knowledge_context = ""
-            if self.memory_manager and combined_text.strip():
-                try:
-                    knowledge_context = await self.memory_manager.search_knowledge(combined_text)
-                except Exception as e: print(f"⚠️ RAG Search Error: {e}")
-
             # Self Identity
             self_identity = ""
             try:
@@ -613,11 +806,11 @@ class AIChat(commands.Cog):
             except: pass
 
             # System Prompt
-            system_prompt = await self._get_system_prompt(facts_context, location_info, knowledge_context, self_identity)
+            system_prompt, cached_content = await self._get_system_prompt(facts_context, location_info, knowledge_context, self_identity)
             
             # Build History
             api_messages = []
-            for msg in self.history:
+            for msg in session.history:
                  api_messages.append(msg)
 
             # 3. Construct Current Turn (Merge Messages)
@@ -651,21 +844,23 @@ class AIChat(commands.Cog):
                             if attachment.size > 8 * 1024 * 1024: continue
                             try:
                                 image_data = await attachment.read()
-                                b64_data = base64.b64encode(image_data).decode('utf-8')
-                                current_user_parts.append({
-                                    "inline_data": { "mime_type": attachment.content_type, "data": b64_data }
-                                })
-                                # Image Hashing Logic
-                                try:
-                                    img_hash = hashlib.sha256(image_data).hexdigest()
-                                    if self.memory_manager:
-                                        existing = await self.memory_manager.check_image_hash(img_hash)
+                                # 縮圖 + 重新壓縮 (同一張圖只處理一次)
+                                media = await self.media_cache.from_bytes(image_data, attachment.content_type)
+                                if media:
+                                    current_user_parts.append({
+                                        "inline_data": { "mime_type": media["mime_type"], "data": media["data"] }
+                                    })
+                                # 重複圖片偵測 (感知雜湊查記憶體 BK-tree，沒命中再以 sha256 查舊圖片；DB 寫入在背景與模型呼叫並行)
+                                if media and self.memory_manager:
+                                    try:
+                                        existing = await self.memory_manager.find_duplicate_image(media["hash"], media["phash"])
                                         if existing:
                                             ts = existing['created_at'].strftime('%Y-%m-%d %H:%M')
                                             current_user_parts.append({"text": f"\n[系統提示: 這張圖片在 {ts} 由 {existing['user_id']} 傳送過。]"})
                                         else:
-                                            await self.memory_manager.add_image_hash(img_hash, msg.author.name)
-                                except: pass
+                                            self.memory_manager.remember_image(media["hash"], media["phash"], msg.author.name)
+                                    except Exception as e:
+                                        print(f"⚠️ [Image] 重複圖片偵測失敗: {e}")
                             except: pass
 
                 # --- 3. Handle Stickers (Vision + Text) ---
@@ -679,17 +874,14 @@ class AIChat(commands.Cog):
                         # Discord stickers are often Lottie (JSON) or PNG/APNG
                         try:
                             if sticker.format in [discord.StickerFormatType.png, discord.StickerFormatType.apng]:
-                                url = sticker.url
-                                async with aiohttp.ClientSession() as session:
-                                    async with session.get(url) as resp:
-                                        if resp.status == 200:
-                                            data = await resp.read()
-                                            b64_data = base64.b64encode(data).decode('utf-8')
-                                            # Mime type check
-                                            mime = "image/png" # Default
-                                            current_user_parts.append({
-                                                "inline_data": { "mime_type": mime, "data": b64_data }
-                                            })
+                                # 共用連線池 (注意：不可命名為 session，會蓋掉頻道的 ChatSession)
+                                # 同一個貼圖只下載 / 縮圖一次
+                                http = self.bot.http_clients.session("media")
+                                media = await self.media_cache.fetch_sticker(sticker, http)
+                                if media:
+                                    current_user_parts.append({
+                                        "inline_data": { "mime_type": media["mime_type"], "data": media["data"] }
+                                    })
                         except Exception as e:
                             print(f"⚠️ Sticker processing error: {e}")
                     
@@ -707,36 +899,63 @@ class AIChat(commands.Cog):
                 final_text = user_header + reply_context + text_content + "\n"
                 current_user_parts.append({"text": final_text})
 
+            if preview_task:
+                try:
+                    for preview in await asyncio.shield(preview_task):
+                        current_user_parts.append({"text": f"\n{preview}\n"})
+                except Exception as e:
+                    print(f"⚠️ [Link] 連結預覽失敗: {e}")
+
             api_messages.append({"role": "user", "parts": current_user_parts})
 
             # 4. Call Agent
             async with channel.typing():
-                response_text = await self._call_gemini_agent(api_messages, system_instruction=system_prompt)
-                
-                final_response = response_text
-                for k, v in self.emojis.items():
-                    final_response = final_response.replace(f"[{k}]", v)
-                
-                await channel.send(final_response)
+                if self.stream_replies:
+                    streamer = ReplyStreamer(channel, self._render_emojis, min_interval=self.stream_edit_interval)
+                    try:
+                        response_text = await self._call_gemini_agent(
+                            api_messages, system_instruction=system_prompt,
+                            on_text=streamer.feed, on_reset=streamer.reset,
+                            cached_content=cached_content
+                        )
+                        await streamer.finish(response_text)
+                    except asyncio.CancelledError:
+                        # 被新訊息打斷 → 刪掉半成品，交給下一輪回覆
+                        await streamer.abort()
+                        raise
+                    finally:
+                        self._record_stream_stats(streamer)
+                else:
+                    response_text = await self._call_gemini_agent(
+                        api_messages, system_instruction=system_prompt, cached_content=cached_content
+                    )
+                    await channel.send(self._render_emojis(response_text))
                 
                 # Log AI Response
                 if self.memory_manager:
                     await self.memory_manager.log_chat(role="model", content=response_text, session_id=f"discord_{channel.id}")
                 
                 # Update History (Store merged turn)
-                self.history.append({"role": "user", "parts": current_user_parts})
-                self.history.append({"role": "model", "parts": [{"text": response_text}]})
+                # 圖片只在這一回合送出，存入歷史時換成佔位文字 (之後每回合不再重送)
+                session.history.append({"role": "user", "parts": self.media_cache.compact_parts(current_user_parts)})
+                session.history.append({"role": "model", "parts": [{"text": response_text}]})
                 
-                # Token Limit Check
-                TOKEN_LIMIT = 8000
-                if self._count_tokens(self.history) > TOKEN_LIMIT:
+                # Token Limit Check (每個頻道各自的預算，總數由 TokenHistory 增量維護)
+                TOKEN_LIMIT = session.token_limit
+                if self.exact_token_count and self.client and session.history.total_tokens > TOKEN_LIMIT:
+                    # 估算超標時才用精確計數確認，避免每回合都打 API
+                    try:
+                        await session.history.refine_exact(self.client, self.model_name)
+                    except Exception as e:
+                        print(f"⚠️ [Token] 精確計數失敗，沿用估算值: {e}")
+                if session.history.total_tokens > TOKEN_LIMIT:
                     context_info = {
                         "channel_id": channel.id,
                         "channel_name": getattr(channel, 'name', 'private'),
                         "guild_id": getattr(channel.guild, 'id', 0) if hasattr(channel, 'guild') else 0,
                         "guild_name": getattr(channel.guild, 'name', 'Direct Message') if hasattr(channel, 'guild') else "DM"
                     }
-                    await self._manage_history_overflow(TOKEN_LIMIT, context_info)
+                    await self._manage_history_overflow(session, TOKEN_LIMIT, context_info)
 
         except asyncio.CancelledError:
             print("🛑 [Agent] Task Cancelled (New message arrived or interruption)")
@@ -745,51 +964,84 @@ class AIChat(commands.Cog):
             print(f"❌ [Agent] Critical Error: {e}")
             await channel.send(f"😵 (系統錯誤: {e})")
 
-    async def _manage_history_overflow(self, limit, context_info=None):
+    def _render_emojis(self, text):
+        """把 [emoji名稱] 換成實際的 Discord emoji"""
+        for k, v in self.emojis.items():
+            text = text.replace(f"[{k}]", v)
+        return text
+
+    def _media_status_line(self):
+        media = self.media_cache.get_stats()
+        saved_mb = (media["resize_bytes_saved"] + media["history_bytes_saved"]) / (1024 * 1024)
+        return (f"- 圖片快取: {media['items']} 張 | 命中率 {media['hit_rate']:.0%} (貼圖 {media['sticker_hits']}) | "
+                f"縮圖省 {media['resize_bytes_saved'] / 1024:.0f} KB + 歷史佔位 {media['placeholders']} 次 (共省 {saved_mb:.1f} MB)")
+
+    def _link_status_line(self):
+        link = self.link_previewer.get_stats()
+        return (f"- 連結預覽: 快取 {link['cached']} 筆 | 命中率 {link['hit_rate']:.0%} (負快取 {link['negative_hits']}) | "
+                f"截斷 {link['truncated']} 次 | 失敗 {link['errors']} | 解析器 {link['parser']}")
+
+    def _record_stream_stats(self, streamer):
+        self.stream_stats["replies"] += 1
+        for key in ("edits", "coalesced", "rate_limited"):
+            self.stream_stats[key] += streamer.stats[key]
+        if streamer.stats["first_token_ms"] is not None:
+            self.stream_stats["last_first_token_ms"] = streamer.stats["first_token_ms"]
+
+    async def _manage_history_overflow(self, session, limit, context_info=None):
         """
         當短期記憶爆滿時，執行「情節記憶整合 (Episodic Memory Consolidation)」
         策略：Look-Ahead Summarization
         1. 讀取全部記憶 (0~8000) 以取得完整上下文
-        2. 總結前半段 (0~4000) 的故事
-        3. 刪除前半段 (0~3500)，保留 500 Tokens 的重疊區 (Context Bridge)
+        2. 總結前半段 (0~4000) 的故事 — 排入背景佇列，不等待
+        3. 立即刪除前半段 (0~3500)，保留 500 Tokens 的重疊區 (Context Bridge)
         """
-        print(f"🧹 [Memory] Token Limit Reached ({self._count_tokens(self.history)} > {limit}). Starting consolidation...")
+        print(f"🧹 [Memory] Token Limit Reached ({session.history.total_tokens} > {limit}). Starting consolidation...")
         
         # Target: Prune oldest 50% (approx 4000 tokens)
         target_prune_tokens = limit // 2  # 4000
         
-        # 1. Identify Split Point
-        current_tokens = 0
-        split_index = 0
-        for i, msg in enumerate(self.history):
-            msg_tokens = self._count_tokens([msg])
-            current_tokens += msg_tokens
-            if current_tokens >= target_prune_tokens:
-                split_index = i
-                break
+        # 1. Identify Split Point (使用每則訊息快取的成本)
+        split_index = session.history.split_index_for(target_prune_tokens)
         
         # Ensure we don't split in the middle of a pair (User/Model)
         if split_index % 2 != 0: 
             split_index += 1
-            
-        old_chunk = self.history[:split_index]
-        new_chunk = self.history[split_index:]
         
-        # 2. Consolidate (Summarize)
+        # 2. Consolidate (Summarize) — 背景執行
         # This gives the AI "Look-Ahead" context to understand the old chunk better.
-        await self._consolidate_memory(full_history=self.history, focus_end_index=split_index, context_info=context_info)
+        snapshot = session.history.to_list()
+        focus_text = json.dumps(snapshot[:split_index], ensure_ascii=False, sort_keys=True, default=str)
+        job_key = hashlib.sha256(f"{session.session_id}:{focus_text}".encode('utf-8')).hexdigest()
+        queued = self.consolidation_queue.submit(job_key, {
+            "full_history": snapshot,
+            "focus_end_index": split_index,
+            "context_info": context_info
+        })
+        if queued:
+            print(f"📥 [Memory] Consolidation queued ({self.consolidation_queue.pending} pending)")
         
         # 3. Prune (With Overlap Bridge)
         # We want to keep the last few messages of the old chunk as a bridge
         BRIDGE_SIZE = 5 # Messages
-        bridge = old_chunk[-BRIDGE_SIZE:] if len(old_chunk) > BRIDGE_SIZE else []
+        bridge_len = BRIDGE_SIZE if split_index > BRIDGE_SIZE else 0
+        pruned = split_index - bridge_len
         
-        self.history = bridge + new_chunk
-        print(f"🧹 [Memory] Pruned {len(old_chunk) - len(bridge)} messages. New size: {len(self.history)} msgs.")
+        session.history.drop_front(pruned)
+        print(f"🧹 [Memory] Pruned {pruned} messages. New size: {len(session.history)} msgs ({session.history.total_tokens} tokens).")
+
+    async def _run_consolidation_job(self, payload):
+        """ConsolidationQueue 的 handler"""
+        return await self._consolidate_memory(
+            full_history=payload["full_history"],
+            focus_end_index=payload["focus_end_index"],
+            context_info=payload.get("context_info")
+        )
 
     async def _consolidate_memory(self, full_history, focus_end_index, context_info=None):
         """
         將對話轉化為長期記憶日記
+        回傳 True = 完成 (或無須處理)，False = 失敗需重試
         """
         try:
             # Construct the text to be summarized
@@ -814,7 +1066,7 @@ class AIChat(commands.Cog):
             """
             
             # Call Gemini to summarize (Using SDK)
-            if not self.client: return
+            if not self.client: return True
 
             try:
                 response = await self.client.aio.models.generate_content(
@@ -825,38 +1077,89 @@ class AIChat(commands.Cog):
                 
                 # Save to Long-Term Memory
                 if self.memory_manager:
-                    await self.memory_manager.add_memory(
+                    memory_id = await self.memory_manager.add_memory(
                         user_name="SYSTEM_ARCHIVE", 
                         content=f"【對話封存日記】 {summary}", 
                         importance=8, 
                         type="episodic_log",
                         metadata=context_info
                     )
+                    if memory_id is None:
+                        # Embedding / DB 失敗 → 回傳 False 讓 ConsolidationQueue 稍後重試
+                        print("⚠️ [Memory] 日記儲存失敗，稍後重試")
+                        return False
                     print(f"💾 [Memory] Consolidated Diary: {summary[:50]}...")
+                return True
             except Exception as e:
                 print(f"❌ Summarization failed: {e}")
+                return False
 
         except Exception as e:
             print(f"❌ Consolidation Error: {e}")
+            return False
 
     def _count_tokens(self, messages):
         """
-        Simple Heuristic Token Counter
+        Heuristic Token Counter (CJK 感知 + 圖片/工具呼叫計價)
+        對話歷史請直接使用 TokenHistory.total_tokens (增量維護)，這裡只給零散訊息用。
         """
-        total = 0
-        for msg in messages:
-            content = msg.get('parts', [{}])[0].get('text', '')
-            # English words = 1.3, Chinese chars = 1.5, Others = 1
-            # Simple approximation: len(content) is chars.
-            # 1 Chinese char is usually 1-3 bytes, in UTF-8 len() counts codepoints.
-            # Let's count characters.
-            # Rough estimation: 1 char ~= 1 token (conservative)
-            total += len(content)
-        return total
+        return sum(estimate_message_tokens(msg) for msg in messages)
 
     @commands.group(name="status", invoke_without_command=True)
     async def status_group(self, ctx):
-        await ctx.send(f"🤖 **HiHi Agent V2**\n- Model: {self.model_name}\n- Memory: {'✅ Postgres' if self.memory_manager else '❌ Disabled'}\n- Mode: Agentic Loop")
+        lines = [
+            "🤖 **HiHi Agent V2**",
+            f"- Model: {self.model_name}",
+            f"- Memory: {'✅ Postgres' if self.memory_manager else '❌ Disabled'}",
+            "- Mode: Agentic Loop",
+            f"- Sessions: {len(self.sessions)} 個頻道 (上限 {self.sessions.max_sessions})",
+            f"- 串流回覆: {'✅' if self.stream_replies else '❌'} | {self.stream_stats['replies']} 則 | 編輯 {self.stream_stats['edits']} 次 (合併 {self.stream_stats['coalesced']}, 429 {self.stream_stats['rate_limited']}) | 首字 {self.stream_stats['last_first_token_ms'] or '-'} ms",
+            f"- System Prompt: 靜態前綴 v{self.static_prompt.version or '-'} (重用 {self.static_prompt.stats['hits']} / 重建 {self.static_prompt.stats['rebuilds']})"
+            + (f" | Context Cache {'✅' if self.context_cache.get_stats()['active'] else '❌'} (建立 {self.context_cache.stats['created']}, 失敗 {self.context_cache.stats['errors']})" if self.context_cache else ""),
+            self._media_status_line(),
+            self._link_status_line(),
+            f"- 記憶整合: 待處理 {self.consolidation_queue.pending} | 完成 {self.consolidation_queue.stats['completed']} | 失敗 {self.consolidation_queue.stats['failed']}",
+        ]
+        if self.memory_manager:
+            emb = self.memory_manager.embedder.get_stats()
+            lines.append(f"- Embedding: 佇列 {emb['queue_depth']} | 批次 {emb['batches']} 次 (平均 {emb['avg_batch_size']} 筆, 最大 {emb['max_batch_size']} 筆)")
+            if "cache" in emb:
+                cache = emb["cache"]
+                lines.append(f"- Embedding 快取: 命中率 {cache['hit_rate']:.0%} (記憶體 {cache['memory_hits']} / 磁碟 {cache['disk_hits']} / 未命中 {cache['misses']})")
+            facts_cache = self.memory_manager.get_facts_cache_stats()
+            lines.append(f"- Facts 快取: 命中率 {facts_cache['hit_rate']:.0%} ({facts_cache['size']} 人, 監聽 {'✅' if facts_cache['listening'] else '❌'})")
+            retention = self.memory_manager.chat_retention.get_stats()
+            lines.append(f"- 聊天記錄: {'月分區' if retention['partitioned'] else '單一表'} | 保留 {retention['retention_months'] or '∞'} 個月 | 已封存 {len(retention['archived'])} 個分區")
+            chat_log = self.memory_manager.chat_log.get_stats()
+            lines.append(f"- 聊天記錄寫入: 緩衝 {chat_log['buffered']} | 已寫入 {chat_log['written']} ({chat_log['flushes']} 批) | 日誌 {chat_log['journaled']} / 重送 {chat_log['replayed']}" + (" ⚠️ DB 寫入異常" if chat_log['degraded'] else ""))
+            tool_stats = self.tool_metrics.get_stats()
+            if tool_stats["tools"]:
+                slowest = next(iter(tool_stats["tools"].items()))
+                lines.append(f"- 工具: {tool_stats['steps']} 步驟 (並行 {tool_stats['parallel_steps']}) | 最耗時 {slowest[0]} (p95 ≤ {slowest[1]['p95_ms']:.0f} ms) — 詳見 !status tools")
+            index = self.memory_manager.get_local_index_stats()
+            if index["enabled"]:
+                kn, fa = index["knowledge"], index["facts"]
+                lines.append(f"- 本地向量索引: 知識 {kn['size'] if kn['ready'] else 'SQL'} | 事實 {fa['size'] if fa['ready'] else 'SQL'} (上次查詢 {max(kn['last_query_us'], fa['last_query_us'])} µs)")
+            lines.append(f"- 重複圖片索引: {len(self.memory_manager.image_index)} 張 (漢明距離 ≤ {self.memory_manager.image_dup_distance})")
+        await ctx.send("\n".join(lines))
+
+    @status_group.command(name="tools")
+    async def status_tools(self, ctx):
+        """各工具的延遲直方圖 (依總耗時排序)"""
+        stats = self.tool_metrics.get_stats()
+        if not stats["tools"]:
+            await ctx.send("🛠️ 尚未執行過任何工具。")
+            return
+        lines = [f"🛠️ **工具延遲** ({stats['steps']} 步驟，其中 {stats['parallel_steps']} 步驟並行)"]
+        for name, t in stats["tools"].items():
+            lines.append(
+                f"**{name}** — {t['count']} 次 | 總計 {t['total_ms'] / 1000:.1f}s | 平均 {t['avg_ms']:.0f} ms | "
+                f"p50 ≤ {t['p50_ms']:.0f} ms | p95 ≤ {t['p95_ms']:.0f} ms | 最大 {t['max_ms']:.0f} ms | "
+                f"錯誤 {t.get('error', 0)} / 逾時 {t.get('timeout', 0)}"
+            )
+            buckets = " ".join(f"{k[3:]}:{v}" for k, v in t["buckets"].items() if v)
+            lines.append(f"`{buckets}`")
+        await ctx.send("\n".join(lines))
 
     @tasks.loop(minutes=30)
     async def ice_breaker_task(self):
@@ -866,5 +1169,21 @@ class AIChat(commands.Cog):
     async def before_ice_breaker(self):
         await self.bot.wait_until_ready()
 
+    @tasks.loop(hours=6)
+    async def chat_maintenance_task(self):
+        """chat_history 分區 / 每日統計 / 過期封存 (啟動時 init_pool 已執行過一次)"""
+        if not self.memory_manager or not self.memory_manager.pool:
+            return
+        try:
+            await self.memory_manager.run_chat_maintenance()
+        except Exception as e:
+            print(f"⚠️ [ChatLog] 定期維護失敗: {e}")
+
+    @chat_maintenance_task.before_loop
+    async def before_chat_maintenance(self):
+        await self.bot.wait_until_ready()
+        # 第一次執行延後 (避免與 init_pool 內的維護重複)
+        await asyncio.sleep(6 * 3600)
+
 async def setup(bot):
     await bot.add_cog(AIChat(bot))
@@ -26,7 +26,6 @@ import aiohttp
 # ... (Regex Patterns)
 JOIN_PATTERN = re.compile(r'\[PlayerJoin\] (.+)')
 LEFT_PATTERN = re.compile(r'\[PlayerLeave\] (.+)')
-LIST_PATTERN = re.compile(r'(?:There are|共有)\s+(\d+)/(\d+)\s+(?:players online|玩家在線上)')
 CHAT_PATTERN = re.compile(r'\[ChatLog\]\s+<(.+?)>\s+(.*)')
 
 class JoinButton(discord.ui.View):
@@ -134,11 +133,11 @@ class Minecraft(commands.Cog):
         
         # Fetch Public IP
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get('https://api.ipify.org') as resp:
-                    if resp.status == 200:
-                        self.public_ip = await resp.text()
-                        print(f"🌍 Detected Public IP: {self.public_ip}")
+            session = self.bot.http_clients.session("default")
+            async with session.get('https://api.ipify.org') as resp:
+                if resp.status == 200:
+                    self.public_ip = await resp.text()
+                    print(f"🌍 Detected Public IP: {self.public_ip}")
         except Exception as e:
             print(f"⚠️ Failed to fetch public IP: {e}")
             
@@ -190,10 +189,11 @@ class Minecraft(commands.Cog):
         payload = {"action": action, **kwargs}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload, timeout=timeout) as resp:
-                    resp.raise_for_status()
-                    return await resp.json()
+            # 共用連線池 (Keep-Alive)，同一台 VM 的連續請求不必重新握手
+            session = self.bot.http_clients.session("agent")
+            async with session.post(url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                resp.raise_for_status()
+                return await resp.json()
         except Exception as e:
             self.log_debug(f"Agent POST failed to {vm_ip} for {action}: {e}")
             return {"status": "error", "message": str(e)}
@@ -330,31 +330,24 @@ class Minecraft(commands.Cog):
         public_ip = self.gcp_manager.get_instance_public_ip(vm_name) or "嘗試獲取中..."
         embed.description = f"🌍 主機 IP: `{public_ip}`\n"
         
-        # 4. 針對每一個實例抓取詳細資料 (嘗試併發執行以節省時間)
-        async def fetch_instance_status(inst):
-            screen_name = inst.get('screen_name')
-            if screen_name in active_screens:
-                # 在線！嘗試抓玩家數量
-                await self._agent_post(vm_ip, "execute_command", screen_name=screen_name, command="list")
-                await asyncio.sleep(0.3) # 縮短等待時間
-                
-                log_path = f"{inst['path']}/bedrock_screen.log"
-                log_res = await self._agent_post(vm_ip, "read_log_tail", filepath=log_path, lines=15)
-                
+        # 4. 在線實例的玩家名單 (Agent 由 log 事件即時維護，一次查詢、不必注入 list 指令)
+        online = [inst for inst in self.instances if inst.get('screen_name') in active_screens]
+        players_res = await self._agent_post(vm_ip, "get_players", paths=[inst['path'] for inst in online]) if online else {}
+        rosters = {r['path'].rstrip('/'): r for r in players_res.get('instances', [])}
+        online_ids = {id(inst) for inst in online}
+
+        results = []
+        for inst in self.instances:
+            if id(inst) in online_ids:
                 player_display = "? 人"
-                if log_res.get('status') == 'success':
-                    content = log_res.get('content', '')
-                    matches = LIST_PATTERN.findall(content)
-                    if matches:
-                        player_display = f"{matches[-1][0]} / {matches[-1][1]} 人"
-                        
-                return {"name": inst['name'], "port": inst['port'], "status": "online", "players": player_display}
+                roster = rosters.get(inst['path'].rstrip('/'))
+                if roster:
+                    names = ", ".join(p['name'] for p in roster['players'])
+                    max_players = roster.get('max_players') or "?"
+                    player_display = f"{roster['count']} / {max_players} 人" + (f"\n{names}" if names else "")
+                results.append({"name": inst['name'], "port": inst['port'], "status": "online", "players": player_display})
             else:
-                return {"name": inst['name'], "port": inst['port'], "status": "offline", "players": "N/A"}
-
-        # 啟動併發任務
-        tasks = [fetch_instance_status(inst) for inst in self.instances]
-        results = await asyncio.gather(*tasks)
+                results.append({"name": inst['name'], "port": inst['port'], "status": "offline", "players": "N/A"})
 
         for r in results:
             if r["status"] == "online":
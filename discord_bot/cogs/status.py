@@ -117,6 +117,25 @@ class Status(commands.Cog):
             await message.channel.send(f"🤖 {self.bot_name}收到更新訊號，開始重載...")
             await self.do_reload(interaction=None, channel=message.channel)
 
+    @commands.command(name="http")
+    async def http_stats(self, ctx):
+        """共用 HTTP 連線池的連線重用統計"""
+        registry = getattr(self.bot, 'http_clients', None)
+        if registry is None:
+            await ctx.send("❌ 共用 HTTP 連線池未啟用")
+            return
+
+        stats = registry.get_stats()
+        lines = [f"🌐 **{self.bot_name} HTTP 連線池** ({'✅' if stats['active'] else '❌'} | 上限 {stats['limit']}, 每主機 {stats['limit_per_host']})"]
+        if not stats['purposes']:
+            lines.append("(尚未發出任何請求)")
+        for purpose, s in stats['purposes'].items():
+            lines.append(
+                f"- `{purpose}`: 請求 {s['requests']} | 新連線 {s['new_connections']} / 重用 {s['reused_connections']} "
+                f"(重用率 {s['reuse_rate']:.0%}) | DNS 快取 {s['dns_hits']}/{s['dns_hits'] + s['dns_misses']} | 錯誤 {s['errors']}"
+            )
+        await ctx.send("\n".join(lines))
+
     async def do_reload(self, interaction=None, channel=None):
         msg = []
         cogs_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cogs')
@@ -4,6 +4,7 @@ import asyncio
 from discord.ext import commands
 from discord import app_commands
 from dotenv import load_dotenv
+from utils.http_client import HttpClientRegistry
 
 # 載入 .env 設定 (Token)
 # 載入 .env 設定 (位於專案根目錄 servers/.env)
@@ -28,9 +29,17 @@ class MyBot(commands.Bot):
             intents=intents,
             help_command=commands.DefaultHelpCommand()
         )
+        # 全 Bot 共用的 HTTP 連線池 (各 cog 透過 self.bot.http_clients.session(用途) 取得)
+        self.http_clients = HttpClientRegistry(
+            limit=int(os.getenv('HTTP_POOL_LIMIT', '100')),
+            limit_per_host=int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '8'))
+        )
 
     async def setup_hook(self):
         """啟動時自動載入 cogs 資料夾內的 extensions"""
+
+        # 先建立共用 HTTP 連線池 (cogs 載入時就可能用到)
+        await self.http_clients.start()
         
         # 決定要載入哪些模組 (Split Architecture)
         mode = os.getenv('BOT_MODE', 'ALL').upper()
@@ -75,6 +84,11 @@ class MyBot(commands.Bot):
                 
         self.tree.on_error = on_tree_error
 
+    async def close(self):
+        # super().close() 會先卸載所有 cogs，之後才關閉共用連線池
+        await super().close()
+        await self.http_clients.close()
+
     async def on_ready(self):
         print(f'🤖 機器人已登入: {self.user} (ID: {self.user.id})')
         print(f'---------------------------------------------')
@@ -0,0 +1,46 @@
+"""
+memories.content_tsv 欄位遷移 (全文檢索索引)
+原本混合搜尋每次都對每一列重算 to_tsvector('simple', content) → 全文檢索部分只能循序掃描。
+改為 STORED 產生欄位 + GIN 索引，search_memory 直接比對 content_tsv。
+同時補上 facts(embedding) 的 HNSW 索引 (search_facts_by_topic 使用)。
+"""
+import asyncio
+import asyncpg
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+DB_URL = os.getenv("DATABASE_URL")
+
+async def update_schema():
+    if not DB_URL:
+        print("❌ DATABASE_URL 未設定。")
+        return
+    conn = await asyncpg.connect(DB_URL)
+    try:
+        print("🔨 Altering memories table (會重寫整張表，資料多時需要一點時間)...")
+        await conn.execute("""
+            ALTER TABLE memories
+            ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED;
+        """)
+        print("🔧 建立 GIN 索引...")
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_memories_content_tsv
+            ON memories USING gin (content_tsv);
+        """)
+        print("🔧 建立 facts 向量 HNSW 索引...")
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_facts_embedding_hnsw
+            ON facts USING hnsw (embedding vector_cosine_ops);
+        """)
+        await conn.execute("ANALYZE memories;")
+        await conn.execute("ANALYZE facts;")
+        print("✅ Column 'content_tsv' + indexes added successfully.")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(update_schema())
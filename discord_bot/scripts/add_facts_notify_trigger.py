@@ -0,0 +1,83 @@
+"""
+facts 變更通知 Trigger (Facts NOTIFY Trigger)
+建立 trigger，讓 facts 表的任何 INSERT / UPDATE / DELETE / TRUNCATE
+都透過 pg_notify('facts_changed', user_id) 通知 Bot，
+使 MemoryManager 的事實快取能即時失效 (包含 consolidate_facts.py、cleanup_db.py 等外部腳本的修改)。
+"""
+import asyncio
+import os
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+STATEMENTS = [
+    {
+        "desc": "建立 notify_facts_changed() 函式 (逐列)",
+        "sql": """
+            CREATE OR REPLACE FUNCTION notify_facts_changed() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM pg_notify('facts_changed', OLD.user_id);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM pg_notify('facts_changed', NEW.user_id);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """
+    },
+    {
+        "desc": "建立 notify_facts_truncated() 函式 (整表)",
+        "sql": """
+            CREATE OR REPLACE FUNCTION notify_facts_truncated() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('facts_changed', '*');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """
+    },
+    {
+        "desc": "掛載 trg_facts_notify (INSERT/UPDATE/DELETE)",
+        "sql": """
+            DROP TRIGGER IF EXISTS trg_facts_notify ON facts;
+            CREATE TRIGGER trg_facts_notify
+                AFTER INSERT OR UPDATE OR DELETE ON facts
+                FOR EACH ROW EXECUTE FUNCTION notify_facts_changed();
+        """
+    },
+    {
+        "desc": "掛載 trg_facts_truncate_notify (TRUNCATE)",
+        "sql": """
+            DROP TRIGGER IF EXISTS trg_facts_truncate_notify ON facts;
+            CREATE TRIGGER trg_facts_truncate_notify
+                AFTER TRUNCATE ON facts
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_facts_truncated();
+        """
+    },
+]
+
+async def migrate():
+    if not DATABASE_URL:
+        print("❌ DATABASE_URL 未設定。")
+        return
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        for stmt in STATEMENTS:
+            print(f"🔧 {stmt['desc']}...")
+            try:
+                await conn.execute(stmt["sql"])
+                print("  ✅ 完成")
+            except Exception as e:
+                print(f"  ❌ 失敗: {e}")
+    finally:
+        await conn.close()
+
+    print("\n✅ facts 變更通知設定完成！")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,36 @@
+"""
+image_memory.phash 欄位遷移 (感知雜湊)
+原本以 sha256(原始位元組) 判斷重複圖片，重新壓縮 / 縮放後就認不出來。
+新增 phash BIGINT (64-bit dHash)，MemoryManager 啟動時載入記憶體 BK-tree 做漢明距離查詢。
+舊資料沒有原始圖片可重算，phash 保持 NULL (只影響舊圖的近似比對)。
+"""
+import asyncio
+import asyncpg
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+DB_URL = os.getenv("DATABASE_URL")
+
+async def update_schema():
+    if not DB_URL:
+        print("❌ DATABASE_URL 未設定。")
+        return
+    conn = await asyncpg.connect(DB_URL)
+    try:
+        print("🔨 Altering image_memory table...")
+        await conn.execute("""
+            ALTER TABLE image_memory ADD COLUMN IF NOT EXISTS phash BIGINT;
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_image_memory_phash
+            ON image_memory (phash) WHERE phash IS NOT NULL;
+        """)
+        print("✅ Column 'phash' added successfully.")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(update_schema())
@@ -0,0 +1,43 @@
+"""
+memories.metadata_status 欄位遷移
+AI 標籤改為背景批次處理後，用此欄位記錄每筆記憶的標籤狀態：
+- pending: 已寫入，等待背景標籤
+- tagged:  已完成標籤
+- failed:  標籤失敗 (搜尋仍可正常使用，只是沒有 metadata)
+既有記憶一律標為 tagged (舊流程在寫入前就已標籤)。
+"""
+import asyncio
+import asyncpg
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+DB_URL = os.getenv("DATABASE_URL")
+
+async def update_schema():
+    if not DB_URL:
+        print("❌ DATABASE_URL 未設定。")
+        return
+    conn = await asyncpg.connect(DB_URL)
+    try:
+        print("🔨 Altering memories table...")
+        await conn.execute("""
+            ALTER TABLE memories
+            ADD COLUMN IF NOT EXISTS metadata_status TEXT NOT NULL DEFAULT 'tagged';
+        """)
+        # 新資料預設為 pending (由 MemoryManager 明確寫入，這裡只調整預設值)
+        await conn.execute("""
+            ALTER TABLE memories ALTER COLUMN metadata_status SET DEFAULT 'pending';
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_memories_metadata_pending
+            ON memories (id) WHERE metadata_status = 'pending';
+        """)
+        print("✅ Column 'metadata_status' added successfully.")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(update_schema())
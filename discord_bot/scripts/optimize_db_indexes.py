@@ -5,6 +5,8 @@
 2. knowledge(embedding) HNSW — 加速知識語意搜尋
 3. memories(embedding) HNSW — 加速記憶語意搜尋
 4. facts(user_id) — 加速事實查詢
+5. facts(embedding) HNSW — 加速跨使用者事實語意搜尋
+(memories.content_tsv 的 GIN 索引見 add_content_tsv_column.py，需先有該欄位)
 """
 import asyncio
 import os
@@ -35,6 +37,11 @@ INDEXES = [
         "sql": "CREATE INDEX IF NOT EXISTS idx_facts_user_id ON facts (user_id);",
         "desc": "facts 按使用者查詢索引"
     },
+    {
+        "name": "idx_facts_embedding_hnsw",
+        "sql": "CREATE INDEX IF NOT EXISTS idx_facts_embedding_hnsw ON facts USING hnsw (embedding vector_cosine_ops);",
+        "desc": "facts 向量 HNSW 索引"
+    },
 ]
 
 async def optimize():
@@ -0,0 +1,103 @@
+"""
+chat_history 月分區遷移 (Declarative Partitioning)
+chat_history 只增不減，全表排序 / 掃描會隨時間越來越慢。
+
+1. 舊表改名為 chat_history_legacy
+2. 建立新的 chat_history (PARTITION BY RANGE (timestamp))，依月份建立分區 (含往後 2 個月) + DEFAULT 分區
+3. 舊資料搬入新表 (沿用原本的 id 序號)
+4. (session_id, timestamp DESC) 索引建在父表上，自動套用到每個分區
+5. 新增 author 欄位 (每日統計的參與人數用) 與每日統計表 chat_history_daily
+
+之後的新月份分區由 MemoryManager (utils/chat_retention.py) 定期自動建立；
+過期分區由保留任務匯出成 .csv.gz 後 DETACH + DROP。
+確認資料無誤後可手動 DROP TABLE chat_history_legacy。
+"""
+import asyncio
+import asyncpg
+import datetime
+import os
+import sys
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.chat_retention import partition_name, month_start, add_months, ROLLUP_TABLE_SQL
+
+load_dotenv()
+DB_URL = os.getenv("DATABASE_URL")
+
+
+async def migrate():
+    if not DB_URL:
+        print("❌ DATABASE_URL 未設定。")
+        return
+    conn = await asyncpg.connect(DB_URL)
+    try:
+        partitioned = await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'chat_history'::regclass)"
+        )
+        if partitioned:
+            print("✅ chat_history 已是分區表，只補建統計表。")
+            await conn.execute(ROLLUP_TABLE_SQL)
+            return
+
+        first_ts = await conn.fetchval("SELECT MIN(timestamp) FROM chat_history")
+        total = await conn.fetchval("SELECT COUNT(*) FROM chat_history")
+        now = datetime.datetime.now(datetime.timezone.utc)
+        start = month_start(first_ts or now)
+        end = add_months(month_start(now), 3)
+        print(f"📦 chat_history: {total} 筆，分區範圍 {start:%Y-%m} ~ {add_months(end, -1):%Y-%m}")
+
+        async with conn.transaction():
+            print("🔨 [1/5] 舊表改名...")
+            await conn.execute("ALTER TABLE chat_history RENAME TO chat_history_legacy")
+            # id 序號改由新表使用 (舊表 DROP 時不會一起刪掉)
+            await conn.execute("ALTER SEQUENCE chat_history_id_seq OWNED BY NONE")
+            await conn.execute("ALTER INDEX IF EXISTS idx_chat_history_session_time RENAME TO idx_chat_history_legacy_session_time")
+
+            print("🔨 [2/5] 建立分區表...")
+            await conn.execute("""
+                CREATE TABLE chat_history (
+                    id BIGINT NOT NULL DEFAULT nextval('chat_history_id_seq'),
+                    session_id TEXT,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    author TEXT,
+                    timestamp TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (id, timestamp)
+                ) PARTITION BY RANGE (timestamp)
+            """)
+            await conn.execute("ALTER SEQUENCE chat_history_id_seq OWNED BY chat_history.id")
+            month = start
+            while month < end:
+                nxt = add_months(month, 1)
+                await conn.execute(f"""
+                    CREATE TABLE {partition_name(month)} PARTITION OF chat_history
+                    FOR VALUES FROM ('{month.isoformat()}') TO ('{nxt.isoformat()}')
+                """)
+                month = nxt
+            await conn.execute("CREATE TABLE chat_history_default PARTITION OF chat_history DEFAULT")
+
+            print("🔨 [3/5] 搬移資料...")
+            await conn.execute("""
+                INSERT INTO chat_history (id, session_id, role, content, timestamp)
+                SELECT id, session_id, role, content, COALESCE(timestamp, CURRENT_TIMESTAMP)
+                FROM chat_history_legacy
+            """)
+
+            print("🔨 [4/5] 建立索引...")
+            await conn.execute("""
+                CREATE INDEX idx_chat_history_session_time ON chat_history (session_id, timestamp DESC)
+            """)
+
+            print("🔨 [5/5] 建立每日統計表...")
+            await conn.execute(ROLLUP_TABLE_SQL)
+
+        moved = await conn.fetchval("SELECT COUNT(*) FROM chat_history")
+        print(f"✅ 遷移完成：{moved}/{total} 筆。確認無誤後可執行 DROP TABLE chat_history_legacy;")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
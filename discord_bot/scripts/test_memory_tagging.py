@@ -20,14 +20,16 @@ async def test_memory_tagging():
         return
 
     manager = MemoryManager(DATABASE_URL, GEMINI_API_KEY)
+    await manager.init_pool(min_size=1, max_size=2)
     
     test_content = "HiHi 覺得 Python 寫起來比 C++ 舒服多了，雖然效能差一點，但開發速度很快。"
     user_name = "TEST_USER_TAGGING"
     
     print(f"🔬 Testing AI Tagging with content: '{test_content}'")
     
-    # 1. Add Memory (Should trigger _analyze_content)
+    # 1. Add Memory (標籤由背景 MemoryTagger 批次補上，等待佇列處理完畢)
     await manager.add_memory(user_name, test_content, importance=5, type="test", metadata={"source": "script"})
+    await manager.tagger.flush()
     
     # 2. Verify Metadata from DB
     import asyncpg
@@ -51,5 +53,7 @@ async def test_memory_tagging():
     else:
         print("\n❌ FAILED: No metadata found.")
 
+    await manager.close_pool()
+
 if __name__ == "__main__":
     asyncio.run(test_memory_tagging())
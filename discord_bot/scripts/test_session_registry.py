@@ -0,0 +1,37 @@
+
+import os
+import sys
+
+# Ensure we can import from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.chat_session import SessionRegistry
+
+
+def test_evicts_idle_sessions():
+    registry = SessionRegistry(max_sessions=2)
+    registry.get(1)
+    registry.get(2)
+    registry.get(3)
+    assert [s.channel_id for s in registry.all()] == [2, 3]
+
+
+def test_all_busy_keeps_new_session():
+    # 其他 session 全都忙碌 → 新的 session 不能被自己淘汰掉 (曾經 KeyError)
+    registry = SessionRegistry(max_sessions=1)
+    registry.get(1).message_buffer.append("msg")
+    session = registry.get(2)
+    assert session.channel_id == 2
+    assert [s.channel_id for s in registry.all()] == [1, 2]
+
+    # 忙碌的 session 處理完後，下一次 get() 把超出的部分淘汰
+    registry.get(1).message_buffer.clear()
+    registry.get(2)
+    registry.get(3)
+    assert [s.channel_id for s in registry.all()] == [3]
+
+
+if __name__ == "__main__":
+    test_evicts_idle_sessions()
+    test_all_busy_keeps_new_session()
+    print("✅ SessionRegistry tests passed.")
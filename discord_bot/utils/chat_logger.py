@@ -0,0 +1,219 @@
+"""
+HiHi 聊天記錄寫入器 (Write-Behind Chat Logger)
+聊天記錄先進記憶體緩衝，背景批次寫入 chat_history
+
+功能：
+- 延後寫入 (Write-Behind) — log_chat / log_chats 只排入緩衝，不佔用回覆流程的 DB 連線
+- 批次 COPY — 累積 flush_rows 筆或 flush_interval 秒後以 copy_records_to_table 一次寫入
+- 時間戳記在排入時決定 — 批次延遲不影響 chat_history 的排序
+- 磁碟日誌 (Journal) — DB 暫時無法寫入時改寫 JSONL 檔 (有大小上限)，恢復後自動重送
+- 關閉時清空 — Bot 關閉前把緩衝寫完 (寫不進 DB 就寫入日誌，下次啟動重送)
+"""
+
+import os
+import json
+import time
+import asyncio
+import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'hihi', 'chat_log_journal.jsonl')
+
+# (role, content, session_id, author, timestamp)
+ChatRow = Tuple[str, str, str, Optional[str], datetime.datetime]
+
+
+class ChatLogWriter:
+    def __init__(self, journal_path: str = DEFAULT_JOURNAL_PATH, flush_rows: int = 100,
+                 flush_interval: float = 0.5, max_buffer: int = 5000,
+                 journal_max_bytes: int = 16 * 1024 * 1024, retry_interval: float = 10.0):
+        """
+        flush_rows / flush_interval: 累積幾筆或幾秒後寫入
+        max_buffer: 記憶體緩衝上限 (DB 卡住時超過的部分直接寫入日誌)
+        journal_max_bytes: 日誌檔上限 (超過時丟棄新資料並計數)
+        retry_interval: DB 寫入失敗後，多久再試一次 (期間新資料直接進日誌)
+        """
+        self.journal_path = journal_path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.journal_max_bytes = journal_max_bytes
+        self.retry_interval = retry_interval
+
+        self.pool = None
+        self.with_author = False
+        self._buffer: List[ChatRow] = []
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._retry_at = 0.0  # DB 故障期間：此時間前不嘗試寫 DB
+        self._replay_at = 0.0  # 日誌重送失敗後，此時間前不再重送 (不影響新資料寫入)
+
+        self.stats = {
+            "queued": 0, "written": 0, "flushes": 0, "max_batch": 0, "errors": 0,
+            "journaled": 0, "replayed": 0, "dropped": 0,
+        }
+
+    # =========================================================================
+    # 🔌 生命週期
+    # =========================================================================
+
+    def start(self, pool, with_author: bool = False):
+        """with_author: chat_history 是否已有 author 欄位 (scripts/partition_chat_history.py)"""
+        self.pool = pool
+        self.with_author = with_author
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        # 最後一次寫入 (失敗就留在日誌，下次啟動重送)
+        self._retry_at = 0.0
+        self._replay_at = 0.0
+        await self.flush()
+        if self.stats["written"] or self.stats["journaled"]:
+            print(f"📝 [ChatLog] 寫入器已關閉 (寫入 {self.stats['written']} 筆，日誌 {self.stats['journaled']} 筆)")
+
+    # =========================================================================
+    # 📥 排入
+    # =========================================================================
+
+    def write(self, messages: List[Dict[str, Any]], session_id: str):
+        """排入聊天記錄 (同步、不等待 DB)"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for i, m in enumerate(messages):
+            # 同一批內保留先後順序 (timestamp 相同時 ORDER BY 不穩定)
+            ts = now + datetime.timedelta(microseconds=i)
+            self._buffer.append((m["role"], m["content"], session_id, m.get("author"), ts))
+        self.stats["queued"] += len(messages)
+        if len(self._buffer) >= self.flush_rows:
+            self._wakeup.set()
+
+    async def flush(self):
+        """立即寫出緩衝 (DB 失敗時寫入日誌)"""
+        async with self._lock:
+            # 先重送日誌 (較舊的資料)，再寫新資料
+            now = time.monotonic()
+            if self._journal_pending() and now >= self._retry_at and now >= self._replay_at:
+                await self._replay_journal()
+
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            if time.monotonic() < self._retry_at or self.pool is None:
+                self._append_journal(batch)
+                return
+            try:
+                await self._copy(batch)
+                self.stats["flushes"] += 1
+                self.stats["written"] += len(batch)
+                self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            except Exception as e:
+                self.stats["errors"] += 1
+                self._retry_at = time.monotonic() + self.retry_interval
+                print(f"⚠️ [ChatLog] 寫入 DB 失敗，{len(batch)} 筆改寫入日誌: {e}")
+                self._append_journal(batch)
+
+    # =========================================================================
+    # ⚙️ 內部
+    # =========================================================================
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ [ChatLog] 寫入迴圈錯誤: {e}")
+            # DB 卡住 → 緩衝過大的部分先落地，避免記憶體無限成長
+            if len(self._buffer) > self.max_buffer:
+                overflow, self._buffer = self._buffer, []
+                self._append_journal(overflow)
+
+    async def _copy(self, rows: List[ChatRow]):
+        async with self.pool.acquire() as conn:
+            if self.with_author:
+                await conn.copy_records_to_table(
+                    "chat_history", records=rows,
+                    columns=["role", "content", "session_id", "author", "timestamp"]
+                )
+            else:
+                await conn.copy_records_to_table(
+                    "chat_history", records=[(r[0], r[1], r[2], r[4]) for r in rows],
+                    columns=["role", "content", "session_id", "timestamp"]
+                )
+
+    def _append_journal(self, rows: List[ChatRow]):
+        try:
+            size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            lines = []
+            for role, content, session_id, author, ts in rows:
+                line = json.dumps({"role": role, "content": content, "session_id": session_id,
+                                   "author": author, "timestamp": ts.isoformat()}, ensure_ascii=False) + "\n"
+                size += len(line.encode('utf-8'))
+                if size > self.journal_max_bytes:
+                    break
+                lines.append(line)
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+            self.stats["journaled"] += len(lines)
+            if len(lines) < len(rows):
+                self.stats["dropped"] += len(rows) - len(lines)
+                print(f"⚠️ [ChatLog] 日誌已滿 ({self.journal_max_bytes // 1024} KB)，丟棄 {len(rows) - len(lines)} 筆")
+        except OSError as e:
+            self.stats["dropped"] += len(rows)
+            print(f"❌ [ChatLog] 日誌寫入失敗，丟棄 {len(rows)} 筆: {e}")
+
+    async def _replay_journal(self):
+        if self.pool is None:
+            return
+        # 先改名再讀：重送途中又失敗時，新的失敗資料會寫進新的日誌檔
+        replay_path = self.journal_path + ".replay"
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.journal_path):
+                return
+            os.replace(self.journal_path, replay_path)
+
+        rows: List[ChatRow] = []
+        with open(replay_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    d = json.loads(line)
+                    rows.append((d["role"], d["content"], d["session_id"], d.get("author"),
+                                 datetime.datetime.fromisoformat(d["timestamp"])))
+                except (ValueError, KeyError):
+                    continue  # 關閉途中被截斷的最後一行
+
+        try:
+            await self._copy(rows)  # 單一 COPY：失敗時整批不寫入，重試不會重複
+        except Exception as e:
+            self.stats["errors"] += 1
+            self._replay_at = time.monotonic() + self.retry_interval
+            print(f"⚠️ [ChatLog] 日誌重送失敗，稍後再試: {e}")
+            return
+        os.remove(replay_path)
+        if os.path.exists(self.journal_path):
+            os.replace(self.journal_path, replay_path)  # 重送期間新增的日誌留到下一輪
+        self.stats["replayed"] += len(rows)
+        print(f"📝 [ChatLog] 已重送日誌 {len(rows)} 筆")
+
+    def _journal_pending(self) -> bool:
+        return os.path.exists(self.journal_path) or os.path.exists(self.journal_path + ".replay")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["buffered"] = len(self._buffer)
+        stats["journal_pending"] = self._journal_pending()
+        stats["degraded"] = time.monotonic() < self._retry_at
+        return stats
@@ -0,0 +1,240 @@
+"""
+HiHi 聊天記錄保留 (Chat History Retention)
+chat_history 依月份分區，舊分區匯出封存，每日統計另存一張小表
+
+功能：
+- 分區維護 — 自動建立本月 + 往後 months_ahead 個月的分區 (遷移見 scripts/partition_chat_history.py)
+- 每日統計 (Rollup) — 每天 × 每個 session 的訊息數、使用者 / 模型訊息數、參與者 (chat_history_daily)
+- 保留期限 — 超過 retention_months 的分區：先補統計 → 匯出 .csv.gz → DETACH → DROP
+- 未遷移的舊表 (非分區表) 只做每日統計，不做分區與封存
+"""
+
+import os
+import gzip
+import datetime
+from typing import List, Dict, Any, Optional
+
+# 每日統計以台灣時間切日 (與 Bot 顯示的時間一致)
+ROLLUP_TIMEZONE = "Asia/Taipei"
+_LOCAL_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'hihi', 'chat_archive')
+
+ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS chat_history_daily (
+        day DATE NOT NULL,
+        session_id TEXT NOT NULL,
+        messages INT NOT NULL,
+        user_messages INT NOT NULL,
+        model_messages INT NOT NULL,
+        participants TEXT[] NOT NULL DEFAULT '{}',
+        first_at TIMESTAMPTZ,
+        last_at TIMESTAMPTZ,
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (day, session_id)
+    );
+"""
+
+# $1, $2 = 時間範圍 [from, to)；{conflict} = DO UPDATE (重算) 或 DO NOTHING (只補缺)
+_ROLLUP_SQL = """
+    INSERT INTO chat_history_daily
+        (day, session_id, messages, user_messages, model_messages, participants, first_at, last_at)
+    SELECT (timestamp AT TIME ZONE '{tz}')::date AS day,
+           COALESCE(session_id, 'global'),
+           COUNT(*),
+           COUNT(*) FILTER (WHERE role = 'user'),
+           COUNT(*) FILTER (WHERE role = 'model'),
+           {participants},
+           MIN(timestamp), MAX(timestamp)
+    FROM chat_history
+    WHERE timestamp >= $1 AND timestamp < $2
+    GROUP BY 1, 2
+    ON CONFLICT (day, session_id) {conflict}
+"""
+_ROLLUP_UPDATE = """DO UPDATE SET
+        messages = EXCLUDED.messages,
+        user_messages = EXCLUDED.user_messages,
+        model_messages = EXCLUDED.model_messages,
+        participants = EXCLUDED.participants,
+        first_at = EXCLUDED.first_at,
+        last_at = EXCLUDED.last_at,
+        updated_at = CURRENT_TIMESTAMP"""
+
+
+def month_start(ts: datetime.datetime) -> datetime.datetime:
+    """該時間所在月份的第一天 00:00 (UTC)"""
+    ts = ts.astimezone(datetime.timezone.utc)
+    return datetime.datetime(ts.year, ts.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(month: datetime.datetime, n: int) -> datetime.datetime:
+    index = month.year * 12 + (month.month - 1) + n
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def partition_name(month: datetime.datetime) -> str:
+    return f"chat_history_p{month:%Y%m}"
+
+
+def _parse_partition(name: str) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.strptime(name[len("chat_history_p"):], "%Y%m").replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        return None
+
+
+def _local_day_start(ts: datetime.datetime, round_up: bool = False) -> datetime.datetime:
+    local = ts.astimezone(_LOCAL_TZ)
+    start = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    if round_up and start < local:
+        start += datetime.timedelta(days=1)
+    return start
+
+
+class ChatRetention:
+    def __init__(self, retention_months: int = 0, archive_dir: str = DEFAULT_ARCHIVE_DIR,
+                 months_ahead: int = 2, rollup_days: int = 2):
+        """
+        retention_months: 保留幾個完整月份 (0 = 不封存)
+        archive_dir: 匯出的 .csv.gz 存放位置
+        rollup_days: 每次維護重算最近幾天的統計
+        """
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir
+        self.months_ahead = months_ahead
+        self.rollup_days = rollup_days
+
+        self.partitioned = False
+        self.has_author = False
+        self.has_rollup = False
+        self.stats: Dict[str, Any] = {"runs": 0, "partitions_created": 0, "archived": [], "rollup_rows": 0, "last_run": None}
+
+    # =========================================================================
+    # 🔍 偵測
+    # =========================================================================
+
+    async def detect(self, conn):
+        """啟動時檢查 chat_history 是否已遷移 (分區表 / author 欄位 / 統計表)"""
+        self.partitioned = await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('chat_history')
+            )
+        """)
+        self.has_author = await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'chat_history' AND column_name = 'author'
+            )
+        """)
+        self.has_rollup = await conn.fetchval("SELECT to_regclass('chat_history_daily') IS NOT NULL")
+        if not self.partitioned:
+            print("ℹ️ [ChatLog] chat_history 尚未分區 (可執行 scripts/partition_chat_history.py)")
+
+    # =========================================================================
+    # 🧹 維護
+    # =========================================================================
+
+    async def run(self, pool) -> Dict[str, Any]:
+        """建立分區 → 重算最近幾天統計 → 封存過期分區"""
+        result = {"created": [], "rollup_rows": 0, "archived": []}
+        async with pool.acquire() as conn:
+            if self.partitioned:
+                result["created"] = await self.ensure_partitions(conn)
+            if self.has_rollup:
+                now = datetime.datetime.now(datetime.timezone.utc)
+                since = _local_day_start(now - datetime.timedelta(days=self.rollup_days))
+                result["rollup_rows"] = await self.rollup(conn, since, now + datetime.timedelta(seconds=1))
+            if self.partitioned and self.retention_months > 0:
+                result["archived"] = await self.archive_expired(conn)
+
+        self.stats["runs"] += 1
+        self.stats["partitions_created"] += len(result["created"])
+        self.stats["rollup_rows"] = result["rollup_rows"]
+        self.stats["archived"].extend(result["archived"])
+        self.stats["last_run"] = datetime.datetime.now(datetime.timezone.utc)
+        return result
+
+    async def ensure_partitions(self, conn) -> List[str]:
+        existing = set(await self._list_partitions(conn))
+        created = []
+        month = month_start(datetime.datetime.now(datetime.timezone.utc))
+        for _ in range(self.months_ahead + 1):
+            name = partition_name(month)
+            if name not in existing:
+                nxt = add_months(month, 1)
+                try:
+                    await conn.execute(f"""
+                        CREATE TABLE IF NOT EXISTS {name} PARTITION OF chat_history
+                        FOR VALUES FROM ('{month.isoformat()}') TO ('{nxt.isoformat()}')
+                    """)
+                    created.append(name)
+                    print(f"🗂️ [ChatLog] 已建立分區 {name}")
+                except Exception as e:
+                    # 例如 DEFAULT 分區已有該月份的資料
+                    print(f"⚠️ [ChatLog] 建立分區 {name} 失敗: {e}")
+            month = add_months(month, 1)
+        return created
+
+    async def rollup(self, conn, start: datetime.datetime, end: datetime.datetime, overwrite: bool = True) -> int:
+        """
+        重算 [start, end) 的每日統計。overwrite=False 時只補沒有的日期
+        (封存前用：邊界那天的部分資料可能已在更早的分區被封存)。
+        """
+        participants = ("COALESCE(array_agg(DISTINCT author) FILTER (WHERE author IS NOT NULL), '{}')"
+                        if self.has_author else "'{}'::text[]")
+        sql = _ROLLUP_SQL.format(tz=ROLLUP_TIMEZONE, participants=participants,
+                                 conflict=_ROLLUP_UPDATE if overwrite else "DO NOTHING")
+        status = await conn.execute(sql, start, end)
+        return int(status.split()[-1])
+
+    async def archive_expired(self, conn) -> List[str]:
+        cutoff = add_months(month_start(datetime.datetime.now(datetime.timezone.utc)), -self.retention_months)
+        archived = []
+        for name in sorted(await self._list_partitions(conn)):
+            month = _parse_partition(name)
+            if month is None or add_months(month, 1) > cutoff:
+                continue
+            try:
+                await self._archive_partition(conn, name, month)
+                archived.append(name)
+            except Exception as e:
+                print(f"❌ [ChatLog] 封存分區 {name} 失敗: {e}")
+                break  # 由舊到新依序封存，失敗就停下，避免留下缺口
+        return archived
+
+    async def _archive_partition(self, conn, name: str, month: datetime.datetime):
+        if self.has_rollup:
+            await self.rollup(conn, _local_day_start(month, round_up=True),
+                              _local_day_start(add_months(month, 1), round_up=True), overwrite=False)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+        tmp_path = path + ".tmp"
+        expected = await conn.fetchval(f"SELECT COUNT(*) FROM {name}")
+        with gzip.open(tmp_path, "wb") as f:
+            status = await conn.copy_from_table(name, output=f, format="csv", header=True)
+        copied = int(status.split()[-1])
+        if copied != expected:
+            os.remove(tmp_path)
+            raise RuntimeError(f"匯出筆數不符 ({copied}/{expected})")
+        os.replace(tmp_path, path)
+
+        async with conn.transaction():
+            await conn.execute(f"ALTER TABLE chat_history DETACH PARTITION {name}")
+            await conn.execute(f"DROP TABLE {name}")
+        print(f"📦 [ChatLog] 已封存 {name} ({copied} 筆) → {path}")
+
+    async def _list_partitions(self, conn) -> List[str]:
+        rows = await conn.fetch("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'chat_history'::regclass
+        """)
+        return [r['relname'] for r in rows if r['relname'].startswith("chat_history_p")]
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["archived"] = list(self.stats["archived"])
+        stats["partitioned"] = self.partitioned
+        stats["retention_months"] = self.retention_months
+        return stats
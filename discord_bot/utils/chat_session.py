@@ -0,0 +1,103 @@
+"""
+HiHi 頻道對話狀態 (Chat Sessions)
+每個頻道一份獨立的短期記憶
+
+功能：
+- ChatSession — 單一頻道的 history (TokenHistory)、debounce buffer、回覆 task、token 預算
+- SessionRegistry — 以 channel_id 取得 session，閒置的 session 依 LRU 淘汰
+- 延遲載入 (Lazy Load) — 第一次用到時才從 chat_history (session_id = discord_{channel.id}) 讀取歷史
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+from utils.token_counter import TokenHistory
+
+
+class ChatSession:
+    def __init__(self, channel_id: int, token_limit: int = 8000):
+        self.channel_id = channel_id
+        self.session_id = f"discord_{channel_id}"  # 與 chat_history.session_id 一致
+        self.token_limit = token_limit
+
+        self.history = TokenHistory()
+        self.message_buffer: list = []  # list[discord.Message]
+        self.response_task: Optional[asyncio.Task] = None
+
+        self.last_active = time.monotonic()
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def is_busy(self) -> bool:
+        """還有待處理的訊息或正在回覆中 → 不能被淘汰"""
+        return bool(self.message_buffer) or (self.response_task is not None and not self.response_task.done())
+
+    async def ensure_loaded(self, loader: Callable[[str], Awaitable[List[Dict[str, Any]]]]):
+        """
+        第一次使用時從資料庫載入近期對話。
+        loader(session_id) 需回傳 Gemini 格式的 history list。
+        """
+        if self.loaded:
+            return
+        async with self._load_lock:
+            if self.loaded:
+                return
+            try:
+                loaded = await loader(self.session_id)
+                # 載入期間若已有新對話，保留在後面
+                self.history.insert_front(loaded or [])
+            except Exception as e:
+                print(f"⚠️ [Session] {self.session_id} 載入歷史失敗: {e}")
+            self.loaded = True
+
+    def cancel(self):
+        if self.response_task and not self.response_task.done():
+            self.response_task.cancel()
+
+
+class SessionRegistry:
+    def __init__(self, max_sessions: int = 20, token_limit: int = 8000):
+        self.max_sessions = max_sessions
+        self.token_limit = token_limit
+        self._sessions: "OrderedDict[int, ChatSession]" = OrderedDict()
+
+    def get(self, channel_id: int) -> ChatSession:
+        """取得 (或建立) 頻道的 session，並標記為最近使用"""
+        session = self._sessions.get(channel_id)
+        if session is None:
+            session = ChatSession(channel_id, token_limit=self.token_limit)
+            self._sessions[channel_id] = session
+            self._evict(keep=channel_id)
+        self._sessions.move_to_end(channel_id)
+        session.touch()
+        return session
+
+    def _evict(self, keep: Optional[int] = None):
+        """
+        超過上限時，從最久沒用的開始淘汰閒置 session (忙碌中的與 keep 跳過)。
+        其他 session 全都忙碌時暫時超出上限，之後的 get() 再淘汰。
+        """
+        if len(self._sessions) <= self.max_sessions:
+            return
+        for channel_id in list(self._sessions.keys()):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            session = self._sessions[channel_id]
+            if channel_id == keep or session.is_busy():
+                continue
+            del self._sessions[channel_id]
+            print(f"🧹 [Session] 淘汰閒置頻道 {channel_id} (history {len(session.history)} 則)")
+
+    def all(self) -> List[ChatSession]:
+        return list(self._sessions.values())
+
+    def cancel_all(self):
+        for session in self._sessions.values():
+            session.cancel()
+
+    def __len__(self):
+        return len(self._sessions)
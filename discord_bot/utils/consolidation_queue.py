@@ -0,0 +1,125 @@
+"""
+HiHi 背景整合佇列 (Consolidation Queue)
+把「情節記憶整合」移出回覆流程
+
+功能：
+- 背景工作佇列 — 回覆結束前只需排入工作，摘要與寫入記憶在背景完成
+- 併發上限 — 同時最多 N 個整合工作 (避免搶佔模型配額)
+- 重試 — 失敗時指數退避重試
+- 冪等鍵 (Idempotency Key) — 相同內容的整合只會執行一次
+- 關機排空 (Drain) — cog_unload 時等待剩餘工作完成
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+
+class ConsolidationQueue:
+    def __init__(self, handler: Callable[[Dict[str, Any]], Awaitable[bool]], concurrency: int = 2,
+                 max_retries: int = 3, retry_base_delay: float = 2.0, max_pending: int = 100):
+        """
+        handler(payload) -> bool：回傳 True 代表成功；回傳 False 或拋出例外則重試
+        """
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.max_pending = max_pending
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list = []
+        self._keys_pending: set = set()
+        self._keys_done: "OrderedDict[str, float]" = OrderedDict()  # 近期完成的 key (防止重複整合)
+        self._closing = False
+
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "retries": 0, "duplicates": 0, "dropped": 0, "running": 0}
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.concurrency:
+            self._workers.append(asyncio.create_task(self._worker_loop()))
+
+    def submit(self, key: str, payload: Dict[str, Any]) -> bool:
+        """
+        排入整合工作。相同 key 已在排隊或近期已完成時略過。
+        回傳是否成功排入。
+        """
+        if self._closing:
+            print(f"⚠️ [Consolidation] 關機中，拒絕新工作 {key[:8]}")
+            return False
+        if key in self._keys_pending or key in self._keys_done:
+            self.stats["duplicates"] += 1
+            return False
+        if len(self._keys_pending) >= self.max_pending:
+            self.stats["dropped"] += 1
+            print(f"⚠️ [Consolidation] 佇列已滿 ({self.max_pending})，丟棄工作 {key[:8]}")
+            return False
+
+        self._ensure_workers()
+        self._keys_pending.add(key)
+        self._queue.put_nowait((key, payload))
+        self.stats["submitted"] += 1
+        return True
+
+    @property
+    def pending(self) -> int:
+        """排隊中 + 執行中的工作數"""
+        return len(self._keys_pending)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["pending"] = self.pending
+        return stats
+
+    async def drain(self, timeout: float = 60.0):
+        """
+        停止接收新工作，等待剩餘工作完成 (最多 timeout 秒)，然後停止 worker。
+        """
+        self._closing = True
+        if self._queue is not None and self.pending:
+            print(f"⏳ [Consolidation] 等待 {self.pending} 個整合工作完成...")
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️ [Consolidation] 排空逾時，放棄 {self.pending} 個工作")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker_loop(self):
+        while True:
+            key, payload = await self._queue.get()
+            self.stats["running"] += 1
+            try:
+                await self._run_with_retry(key, payload)
+            finally:
+                self.stats["running"] -= 1
+                self._keys_pending.discard(key)
+                self._queue.task_done()
+
+    async def _run_with_retry(self, key: str, payload: Dict[str, Any]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if await self.handler(payload):
+                    self.stats["completed"] += 1
+                    self._keys_done[key] = time.time()
+                    while len(self._keys_done) > 500:
+                        self._keys_done.popitem(last=False)
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ [Consolidation] 工作 {key[:8]} 失敗 (第 {attempt + 1} 次): {e}")
+
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.retry_base_delay * (2 ** attempt))
+
+        self.stats["failed"] += 1
+        print(f"❌ [Consolidation] 工作 {key[:8]} 重試 {self.max_retries} 次後放棄")
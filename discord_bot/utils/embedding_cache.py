@@ -0,0 +1,190 @@
+"""
+HiHi Embedding 快取 (Embedding Cache)
+內容定址 (Content-Addressed) 雙層快取
+
+功能：
+- Key = (model, task_type, dimensionality, sha256(text))
+- 第一層：程序內 LRU (OrderedDict) — 微秒級命中
+- 第二層：本機 SQLite 檔案 — 跨重啟、跨腳本共用 (consolidate_facts.py 等)
+- TTL 過期 + 筆數上限淘汰 (最舊的先刪)
+- 命中率統計 (memory / disk / miss)
+"""
+
+import os
+import time
+import array
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+# 預設快取檔案位置 (可用 EMBEDDING_CACHE_PATH 覆寫，設為空字串則停用磁碟層)
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'hihi', 'embedding_cache.db')
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: Optional[str] = DEFAULT_CACHE_PATH, max_items: int = 2048,
+                 ttl_seconds: int = 30 * 86400, max_rows: int = 200000):
+        """
+        db_path: SQLite 檔案路徑 (None 或空字串 = 只用記憶體層)
+        max_items: 記憶體 LRU 最大筆數
+        ttl_seconds: 向量有效期限 (模型更新後舊向量會自然淘汰)
+        max_rows: 磁碟層最大筆數，超過時刪除最舊的
+        """
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created_at, vector)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._puts_since_prune = 0
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS embedding_cache (
+                        key TEXT PRIMARY KEY,
+                        vector BLOB NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_created ON embedding_cache (created_at)")
+                self._db.commit()
+                self._prune_db()
+            except Exception as e:
+                print(f"⚠️ [EmbeddingCache] 磁碟快取無法開啟，改用純記憶體模式: {e}")
+                self._db = None
+
+    @staticmethod
+    def make_key(model: str, task_type: str, dimensionality: int, text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{model}|{task_type}|{dimensionality}|{digest}"
+
+    # =========================================================================
+    # 🔍 讀取 / 寫入
+    # =========================================================================
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        """
+        依序查詢記憶體層 → 磁碟層。未命中或過期回傳 None。
+        """
+        now = time.time()
+
+        # 1. 記憶體 LRU
+        entry = self._lru.get(key)
+        if entry is not None:
+            created_at, vector = entry
+            if now - created_at < self.ttl_seconds:
+                self._lru.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return vector
+            del self._lru[key]
+
+        # 2. SQLite
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key)
+            if row is not None:
+                created_at, vector = row
+                if now - created_at < self.ttl_seconds:
+                    self._remember(key, created_at, vector)
+                    self.stats["disk_hits"] += 1
+                    return vector
+
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key: str, vector: List[float]):
+        if not vector:
+            return
+        now = time.time()
+        self._remember(key, now, list(vector))
+        self.stats["writes"] += 1
+
+        if self._db is not None:
+            await asyncio.to_thread(self._db_put, key, vector, now)
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["memory_size"] = len(self._lru)
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    # =========================================================================
+    # ⚙️ 內部實作
+    # =========================================================================
+
+    def _remember(self, key: str, created_at: float, vector: List[float]):
+        self._lru[key] = (created_at, vector)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _db_get(self, key: str):
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT created_at, vector FROM embedding_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], array.array('f', row[1]).tolist()
+
+    def _db_put(self, key: str, vector: List[float], created_at: float):
+        blob = array.array('f', vector).tobytes()  # float32，768 維約 3 KB
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embedding_cache (key, vector, created_at) VALUES (?, ?, ?)",
+                    (key, blob, created_at)
+                )
+                self._db.commit()
+            except Exception as e:
+                print(f"⚠️ [EmbeddingCache] 寫入失敗: {e}")
+                return
+
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= 500:
+            self._prune_db()
+
+    def _prune_db(self):
+        """刪除過期向量，並把總筆數壓回 max_rows 以內"""
+        self._puts_since_prune = 0
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                cur = self._db.execute(
+                    "DELETE FROM embedding_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+                )
+                expired = cur.rowcount
+                cur = self._db.execute("""
+                    DELETE FROM embedding_cache WHERE key IN (
+                        SELECT key FROM embedding_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_rows,))
+                self._db.commit()
+                removed = expired + max(cur.rowcount, 0)
+                if removed > 0:
+                    self.stats["evictions"] += removed
+                    print(f"🧹 [EmbeddingCache] 已淘汰 {removed} 筆舊向量")
+            except Exception as e:
+                print(f"⚠️ [EmbeddingCache] 清理失敗: {e}")
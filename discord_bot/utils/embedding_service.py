@@ -0,0 +1,201 @@
+"""
+HiHi Embedding 服務 (Embedding Service)
+批次化 + 非阻塞版
+
+功能：
+- 請求佇列 (asyncio.Queue) — 所有 embedding 請求先排隊
+- 微批次 (Micro-Batching) — 在短時間窗口內把多個請求合併成一次 embed_content 呼叫
+- 非阻塞 (Off-Loop) — 同步 SDK 呼叫丟到執行緒，不再卡住 discord.py 事件迴圈
+- 快取 (Cache) — 可選的 EmbeddingCache，相同文字不重複呼叫 API
+- 統計 (Metrics) — 佇列深度、批次大小、API 呼叫次數
+"""
+
+import asyncio
+import time
+from google.genai import types
+from typing import List, Dict, Any, Optional, Tuple
+
+
+class EmbeddingService:
+    def __init__(self, client, model: str = "gemini-embedding-001", dimensionality: int = 768,
+                 batch_window: float = 0.02, max_batch_size: int = 64, cache=None):
+        """
+        client: google.genai.Client
+        cache: EmbeddingCache (可選)
+        batch_window: 收到第一個請求後，等待其他請求加入同一批的秒數
+        max_batch_size: 單次 embed_content 最多送出的文字數量
+        """
+        self.client = client
+        self.model = model
+        self.dimensionality = dimensionality
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.cache = cache
+
+        # 進行中的請求 (相同 key 同時查詢時只送一次)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # 佇列與背景工作 (第一次呼叫 embed 時才建立，確保綁定正確的事件迴圈)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # 統計數據
+        self.stats = {
+            "requests": 0,        # 總請求文字數
+            "batches": 0,         # 實際 API 呼叫次數
+            "errors": 0,          # 失敗的 API 呼叫次數
+            "max_batch_size": 0,  # 歷史最大批次
+            "last_batch_size": 0,
+            "last_latency_ms": 0.0,
+        }
+
+    # =========================================================================
+    # 🔌 生命週期 (Lifecycle)
+    # =========================================================================
+
+    def _ensure_worker(self):
+        """確保背景批次工作已啟動"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._batch_loop())
+
+    async def close(self):
+        """
+        停止背景工作。尚未處理的請求會收到空向量。
+        """
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        if self.cache:
+            self.cache.close()
+
+        if self._queue:
+            while not self._queue.empty():
+                _, _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_result([])
+
+    # =========================================================================
+    # 🧬 對外介面 (Public API)
+    # =========================================================================
+
+    async def embed(self, text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> List[float]:
+        """
+        取得單一文字的向量。實際會與同時間的其他請求合併送出。
+        失敗時回傳空 list。
+        """
+        if self.cache is None:
+            return await self._enqueue(text, task_type)
+
+        key = self.cache.make_key(self.model, task_type, self.dimensionality, text)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # 相同文字正在查詢中 → 共用同一個結果
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = asyncio.ensure_future(self._enqueue(text, task_type))
+        self._inflight[key] = pending
+        try:
+            vector = await asyncio.shield(pending)
+        finally:
+            if pending.done():
+                self._inflight.pop(key, None)
+            else:
+                pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        if vector:
+            await self.cache.put(key, vector)
+        return vector
+
+    async def _enqueue(self, text: str, task_type: str) -> List[float]:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, task_type, future))
+        return await future
+
+    async def embed_many(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+        """
+        一次取得多筆文字的向量 (保持輸入順序)。
+        """
+        return list(await asyncio.gather(*[self.embed(t, task_type) for t in texts]))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        回傳統計數據 (含目前佇列深度與平均批次大小)。
+        """
+        stats = dict(self.stats)
+        stats["queue_depth"] = self._queue.qsize() if self._queue else 0
+        stats["avg_batch_size"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        if self.cache:
+            stats["cache"] = self.cache.get_stats()
+        return stats
+
+    # =========================================================================
+    # ⚙️ 批次處理 (Batch Worker)
+    # =========================================================================
+
+    async def _batch_loop(self):
+        while True:
+            # 1. 等待第一個請求
+            first = await self._queue.get()
+            batch: List[Tuple[str, str, asyncio.Future]] = [first]
+
+            # 2. 在時間窗口內收集更多請求
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # 3. 依 task_type 分組 (同一次 API 呼叫只能用一種設定)
+            groups: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+            for text, task_type, future in batch:
+                groups.setdefault(task_type, []).append((text, future))
+
+            for task_type, items in groups.items():
+                await self._run_group(task_type, items)
+
+    async def _run_group(self, task_type: str, items: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in items]
+        start = time.perf_counter()
+        try:
+            # 同步 SDK 呼叫移到執行緒，避免阻塞事件迴圈
+            response = await asyncio.to_thread(
+                self.client.models.embed_content,
+                model=self.model,
+                contents=texts,
+                config=types.EmbedContentConfig(
+                    task_type=task_type,
+                    output_dimensionality=self.dimensionality
+                )
+            )
+            vectors = [e.values for e in response.embeddings]
+        except Exception as e:
+            print(f"❌ [Embedding] 批次錯誤 ({len(texts)} 筆): {e}")
+            self.stats["errors"] += 1
+            vectors = []
+
+        self.stats["requests"] += len(items)
+        self.stats["batches"] += 1
+        self.stats["last_batch_size"] = len(items)
+        self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(items))
+        self.stats["last_latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        for i, (_, future) in enumerate(items):
+            if future.done():
+                continue  # 呼叫端已取消
+            future.set_result(vectors[i] if i < len(vectors) else [])
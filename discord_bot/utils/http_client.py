@@ -0,0 +1,121 @@
+"""
+HiHi 共用 HTTP 連線 (HTTP Client Registry)
+整個 Bot 共用一個連線池，取代各 cog 每次請求都新開 aiohttp.ClientSession
+
+功能：
+- 共用 TCPConnector — 總連線上限 + 每台主機上限、Keep-Alive、DNS 快取
+- 用途設定檔 (Timeout Profile) — 每種用途一個 ClientSession，各自的逾時設定
+- 連線重用統計 — 透過 aiohttp TraceConfig 記錄新建 / 重用連線與 DNS 快取命中
+- 生命週期 — MyBot.setup_hook 建立，Bot 關閉時一起關閉
+"""
+
+import aiohttp
+from typing import Dict, Any, Optional
+
+# 用途 → 逾時設定 (秒)
+TIMEOUT_PROFILES: Dict[str, aiohttp.ClientTimeout] = {
+    "default": aiohttp.ClientTimeout(total=15, connect=5),
+    "agent": aiohttp.ClientTimeout(total=5, connect=2),          # VM2 Agent API (區網)
+    "web_preview": aiohttp.ClientTimeout(total=8, connect=3, sock_read=5),  # 網頁預覽
+    "media": aiohttp.ClientTimeout(total=30, connect=5),         # 圖片 / 貼圖下載
+}
+
+
+class HttpClientRegistry:
+    def __init__(self, limit: int = 100, limit_per_host: int = 8, keepalive_timeout: float = 30.0,
+                 dns_cache_ttl: int = 300):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    # =========================================================================
+    # 🔌 生命週期
+    # =========================================================================
+
+    async def start(self):
+        if self._connector is not None and not self._connector.closed:
+            return
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl
+        )
+        print(f"🌐 [HTTP] 共用連線池已建立 (上限 {self.limit}, 每主機 {self.limit_per_host})")
+
+    async def close(self):
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+        print("🌐 [HTTP] 共用連線池已關閉")
+
+    # =========================================================================
+    # 📡 取得 Session
+    # =========================================================================
+
+    def session(self, purpose: str = "default") -> aiohttp.ClientSession:
+        """
+        取得指定用途的共用 session (不要自行 close)。
+        """
+        if self._connector is None or self._connector.closed:
+            raise RuntimeError("HttpClientRegistry 尚未啟動 (start)")
+        session = self._sessions.get(purpose)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=self._connector,
+                connector_owner=False,
+                timeout=TIMEOUT_PROFILES.get(purpose, TIMEOUT_PROFILES["default"]),
+                trace_configs=[self._make_trace_config(purpose)]
+            )
+            self._sessions[purpose] = session
+        return session
+
+    @staticmethod
+    def timeout(purpose: str) -> aiohttp.ClientTimeout:
+        return TIMEOUT_PROFILES.get(purpose, TIMEOUT_PROFILES["default"])
+
+    # =========================================================================
+    # 📊 統計
+    # =========================================================================
+
+    def _make_trace_config(self, purpose: str) -> aiohttp.TraceConfig:
+        stats = self.stats.setdefault(purpose, {
+            "requests": 0, "new_connections": 0, "reused_connections": 0,
+            "dns_hits": 0, "dns_misses": 0, "errors": 0,
+        })
+
+        def counter(key):
+            async def _inc(session, ctx, params):
+                stats[key] += 1
+            return _inc
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(counter("requests"))
+        trace.on_connection_create_end.append(counter("new_connections"))
+        trace.on_connection_reuseconn.append(counter("reused_connections"))
+        trace.on_dns_cache_hit.append(counter("dns_hits"))
+        trace.on_dns_cache_miss.append(counter("dns_misses"))
+        trace.on_request_exception.append(counter("errors"))
+        return trace
+
+    def get_stats(self) -> Dict[str, Any]:
+        purposes = {}
+        for purpose, s in self.stats.items():
+            conns = s["new_connections"] + s["reused_connections"]
+            purposes[purpose] = {**s, "reuse_rate": round(s["reused_connections"] / conns, 3) if conns else 0.0}
+        return {
+            "active": self._connector is not None and not self._connector.closed,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "purposes": purposes,
+        }
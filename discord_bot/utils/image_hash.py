@@ -0,0 +1,94 @@
+"""
+HiHi 感知雜湊 (Perceptual Image Hash)
+重新壓縮 / 縮放後仍能認出的「同一張圖」
+
+功能：
+- dhash — 9x8 灰階差異雜湊，64 bit；存成 PostgreSQL BIGINT (有號)
+- hamming — 兩個雜湊的漢明距離 (相異 bit 數)
+- BKTree — 以漢明距離建的 BK-tree，記憶體內近似查詢 (距離 ≤ N 的所有圖片)
+"""
+
+from typing import List, Dict, Any, Optional, Tuple
+
+HASH_BITS = 64
+_MASK = (1 << HASH_BITS) - 1
+
+
+def dhash_image(img, hash_size: int = 8) -> int:
+    """
+    差異雜湊 (Difference Hash)：縮成 (hash_size+1) x hash_size 灰階，
+    比較每列相鄰像素的亮度，左 > 右記 1。回傳有號 64-bit 整數 (可直接寫入 BIGINT)。
+    img: 已開啟的 PIL.Image
+    """
+    from PIL import Image
+
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return to_signed(value)
+
+
+def to_signed(value: int) -> int:
+    value &= _MASK
+    return value - (1 << HASH_BITS) if value >= (1 << (HASH_BITS - 1)) else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK).count("1")
+
+
+class BKTree:
+    """
+    BK-tree：每個節點的子節點依「與該節點的距離」分組。
+    查詢半徑 r 時只需走距離落在 [d - r, d + r] 的子樹。
+    """
+
+    def __init__(self):
+        # 節點: [hash, [value, ...], {distance: child}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value_hash: int, value: Dict[str, Any]):
+        self._size += 1
+        if self._root is None:
+            self._root = [value_hash, [value], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value_hash, node[0])
+            if d == 0:
+                node[1].append(value)  # 完全相同的雜湊放在同一個節點
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value_hash, [value], {}]
+                return
+            node = child
+
+    def search(self, value_hash: int, max_distance: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """回傳 [(distance, value), ...]，依距離由近到遠"""
+        if self._root is None:
+            return []
+        results = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value_hash, node[0])
+            if d <= max_distance:
+                results.extend((d, v) for v in node[1])
+            for dist, child in node[2].items():
+                if d - max_distance <= dist <= d + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda r: r[0])
+        return results
+
+    def clear(self):
+        self._root = None
+        self._size = 0
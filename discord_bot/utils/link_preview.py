@@ -0,0 +1,322 @@
+"""
+HiHi 連結預覽 (Link Preview)
+訊息中的網址先抓摘要再交給模型
+
+功能：
+- 串流下載 + 大小上限 — 只讀前 max_bytes，超過就截斷 (OpenGraph / <title> 都在 <head>)
+- 執行緒解析 — BeautifulSoup 在 thread pool 中執行；有安裝 lxml 時使用 lxml 解析器
+- OpenGraph 優先 — og:title / og:description → <title> / meta description → 內文前段
+- TTL 快取 — 以正規化網址 (去掉 fragment / utm_*) 為 key；失敗結果也快取 (負快取，較短 TTL)
+- 同網址併發合併 — 同一個網址同時只抓一次，其餘等待同一個結果
+- 每網域併發上限 — 避免一批訊息把同一個網站打爆
+- YouTube — oEmbed 取標題 / 頻道，熱門留言在執行緒中抓取 (數量與時間都有上限)
+- 內網防護 (SSRF) — 只抓解析到公開 IP 的網址，每次轉址都重新檢查 (不能用來探測面板 / VM2 Agent 等內網服務)
+"""
+
+import re
+import time
+import socket
+import asyncio
+import ipaddress
+import itertools
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+from typing import List, Dict, Any, Optional, Callable
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+URL_RE = re.compile(r'https?://[^\s<>()\[\]"\']+')
+_YOUTUBE_ID_RE = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})'
+)
+_TRACKING_PARAMS = {"fbclid", "gclid", "si", "feature"}
+
+USER_AGENT = "Mozilla/5.0 (compatible; HiHiBot/1.0; +link-preview)"
+MAX_REDIRECTS = 5
+_REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+
+def extract_urls(text: str) -> List[str]:
+    """取出文字中的網址 (去掉結尾標點)"""
+    return [u.rstrip(".,!?;:，。！？") for u in URL_RE.findall(text or "")]
+
+
+def normalize_url(url: str) -> str:
+    """快取 key：scheme / host 小寫、去掉 fragment 與追蹤參數"""
+    parts = urlsplit(url.strip())
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS]
+    path = parts.path or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ""))
+
+
+def youtube_video_id(url: str) -> Optional[str]:
+    match = _YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def _is_public_ip(value: str) -> bool:
+    ip = ipaddress.ip_address(value.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global
+
+
+async def is_public_url(url: str) -> bool:
+    """
+    http(s) 且主機解析出的「所有」位址都是公開 IP 才放行
+    (擋 loopback / 私有網段 10.0.0.0/8 等 / link-local / metadata 169.254.169.254)。
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    host = parts.hostname
+    try:
+        return _is_public_ip(host)
+    except ValueError:
+        pass  # 不是 IP 字面值 → 查 DNS
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError):
+        return False
+    try:
+        return bool(infos) and all(_is_public_ip(info[4][0]) for info in infos)
+    except ValueError:
+        return False
+
+
+def _parse_html(html: str, text_limit: int) -> Dict[str, str]:
+    """OpenGraph → <title> / meta description → 內文 (CPU 工作，在執行緒中執行)"""
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    def meta(*keys):
+        for key in keys:
+            tag = soup.find("meta", attrs={"property": key}) or soup.find("meta", attrs={"name": key})
+            if tag and tag.get("content"):
+                return tag["content"].strip()
+        return ""
+
+    title = meta("og:title", "twitter:title")
+    if not title and soup.title and soup.title.string:
+        title = soup.title.string.strip()
+    description = meta("og:description", "twitter:description", "description")
+    if not description:
+        for tag in soup(["script", "style", "noscript", "nav", "header", "footer"]):
+            tag.decompose()
+        body = soup.body or soup
+        description = " ".join(body.get_text(" ", strip=True).split())
+    return {
+        "title": title or "Link",
+        "description": description[:text_limit],
+        "site": meta("og:site_name"),
+    }
+
+
+class LinkPreviewer:
+    def __init__(self, session: Callable[[], Any], yt_downloader=None, max_bytes: int = 256 * 1024,
+                 ttl: float = 3600.0, negative_ttl: float = 300.0, per_domain: int = 2,
+                 max_links: int = 3, text_limit: int = 500, yt_comments: int = 5,
+                 yt_timeout: float = 10.0, max_items: int = 512):
+        """
+        session: 回傳共用 aiohttp session 的函式 (例如 lambda: bot.http_clients.session("web_preview"))
+        max_bytes: 每個網頁最多下載的位元組
+        ttl / negative_ttl: 成功 / 失敗結果的快取秒數
+        per_domain: 每個網域同時進行的請求上限
+        max_links: 一批訊息最多預覽幾個網址
+        """
+        self._session = session
+        self.yt_downloader = yt_downloader
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.per_domain = per_domain
+        self.max_links = max_links
+        self.text_limit = text_limit
+        self.yt_comments = yt_comments
+        self.yt_timeout = yt_timeout
+        self.max_items = max_items
+
+        # key -> (expires_at, preview 或 None)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._domain_limits: Dict[str, asyncio.Semaphore] = {}
+        # YoutubeCommentDownloader 內部共用 requests.Session，一次只跑一個
+        # (執行緒鎖：逾時放棄等待後，背景執行緒仍持有鎖直到真的結束)
+        self._yt_lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0, "negative_hits": 0, "misses": 0, "joined": 0,
+            "errors": 0, "truncated": 0, "bytes": 0, "blocked": 0,
+        }
+
+    # =========================================================================
+    # 🔗 對外介面
+    # =========================================================================
+
+    async def preview_many(self, urls: List[str]) -> List[str]:
+        """同一批訊息中的網址並行預覽 (去重、最多 max_links 個)，回傳成功的預覽文字"""
+        unique = list(OrderedDict((normalize_url(u), u) for u in urls).values())[:self.max_links]
+        if not unique:
+            return []
+        results = await asyncio.gather(*(self.preview(u) for u in unique), return_exceptions=True)
+        return [r for r in results if isinstance(r, str)]
+
+    async def preview(self, url: str) -> Optional[str]:
+        key = normalize_url(url)
+        cached = self._cache.get(key)
+        if cached is not None:
+            expires_at, value = cached
+            if time.monotonic() < expires_at:
+                self._cache.move_to_end(key)
+                self.stats["hits" if value is not None else "negative_hits"] += 1
+                return value
+            del self._cache[key]
+
+        # 同一個網址正在抓 → 等同一個結果
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["joined"] += 1
+            return await asyncio.shield(pending)
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        value = None
+        try:
+            value = await self._fetch(url)
+        except asyncio.CancelledError:
+            # 被取消不代表網址有問題 → 不寫入負快取
+            self._inflight.pop(key, None)
+            future.set_result(None)
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ [Link] 預覽失敗 {key[:80]}: {type(e).__name__}: {e}")
+        self._inflight.pop(key, None)
+        self._put(key, value)
+        future.set_result(value)
+        return value
+
+    # =========================================================================
+    # 📡 抓取
+    # =========================================================================
+
+    async def _fetch(self, url: str) -> Optional[str]:
+        domain = urlsplit(url).hostname or ""
+        if domain.startswith("www."):
+            domain = domain[4:]
+        video_id = youtube_video_id(url)
+        limit = self._domain_limits.setdefault("youtube" if video_id else domain, asyncio.Semaphore(self.per_domain))
+        async with limit:
+            if video_id:
+                return await self._fetch_youtube(url, video_id)
+            return await self._fetch_page(url)
+
+    async def _fetch_page(self, url: str) -> Optional[str]:
+        http = self._session()
+        headers = {"User-Agent": USER_AGENT, "Accept": "text/html,*/*;q=0.5"}
+        # 自行處理轉址：每一跳都先確認目標是公開位址
+        for _ in range(MAX_REDIRECTS + 1):
+            if not await is_public_url(url):
+                self.stats["blocked"] += 1
+                print(f"🚫 [Link] 略過非公開位址: {url[:80]}")
+                return None
+            async with http.get(url, headers=headers, allow_redirects=False) as resp:
+                if resp.status in _REDIRECT_STATUSES and resp.headers.get("Location"):
+                    url = urljoin(url, resp.headers["Location"])
+                    continue
+                if resp.status != 200:
+                    return None
+                content_type = resp.headers.get("Content-Type", "")
+                if "html" not in content_type:
+                    return None
+                raw = await self._read_capped(resp)
+                charset = resp.charset or "utf-8"
+            break
+        else:
+            return None  # 轉址次數過多
+
+        html = raw.decode(charset, errors="replace")
+        page = await asyncio.to_thread(_parse_html, html, self.text_limit)
+        site = f" ({page['site']})" if page["site"] else ""
+        return f"[Link Content] Title: {page['title']}{site}\nBody: {page['description']}..."
+
+    async def _read_capped(self, resp) -> bytes:
+        chunks = []
+        size = 0
+        async for chunk in resp.content.iter_chunked(16 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_bytes:
+                self.stats["truncated"] += 1
+                break
+        self.stats["bytes"] += size
+        return b"".join(chunks)[:self.max_bytes]
+
+    async def _fetch_youtube(self, url: str, video_id: str) -> Optional[str]:
+        watch_url = f"https://www.youtube.com/watch?v={video_id}"
+        info, comments = await asyncio.gather(
+            self._youtube_oembed(watch_url),
+            self._youtube_comments(watch_url),
+            return_exceptions=True
+        )
+        if isinstance(info, Exception) or not info:
+            return None
+        lines = [f"[YouTube] Title: {info.get('title', '')}\nChannel: {info.get('author_name', '')}"]
+        if isinstance(comments, list) and comments:
+            lines.append("Top comments:")
+            lines.extend(f"- {c}" for c in comments)
+        return "\n".join(lines)
+
+    async def _youtube_oembed(self, watch_url: str) -> Optional[Dict[str, Any]]:
+        http = self._session()
+        params = {"url": watch_url, "format": "json"}
+        async with http.get("https://www.youtube.com/oembed", params=params) as resp:
+            if resp.status != 200:
+                return None
+            return await resp.json(content_type=None)
+
+    async def _youtube_comments(self, watch_url: str) -> List[str]:
+        if not self.yt_downloader or self.yt_comments <= 0:
+            return []
+
+        # 下載器是同步 generator (requests)，只取前 N 則，在執行緒中執行
+        from youtube_comment_downloader import SORT_BY_POPULAR
+
+        def fetch():
+            with self._yt_lock:
+                comments = self.yt_downloader.get_comments_from_url(watch_url, sort_by=SORT_BY_POPULAR)
+                return [c.get("text", "")[:200] for c in itertools.islice(comments, self.yt_comments)]
+
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(fetch), timeout=self.yt_timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ [Link] YouTube 留言抓取逾時 ({self.yt_timeout}s)")
+            return []
+
+    # =========================================================================
+    # 📊 統計 / 內部
+    # =========================================================================
+
+    def _put(self, key: str, value: Optional[str]):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._cache[key] = (time.monotonic() + ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_items:
+            self._cache.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["cached"] = len(self._cache)
+        stats["parser"] = HTML_PARSER
+        lookups = stats["hits"] + stats["negative_hits"] + stats["misses"] + stats["joined"]
+        stats["hit_rate"] = round((stats["hits"] + stats["negative_hits"] + stats["joined"]) / lookups, 3) if lookups else 0.0
+        return stats
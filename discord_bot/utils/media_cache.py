@@ -0,0 +1,181 @@
+"""
+HiHi 媒體快取 (Media Cache)
+圖片 / 貼圖先縮圖再送模型，處理結果依內容雜湊快取
+
+功能：
+- 內容雜湊快取 — sha256(原始位元組) → 已縮圖、已 base64 的結果，同一張梗圖只處理一次
+- 貼圖快取 — 以 sticker.id 對應內容雜湊，重複使用的貼圖不再下載
+- 縮圖 + 重新壓縮 (Pillow) — 長邊超過 max_side 時縮小；不透明圖轉 JPEG，有透明度的轉 PNG；動圖取第一格
+- 感知雜湊 — 解碼時順便算 dHash (重複圖片偵測用，見 utils/image_hash.py)
+- 歷史佔位 (Placeholder) — 圖片只在當回合送出，存入對話歷史時換成簡短文字
+- 統計 — 快取命中、縮圖省下的位元組、歷史佔位省下的位元組
+"""
+
+import base64
+import asyncio
+import hashlib
+from io import BytesIO
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+from utils.image_hash import dhash_image
+
+# Gemini 直接支援的圖片格式 (其他格式一律轉檔)
+SUPPORTED_MIME_TYPES = {"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"}
+
+
+def _transcode(raw: bytes, mime_type: str, max_side: int, jpeg_quality: int) -> Dict[str, Any]:
+    """縮圖 + 重新壓縮 + 感知雜湊 (CPU 工作，在執行緒中執行)"""
+    from PIL import Image
+
+    with Image.open(BytesIO(raw)) as img:
+        img.seek(0)  # 動圖 (APNG / GIF) 只取第一格
+        width, height = img.size
+        phash = dhash_image(img)
+        needs_resize = max(width, height) > max_side
+        if not needs_resize and mime_type in SUPPORTED_MIME_TYPES:
+            return {"bytes": raw, "mime_type": mime_type, "width": width, "height": height, "phash": phash}
+
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        frame = img.convert("RGBA" if has_alpha else "RGB")
+        if needs_resize:
+            frame.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        out = BytesIO()
+        if has_alpha:
+            frame.save(out, format="PNG", optimize=True)
+            out_mime = "image/png"
+        else:
+            frame.save(out, format="JPEG", quality=jpeg_quality, optimize=True)
+            out_mime = "image/jpeg"
+        encoded = out.getvalue()
+
+    # 不需縮圖、轉檔後反而變大 → 保留原檔
+    if not needs_resize and len(encoded) >= len(raw) and mime_type in SUPPORTED_MIME_TYPES:
+        return {"bytes": raw, "mime_type": mime_type, "width": width, "height": height, "phash": phash}
+    return {"bytes": encoded, "mime_type": out_mime, "width": frame.width, "height": frame.height, "phash": phash}
+
+
+class MediaCache:
+    def __init__(self, max_side: int = 1024, jpeg_quality: int = 85, max_items: int = 256,
+                 max_bytes: int = 64 * 1024 * 1024):
+        """
+        max_side: 長邊上限 (px)
+        max_items / max_bytes: 快取上限 (以 base64 後大小計)
+        """
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+        self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._stickers: Dict[int, str] = {}  # sticker.id -> 內容雜湊
+        self._bytes = 0
+
+        self.stats = {
+            "hits": 0, "misses": 0, "sticker_hits": 0, "errors": 0,
+            "original_bytes": 0, "encoded_bytes": 0, "history_bytes_saved": 0, "placeholders": 0,
+        }
+
+    # =========================================================================
+    # 📥 取得媒體
+    # =========================================================================
+
+    async def from_bytes(self, raw: bytes, mime_type: str) -> Optional[Dict[str, Any]]:
+        """
+        回傳 {"hash", "phash", "mime_type", "data" (base64), "width", "height", "original_bytes", "encoded_bytes"}；
+        無法解碼時回傳 None。
+        """
+        key = hashlib.sha256(raw).hexdigest()
+        item = self._get(key)
+        if item is not None:
+            self.stats["hits"] += 1
+            return item
+
+        self.stats["misses"] += 1
+        try:
+            result = await asyncio.to_thread(_transcode, raw, mime_type or "", self.max_side, self.jpeg_quality)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ [Media] 圖片處理失敗: {e}")
+            return None
+
+        item = {
+            "hash": key,
+            "phash": result["phash"],
+            "mime_type": result["mime_type"],
+            "data": base64.b64encode(result["bytes"]).decode('utf-8'),
+            "width": result["width"],
+            "height": result["height"],
+            "original_bytes": len(raw),
+            "encoded_bytes": len(result["bytes"]),
+        }
+        self.stats["original_bytes"] += item["original_bytes"]
+        self.stats["encoded_bytes"] += item["encoded_bytes"]
+        self._put(key, item)
+        return item
+
+    async def fetch_sticker(self, sticker, http) -> Optional[Dict[str, Any]]:
+        """下載 PNG / APNG 貼圖 (同一個貼圖只下載一次)"""
+        key = self._stickers.get(sticker.id)
+        if key is not None:
+            item = self._get(key)
+            if item is not None:
+                self.stats["sticker_hits"] += 1
+                return item
+
+        async with http.get(sticker.url) as resp:
+            if resp.status != 200:
+                return None
+            raw = await resp.read()
+        item = await self.from_bytes(raw, "image/png")
+        if item is not None:
+            self._stickers[sticker.id] = item["hash"]
+        return item
+
+    # =========================================================================
+    # 🗜️ 歷史佔位
+    # =========================================================================
+
+    def compact_parts(self, parts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        把 inline 圖片換成文字佔位 (存入對話歷史用；當回合的請求仍使用完整圖片)。
+        回傳新的 list，不修改原本的 parts。
+        """
+        compacted = []
+        for part in parts:
+            inline = part.get("inline_data") if isinstance(part, dict) else None
+            if not inline:
+                compacted.append(part)
+                continue
+            data = inline.get("data", "")
+            key = hashlib.sha256(data.encode('utf-8')).hexdigest()[:8]
+            compacted.append({"text": f"[圖片 #{key} ({inline.get('mime_type', 'image')}) — 已於先前回合看過]"})
+            self.stats["placeholders"] += 1
+            self.stats["history_bytes_saved"] += len(data)
+        return compacted
+
+    # =========================================================================
+    # 📊 統計 / 內部
+    # =========================================================================
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["items"] = len(self._items)
+        stats["cached_bytes"] = self._bytes
+        stats["resize_bytes_saved"] = max(stats["original_bytes"] - stats["encoded_bytes"], 0)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def _put(self, key: str, item: Dict[str, Any]):
+        self._items[key] = item
+        self._bytes += len(item["data"])
+        while self._items and (len(self._items) > self.max_items or self._bytes > self.max_bytes):
+            _, old = self._items.popitem(last=False)
+            self._bytes -= len(old["data"])
@@ -4,19 +4,37 @@ PostgreSQL 全面優化版
 
 功能：
 - 連線池 (Connection Pool) — 效能提升 10 倍
-- 混合搜尋 (Hybrid Search) — Vector + Full-Text + RRF 排序
-- AI 自動標籤 (Auto-Tagging) — Gemini 結構化分析
+- 混合搜尋 (Hybrid Search) — Vector + Full-Text + RRF 排序 (HNSW + GIN 索引可用的寫法)
+- AI 自動標籤 (Auto-Tagging) — Gemini 結構化分析 (背景批次，MemoryTagger)
 - Facts 語意搜尋 — Embedding-based fact retrieval
+- 批次 Embedding — 非阻塞佇列，合併同時間的請求 (EmbeddingService)
+- Embedding 快取 — LRU + SQLite 雙層，相同文字不重複計費 (EmbeddingCache)
+- Facts 快取 — 程序內 LRU，寫入時失效 + LISTEN/NOTIFY 同步外部腳本的修改
+- 本地向量索引 — knowledge / facts 載入記憶體 (NumPy)，語意搜尋不必來回 DB (LocalVectorIndex)
+- 圖片感知雜湊 — image_memory.phash 載入記憶體 BK-tree，重複圖片以漢明距離比對
+- 聊天記錄保留 — chat_history 月分區、每日統計、過期分區封存 (ChatRetention)
+- 聊天記錄延後寫入 — 記憶體緩衝 + 批次 COPY，DB 故障時寫入磁碟日誌 (ChatLogWriter)
 """
 
 import os
 import asyncio
 import asyncpg
 from google import genai
-from google.genai import types
 from typing import List, Dict, Any, Optional
 import datetime
 import json
+import time
+from collections import OrderedDict
+from utils.embedding_service import EmbeddingService
+from utils.embedding_cache import EmbeddingCache, DEFAULT_CACHE_PATH
+from utils.memory_tagger import MemoryTagger, STATUS_PENDING
+from utils.vector_index import LocalVectorIndex
+from utils.image_hash import BKTree
+from utils.chat_retention import ChatRetention, DEFAULT_ARCHIVE_DIR
+from utils.chat_logger import ChatLogWriter, DEFAULT_JOURNAL_PATH
+
+# facts 表變更通知頻道 (由 scripts/add_facts_notify_trigger.py 建立的 trigger 發送)
+FACTS_NOTIFY_CHANNEL = "facts_changed"
 
 class MemoryManager:
     def __init__(self, db_url: str, google_api_key: str):
@@ -24,9 +42,69 @@ class MemoryManager:
         self.client = genai.Client(api_key=google_api_key)
         self.embedding_model = "gemini-embedding-001"
         self.tagging_model = "gemini-3-flash-preview"
+        # Embedding 快取 (EMBEDDING_CACHE_PATH 設為空字串 = 只用記憶體層)
+        self.embedding_cache = EmbeddingCache(
+            db_path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH),
+            max_items=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+            ttl_seconds=int(os.getenv("EMBEDDING_CACHE_TTL_DAYS", "30")) * 86400
+        )
+        # 批次 Embedding 服務 (所有向量生成都經過這裡)
+        self.embedder = EmbeddingService(self.client, model=self.embedding_model, dimensionality=768,
+                                         cache=self.embedding_cache)
+        # 背景 AI 標籤器 (記憶先寫入，標籤稍後批次補上)
+        self.tagger = MemoryTagger(self.client, self.tagging_model)
         # 連線池 (初始化時為 None，需要呼叫 init_pool)
         self.pool: Optional[asyncpg.Pool] = None
 
+        # 向量搜尋參數：ef_search 越大召回率越高、越慢 (pgvector 預設 40)；
+        # vector_candidates = 每一路 (向量 / 全文) 先取幾筆候選再做 RRF 或閾值過濾
+        self.hnsw_ef_search = int(os.getenv("HNSW_EF_SEARCH", "40"))
+        self.vector_candidates = int(os.getenv("VECTOR_CANDIDATES", "20"))
+
+        # Facts 快取 (user_id -> (載入時間, [fact, ...]))
+        # TTL 是 LISTEN 連線中斷時的保險，正常情況由 NOTIFY 即時失效
+        self._facts_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self.facts_cache_size = int(os.getenv("FACTS_CACHE_SIZE", "256"))
+        self.facts_cache_ttl = int(os.getenv("FACTS_CACHE_TTL", "600"))
+        # LISTEN 中斷期間收不到外部修改通知，快取改用短 TTL
+        self.facts_cache_degraded_ttl = int(os.getenv("FACTS_CACHE_DEGRADED_TTL", "15"))
+        self.facts_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        # 失效世代 (每位使用者一個 + 全表一個)：查詢期間若被失效，查到的舊資料不寫入快取
+        self._facts_gen: Dict[str, int] = {}
+        self._facts_gen_all = 0
+        self._facts_listener: Optional[asyncpg.Connection] = None
+        self._facts_reconnect: Optional[asyncio.Task] = None
+
+        # 本地向量索引 (knowledge / facts 小且以讀為主；memories 一律走 SQL)
+        # LOCAL_VECTOR_INDEX=0 或未安裝 NumPy 時停用；超過 MAX_ROWS 的表不載入
+        self.use_local_index = LocalVectorIndex.available and os.getenv("LOCAL_VECTOR_INDEX", "1") != "0"
+        self.local_index_max_rows = int(os.getenv("LOCAL_VECTOR_INDEX_MAX_ROWS", "50000"))
+        self.knowledge_index = LocalVectorIndex("knowledge", dim=768)
+        self.facts_index = LocalVectorIndex("facts", dim=768)
+        self._index_tasks: set = set()
+
+        # 圖片感知雜湊索引 (BK-tree，PostgreSQL image_memory.phash 為後端儲存)
+        # 漢明距離 ≤ AI_IMAGE_DUP_DISTANCE 視為同一張圖 (64 bit 中最多幾個 bit 不同)
+        self.image_index = BKTree()
+        self.image_dup_distance = int(os.getenv("AI_IMAGE_DUP_DISTANCE", "6"))
+        self._image_writes: set = set()
+
+        # 聊天記錄保留 (CHAT_RETENTION_MONTHS=0 = 永久保留，只做分區與每日統計)
+        # 近期歷史先查最近 CHAT_HISTORY_LOOKBACK_DAYS 天 (只掃到 1~2 個分區)，不夠才往前查
+        self.chat_retention = ChatRetention(
+            retention_months=int(os.getenv("CHAT_RETENTION_MONTHS", "0")),
+            archive_dir=os.getenv("CHAT_ARCHIVE_DIR") or DEFAULT_ARCHIVE_DIR
+        )
+        self.chat_history_lookback_days = int(os.getenv("CHAT_HISTORY_LOOKBACK_DAYS", "14"))
+
+        # 聊天記錄延後寫入 (不佔用回覆流程的連線；每 N 筆或 T 毫秒批次 COPY)
+        self.chat_log = ChatLogWriter(
+            journal_path=os.getenv("CHAT_LOG_JOURNAL") or DEFAULT_JOURNAL_PATH,
+            flush_rows=int(os.getenv("CHAT_LOG_FLUSH_ROWS", "100")),
+            flush_interval=int(os.getenv("CHAT_LOG_FLUSH_MS", "500")) / 1000,
+            journal_max_bytes=int(os.getenv("CHAT_LOG_JOURNAL_MAX_MB", "16")) * 1024 * 1024
+        )
+
     # =========================================================================
     # 🔌 連線池管理 (Connection Pool)
     # =========================================================================
@@ -48,10 +126,30 @@ class MemoryManager:
         )
         print(f"🔌 [DB] 連線池已建立 (min={min_size}, max={max_size})")
 
+        await self._start_facts_listener()
+        await self._load_local_indexes()
+        await self._load_image_index()
+        await self._init_chat_retention()
+        self.chat_log.start(self.pool, with_author=self.chat_retention.has_author)
+
+        # 啟動背景標籤器，並補標上次未完成的記憶
+        self.tagger.start(self.pool)
+        await self.tagger.sweep()
+
     async def close_pool(self):
         """
         關閉連線池。應在 Bot 關閉時呼叫。
         """
+        await self._stop_facts_listener()
+        for task in list(self._index_tasks):
+            task.cancel()
+        # 寫完緩衝中的聊天記錄 (寫不進 DB 就留在磁碟日誌，下次啟動重送)
+        await self.chat_log.close()
+        # 等待背景的圖片雜湊寫入完成
+        if self._image_writes:
+            await asyncio.gather(*self._image_writes, return_exceptions=True)
+        await self.tagger.close()
+        await self.embedder.close()
         if self.pool:
             await self.pool.close()
             self.pool = None
@@ -66,147 +164,329 @@ class MemoryManager:
         # Fallback: 單次連線 (相容舊版呼叫)
         return await asyncpg.connect(self.db_url)
 
+    # =========================================================================
+    # 👂 Facts 變更監聽 (LISTEN/NOTIFY)
+    # =========================================================================
+
+    async def _start_facts_listener(self) -> bool:
+        """
+        開一條獨立連線 LISTEN facts 變更 (連線池的連線會被歸還，無法長期監聽)。
+        失敗時在背景以指數退避重試，直到連上或連線池關閉。
+        """
+        conn = None
+        try:
+            conn = await asyncpg.connect(self.db_url)
+            await conn.add_listener(FACTS_NOTIFY_CHANNEL, self._on_facts_notify)
+            conn.add_termination_listener(self._on_facts_listener_lost)
+            self._facts_listener = conn
+            # 監聽建立前的快取可能已過時 (重連時本地索引也整份重載)
+            self._invalidate_facts(None)
+            if self.facts_index.ready:
+                self._schedule_facts_index_refresh(None)
+            print("👂 [DB] 已監聽 facts 變更通知")
+            return True
+        except Exception as e:
+            self._facts_listener = None
+            if conn is not None:
+                conn.terminate()  # 連上但 LISTEN 失敗 → 不留半開的連線
+            print(f"⚠️ [DB] facts LISTEN 失敗，快取改用 {self.facts_cache_degraded_ttl} 秒 TTL: {e}")
+            self._schedule_facts_reconnect()
+            return False
+
+    def _schedule_facts_reconnect(self):
+        if self.pool is None or (self._facts_reconnect is not None and not self._facts_reconnect.done()):
+            return
+        self._facts_reconnect = asyncio.ensure_future(self._facts_reconnect_loop())
+
+    async def _facts_reconnect_loop(self, base_delay: float = 5.0, max_delay: float = 300.0):
+        delay = base_delay
+        while self.pool is not None and self._facts_listener is None:
+            await asyncio.sleep(delay)
+            if self.pool is None:
+                return
+            if await self._start_facts_listener():
+                return
+            delay = min(max_delay, delay * 2)
+
+    async def _stop_facts_listener(self):
+        if self._facts_reconnect is not None:
+            self._facts_reconnect.cancel()
+            self._facts_reconnect = None
+        conn = self._facts_listener
+        self._facts_listener = None
+        if conn is not None:
+            try:
+                conn.remove_termination_listener(self._on_facts_listener_lost)
+                await conn.close()
+            except Exception:
+                pass
+
+    def _on_facts_notify(self, conn, pid, channel, payload):
+        # payload = user_id；"*" 代表整張表 (TRUNCATE)
+        user_id = None if payload in (None, "", "*") else payload
+        self._invalidate_facts(user_id)
+        self._schedule_facts_index_refresh(user_id)
+
+    def _on_facts_listener_lost(self, conn):
+        print("⚠️ [DB] facts 監聽連線中斷，清空事實快取並在背景重連")
+        self._facts_listener = None
+        self._invalidate_facts(None)
+        self._schedule_facts_reconnect()
+
+    # =========================================================================
+    # 🗂️ Facts 快取 (Facts Cache)
+    # =========================================================================
+
+    def _facts_cache_get(self, user_id: str) -> Optional[List[str]]:
+        entry = self._facts_cache.get(user_id)
+        if entry is not None:
+            loaded_at, facts = entry
+            # TTL 是 LISTEN 中斷時的保險；中斷期間改用短 TTL
+            ttl = self.facts_cache_ttl if self._facts_listener is not None else self.facts_cache_degraded_ttl
+            if time.monotonic() - loaded_at < ttl:
+                self._facts_cache.move_to_end(user_id)
+                self.facts_cache_stats["hits"] += 1
+                return list(facts)
+            del self._facts_cache[user_id]
+        self.facts_cache_stats["misses"] += 1
+        return None
+
+    def _facts_generation(self, user_id: str) -> tuple:
+        """查詢 DB 前先取世代，寫入快取時比對 (await 期間可能被 add_fact / NOTIFY 失效)"""
+        return (self._facts_gen_all, self._facts_gen.get(user_id, 0))
+
+    def _facts_cache_put(self, user_id: str, facts: List[str], generation: tuple):
+        if generation != self._facts_generation(user_id):
+            return  # 查詢期間已被失效 → 資料可能過時，不快取
+        self._facts_cache[user_id] = (time.monotonic(), list(facts))
+        self._facts_cache.move_to_end(user_id)
+        while len(self._facts_cache) > self.facts_cache_size:
+            self._facts_cache.popitem(last=False)
+
+    def _invalidate_facts(self, user_id: Optional[str]):
+        """user_id 為 None 時清空全部"""
+        if user_id is None:
+            self._facts_cache.clear()
+            self._facts_gen_all += 1
+            self._facts_gen.clear()  # 全表世代已變，舊的個別世代不再需要
+        else:
+            self._facts_cache.pop(str(user_id), None)
+            self._facts_gen[str(user_id)] = self._facts_gen.get(str(user_id), 0) + 1
+        self.facts_cache_stats["invalidations"] += 1
+
+    def get_facts_cache_stats(self) -> Dict[str, Any]:
+        stats = dict(self.facts_cache_stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["size"] = len(self._facts_cache)
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["listening"] = self._facts_listener is not None
+        return stats
+
+    # =========================================================================
+    # 🧭 本地向量索引 (Local Vector Index)
+    # =========================================================================
+
+    @staticmethod
+    def _knowledge_entry(row):
+        return row['term'], row['embedding'], {
+            "term": row['term'], "definition": row['definition'], "category": row['category']
+        }
+
+    @staticmethod
+    def _fact_entry(row):
+        return row['id'], row['embedding'], {
+            "id": row['id'], "user_id": row['user_id'], "fact": row['fact']
+        }
+
+    async def _load_local_indexes(self):
+        if not self.use_local_index:
+            return
+        await self._load_local_index(
+            self.knowledge_index,
+            "SELECT COUNT(*) FROM knowledge WHERE embedding IS NOT NULL",
+            "SELECT term, definition, category, embedding::text AS embedding FROM knowledge WHERE embedding IS NOT NULL",
+            self._knowledge_entry
+        )
+        await self._load_local_index(
+            self.facts_index,
+            "SELECT COUNT(*) FROM facts WHERE embedding IS NOT NULL",
+            "SELECT id, user_id, fact, embedding::text AS embedding FROM facts WHERE embedding IS NOT NULL",
+            self._fact_entry
+        )
+
+    async def _load_local_index(self, index: LocalVectorIndex, count_sql: str, fetch_sql: str, to_entry):
+        """整份載入 (失敗或超過上限時 index.ready 保持原狀，查詢走 SQL)"""
+        async with self.pool.acquire() as conn:
+            try:
+                total = await conn.fetchval(count_sql)
+                if total > self.local_index_max_rows:
+                    print(f"⚠️ [Index] {index.name} 有 {total} 筆，超過本地索引上限 {self.local_index_max_rows}，改用 SQL")
+                    return
+                rows = await conn.fetch(fetch_sql)
+            except Exception as e:
+                print(f"⚠️ [Index] {index.name} 載入失敗，改用 SQL: {e}")
+                return
+
+        start = time.perf_counter()
+        # 解析 + 正規化向量是 CPU 工作，丟到執行緒；建好後回到事件迴圈一次替換 (查詢中不會讀到一半的索引)
+        built = await asyncio.to_thread(index.build, [to_entry(row) for row in rows])
+        index.swap(built)
+        print(f"🧭 [Index] {index.name} 本地向量索引已載入 ({len(index)} 筆, {(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    def _schedule_facts_index_refresh(self, user_id: Optional[str]):
+        if not self.facts_index.ready or self.pool is None:
+            return
+        task = asyncio.ensure_future(self._refresh_facts_index(user_id))
+        self._index_tasks.add(task)
+        task.add_done_callback(self._index_tasks.discard)
+
+    async def _refresh_facts_index(self, user_id: Optional[str]):
+        """
+        外部修改 (NOTIFY) 後重新同步本地 facts 索引。user_id 為 None 時整份重載。
+        """
+        if user_id is None:
+            await self._load_local_index(
+                self.facts_index,
+                "SELECT COUNT(*) FROM facts WHERE embedding IS NOT NULL",
+                "SELECT id, user_id, fact, embedding::text AS embedding FROM facts WHERE embedding IS NOT NULL",
+                self._fact_entry
+            )
+            return
+
+        async with self.pool.acquire() as conn:
+            try:
+                rows = await conn.fetch("""
+                    SELECT id, user_id, fact, embedding::text AS embedding
+                    FROM facts WHERE user_id = $1 AND embedding IS NOT NULL
+                """, user_id)
+            except Exception as e:
+                print(f"⚠️ [Index] facts 索引同步失敗 ({user_id}): {e}")
+                return
+        self.facts_index.remove_where(lambda payload: payload["user_id"] == user_id)
+        for row in rows:
+            self.facts_index.upsert(*self._fact_entry(row))
+
+    def get_local_index_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.use_local_index,
+            "knowledge": self.knowledge_index.get_stats(),
+            "facts": self.facts_index.get_stats(),
+        }
+
     # =========================================================================
     # 🧬 Embedding 生成
     # =========================================================================
 
-    async def get_embedding(self, text: str) -> List[float]:
+    async def get_embedding(self, text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> List[float]:
         """
         將文字轉換為 768 維向量 (Gemini Embedding)。
+        透過 EmbeddingService 排隊批次送出，不會阻塞事件迴圈。
+        task_type: 儲存用 "RETRIEVAL_DOCUMENT"，查詢用 "RETRIEVAL_QUERY"
         """
         try:
-            response = self.client.models.embed_content(
-                model=self.embedding_model,
-                contents=text,
-                config=types.EmbedContentConfig(
-                    task_type="RETRIEVAL_DOCUMENT",
-                    output_dimensionality=768
-                )
-            )
-            return response.embeddings[0].values
+            return await self.embedder.embed(text, task_type=task_type)
         except Exception as e:
             print(f"❌ Embedding 錯誤: {e}")
             return []
 
+    async def _set_ef_search(self, conn, candidates: int):
+        """
+        設定本次交易的 hnsw.ef_search (需在 conn.transaction() 內呼叫，交易結束自動還原)。
+        ef_search 不可小於要取回的筆數，否則 HNSW 最多只回傳 ef_search 筆。
+        """
+        ef = max(self.hnsw_ef_search, candidates)
+        await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef))
+
     # =========================================================================
     # 🧠 長期記憶 (Memories)
     # =========================================================================
 
-    async def add_memory(self, user_name: str, content: str, importance: int = 1, type: str = "observation", metadata: Dict[str, Any] = None):
+    async def add_memory(self, user_name: str, content: str, importance: int = 1, type: str = "observation", metadata: Dict[str, Any] = None) -> Optional[int]:
         """
         儲存新記憶到 PostgreSQL (memories 表)。
-        自動進行 AI 標籤分析 + 向量嵌入。
+        立即寫入內容 + 向量嵌入 (metadata_status = 'pending')，
+        AI 標籤由背景 MemoryTagger 批次補上，不阻塞呼叫端。
+        回傳新記憶的 id；Embedding 或寫入失敗時回傳 None (呼叫端可決定是否重試)。
         """
-        # 1. AI 自動標籤
-        try:
-            ai_meta = await self._analyze_content(content)
-            if ai_meta:
-                if metadata is None:
-                    metadata = {}
-                metadata.update(ai_meta)
-                print(f"🧠 [Memory] AI 標籤: {ai_meta}")
-        except Exception as e:
-            print(f"⚠️ AI 標籤失敗 (不影響儲存): {e}")
-
-        # 2. 生成 Embedding
+        # 1. 生成 Embedding
         vector = await self.get_embedding(content)
         if not vector:
             print("❌ 無法生成 Embedding，跳過儲存。")
-            return
+            return None
 
-        # 3. 寫入資料庫
+        # 2. 寫入資料庫
         meta_json = json.dumps(metadata, ensure_ascii=False) if metadata else "{}"
         async with self.pool.acquire() as conn:
             try:
-                await conn.execute("""
-                    INSERT INTO memories (user_name, content, importance, type, embedding, metadata)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                """, user_name, content, importance, type, str(vector), meta_json)
+                memory_id = await conn.fetchval("""
+                    INSERT INTO memories (user_name, content, importance, type, embedding, metadata, metadata_status)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    RETURNING id
+                """, user_name, content, importance, type, str(vector), meta_json, STATUS_PENDING)
                 print(f"✅ 記憶已儲存: {user_name} - {content[:30]}... (重要度: {importance})")
             except Exception as e:
                 print(f"❌ 記憶寫入錯誤: {e}")
+                return None
 
-    async def _analyze_content(self, content: str) -> Optional[Dict[str, Any]]:
-        """
-        使用 Gemini Flash 分析內容，回傳結構化 metadata。
-        """
-        try:
-            prompt = f"""
-            分析以下記憶內容，萃取結構化 metadata (JSON 格式)。
-            內容: "{content}"
-            
-            JSON Schema:
-            {{
-                "topics": ["主題1", "主題2"],
-                "entities": ["人物/物品1", "人物/物品2"],
-                "sentiment": "positive" | "negative" | "neutral",
-                "category": "FACT" | "OPINION" | "EVENT" | "KNOWLEDGE",
-                "keywords": ["關鍵字1", "關鍵字2"]
-            }}
-            
-            只回傳 JSON 物件。
-            """
-
-            response = self.client.models.generate_content(
-                model=self.tagging_model,
-                contents=prompt,
-                config=types.GenerateContentConfig(response_mime_type="application/json")
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            print(f"⚠️ 內容分析錯誤: {e}")
-            return None
+        # 3. 排入背景 AI 標籤 (佇列滿時保持 pending，稍後由 sweep 補標)
+        if not self.tagger.enqueue(memory_id, content):
+            print(f"⏳ [Memory] 標籤佇列已滿，記憶 #{memory_id} 稍後補標")
+        return memory_id
 
     async def search_memory(self, query: str, limit: int = 3) -> List[Dict[str, Any]]:
         """
         混合搜尋 (Hybrid Search)：
-        1. Vector Search (語意相似度)
-        2. Full-Text Search (關鍵字匹配)
+        1. Vector Search (語意相似度) — 先以 HNSW 取 ORDER BY/LIMIT 候選，再編排名
+        2. Full-Text Search (關鍵字匹配) — content_tsv (GIN 索引)
         3. RRF (Reciprocal Rank Fusion) 合併排名
         """
         # 生成查詢向量
-        try:
-            response = self.client.models.embed_content(
-                model=self.embedding_model,
-                contents=query,
-                config=types.EmbedContentConfig(
-                    task_type="RETRIEVAL_QUERY",
-                    output_dimensionality=768
-                )
-            )
-            query_vector = response.embeddings[0].values
-        except Exception as e:
-            print(f"❌ 查詢 Embedding 錯誤: {e}")
+        query_vector = await self.get_embedding(query, task_type="RETRIEVAL_QUERY")
+        if not query_vector:
+            print("❌ 查詢 Embedding 錯誤")
             return []
 
+        candidates = max(self.vector_candidates, limit)
         async with self.pool.acquire() as conn:
             memories = []
             try:
                 # 混合搜尋 SQL (RRF = Reciprocal Rank Fusion)
                 # k=60 是 RRF 標準常數
-                rows = await conn.fetch("""
-                    WITH vector_search AS (
-                        SELECT id, content, user_name, importance, created_at, metadata,
-                               1 - (embedding <=> $1) as similarity,
-                               ROW_NUMBER() OVER (ORDER BY embedding <=> $1) as vector_rank
-                        FROM memories
-                        ORDER BY embedding <=> $1
-                        LIMIT 20
-                    ),
-                    fts_search AS (
-                        SELECT id,
-                               ROW_NUMBER() OVER (ORDER BY ts_rank(to_tsvector('simple', content), plainto_tsquery('simple', $2)) DESC) as fts_rank
-                        FROM memories
-                        WHERE to_tsvector('simple', content) @@ plainto_tsquery('simple', $2)
-                        LIMIT 20
-                    )
-                    SELECT v.content, v.user_name, v.importance, v.created_at, v.metadata, v.similarity,
-                           (1.0 / (60 + v.vector_rank)) + COALESCE(1.0 / (60 + f.fts_rank), 0) as rrf_score
-                    FROM vector_search v
-                    LEFT JOIN fts_search f ON v.id = f.id
-                    ORDER BY rrf_score DESC
-                    LIMIT $3
-                """, str(query_vector), query, limit)
+                # 視窗函數 (ROW_NUMBER) 放在 LIMIT 之後的外層計算，
+                # 內層只有 ORDER BY 距離 + LIMIT → 才會走 HNSW / GIN 索引
+                async with conn.transaction():
+                    await self._set_ef_search(conn, candidates)
+                    rows = await conn.fetch("""
+                        WITH vector_candidates AS (
+                            SELECT id, content, user_name, importance, created_at, metadata, metadata_status,
+                                   embedding <=> $1 as distance
+                            FROM memories
+                            ORDER BY embedding <=> $1
+                            LIMIT $4
+                        ),
+                        vector_search AS (
+                            SELECT *, 1 - distance as similarity,
+                                   ROW_NUMBER() OVER (ORDER BY distance) as vector_rank
+                            FROM vector_candidates
+                        ),
+                        fts_candidates AS (
+                            SELECT id, ts_rank(content_tsv, q) as score
+                            FROM memories, plainto_tsquery('simple', $2) q
+                            WHERE content_tsv @@ q
+                            ORDER BY score DESC
+                            LIMIT $4
+                        ),
+                        fts_search AS (
+                            SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC) as fts_rank
+                            FROM fts_candidates
+                        )
+                        SELECT v.content, v.user_name, v.importance, v.created_at, v.metadata, v.metadata_status, v.similarity,
+                               (1.0 / (60 + v.vector_rank)) + COALESCE(1.0 / (60 + f.fts_rank), 0) as rrf_score
+                        FROM vector_search v
+                        LEFT JOIN fts_search f ON v.id = f.id
+                        ORDER BY rrf_score DESC
+                        LIMIT $3
+                    """, str(query_vector), query, limit, candidates)
 
                 for row in rows:
                     meta = row['metadata']
@@ -218,6 +498,7 @@ class MemoryManager:
                         "importance": row['importance'],
                         "created_at": row['created_at'],
                         "metadata": meta if meta else {},
+                        "metadata_status": row['metadata_status'],
                         "similarity": row['similarity']
                     })
             except Exception as e:
@@ -256,6 +537,7 @@ class MemoryManager:
                         str(user_id), fact
                     )
                     print(f"✅ 事實已儲存 (無 Embedding): {user_id} - {fact}")
+            self._invalidate_facts(str(user_id))
             return
 
         embedding_str = str(vector)
@@ -278,21 +560,29 @@ class MemoryManager:
                         UPDATE facts SET fact = $1, embedding = $2, created_at = CURRENT_TIMESTAMP
                         WHERE id = $3
                     """, fact, embedding_str, similar['id'])
+                    fact_id = similar['id']
                     print(f"🔄 事實已更新: {user_id}")
                     print(f"   舊: {old_fact}")
                     print(f"   新: {fact}")
                     print(f"   相似度: {similar['similarity']:.4f}")
                 else:
                     # 4. 沒找到 → INSERT
-                    await conn.execute("""
+                    fact_id = await conn.fetchval("""
                         INSERT INTO facts (user_id, fact, embedding)
                         VALUES ($1, $2, $3)
+                        RETURNING id
                     """, str(user_id), fact, embedding_str)
                     sim_info = f" (最近相似: {similar['similarity']:.4f})" if similar else ""
                     print(f"✅ 事實已儲存: {user_id} - {fact}{sim_info}")
 
+                # 本地索引寫入同步
+                if self.facts_index.ready:
+                    self.facts_index.upsert(fact_id, vector, {"id": fact_id, "user_id": str(user_id), "fact": fact})
+
             except Exception as e:
                 print(f"❌ 事實寫入錯誤: {e}")
+            finally:
+                self._invalidate_facts(str(user_id))
 
     async def remove_fact(self, user_id: str, fact: str):
         """
@@ -302,14 +592,14 @@ class MemoryManager:
         async with self.pool.acquire() as conn:
             try:
                 # 嘗試 1: 精確匹配
-                result = await conn.execute("""
+                deleted = await conn.fetch("""
                     DELETE FROM facts WHERE user_id = $1 AND fact = $2
+                    RETURNING id
                 """, str(user_id), fact)
 
-                # 檢查是否真的刪到了 (asyncpg 的 execute 回傳 "DELETE N")
-                deleted_count = int(result.split(" ")[-1])
-
-                if deleted_count > 0:
+                if deleted:
+                    for row in deleted:
+                        self.facts_index.remove(row['id'])
                     print(f"🗑️ 事實已移除 (精確): {user_id} - {fact}")
                 else:
                     # 嘗試 2: 模糊匹配 (Embedding)
@@ -325,6 +615,7 @@ class MemoryManager:
 
                         if similar and similar['similarity'] >= 0.75:
                             await conn.execute("DELETE FROM facts WHERE id = $1", similar['id'])
+                            self.facts_index.remove(similar['id'])
                             print(f"🗑️ 事實已移除 (模糊): {user_id}")
                             print(f"   目標: {fact}")
                             print(f"   實際刪除: {similar['fact']}")
@@ -336,51 +627,105 @@ class MemoryManager:
 
             except Exception as e:
                 print(f"❌ 事實刪除錯誤: {e}")
+            finally:
+                self._invalidate_facts(str(user_id))
 
     async def get_facts(self, user_id: str) -> List[str]:
         """
-        取得特定使用者的所有事實。
+        取得特定使用者的所有事實 (優先讀快取)。
         """
+        cached = self._facts_cache_get(str(user_id))
+        if cached is not None:
+            return cached
+
+        generation = self._facts_generation(str(user_id))
         async with self.pool.acquire() as conn:
             try:
                 rows = await conn.fetch("""
                     SELECT fact FROM facts WHERE user_id = $1
                 """, str(user_id))
-                return [row['fact'] for row in rows]
+                facts = [row['fact'] for row in rows]
+                self._facts_cache_put(str(user_id), facts, generation)
+                return facts
             except Exception as e:
                 print(f"❌ 事實查詢錯誤: {e}")
                 return []
 
+    async def get_facts_bulk(self, user_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        一次取得多位使用者的事實 (快取未命中的部分以單一查詢 user_id = ANY($1) 補齊)。
+        回傳 {user_id: [fact, ...]}，沒有事實的使用者不會出現在結果中。
+        """
+        facts: Dict[str, List[str]] = {}
+        missing = []
+        for user_id in {str(u) for u in user_ids}:
+            cached = self._facts_cache_get(user_id)
+            if cached is None:
+                missing.append(user_id)
+            elif cached:
+                facts[user_id] = cached
+
+        if not missing:
+            return facts
+
+        generations = {user_id: self._facts_generation(user_id) for user_id in missing}
+        async with self.pool.acquire() as conn:
+            try:
+                rows = await conn.fetch("""
+                    SELECT user_id, fact FROM facts WHERE user_id = ANY($1::text[])
+                    ORDER BY id
+                """, missing)
+                loaded: Dict[str, List[str]] = {u: [] for u in missing}
+                for row in rows:
+                    loaded[row['user_id']].append(row['fact'])
+                for user_id, user_facts in loaded.items():
+                    # 沒有事實的使用者也快取 (空 list)，避免每回合重查
+                    self._facts_cache_put(user_id, user_facts, generations[user_id])
+                    if user_facts:
+                        facts[user_id] = user_facts
+            except Exception as e:
+                print(f"❌ 批次事實查詢錯誤: {e}")
+        return facts
+
+    # 跨使用者事實搜尋的相似度閾值
+    FACT_SEARCH_THRESHOLD = 0.5
+
     async def search_facts_by_topic(self, query: str, limit: int = 5) -> List[Dict[str, str]]:
         """
         語意搜尋事實 (跨使用者)。
         例如：「誰喜歡遊戲？」→ 回傳所有相關使用者的事實。
+        相似度閾值在 HNSW 取出候選之後才過濾 (寫在 WHERE 裡會讓索引失效)。
+        本地 facts 索引就緒時直接在記憶體搜尋，不查 DB。
         """
-        try:
-            response = self.client.models.embed_content(
-                model=self.embedding_model,
-                contents=query,
-                config=types.EmbedContentConfig(
-                    task_type="RETRIEVAL_QUERY",
-                    output_dimensionality=768
-                )
-            )
-            query_vector = response.embeddings[0].values
-        except Exception as e:
-            print(f"❌ 事實搜尋 Embedding 錯誤: {e}")
+        query_vector = await self.get_embedding(query, task_type="RETRIEVAL_QUERY")
+        if not query_vector:
+            print("❌ 事實搜尋 Embedding 錯誤")
             return []
 
+        if self.facts_index.ready:
+            return [
+                {"user_id": payload["user_id"], "fact": payload["fact"], "similarity": similarity}
+                for payload, similarity in self.facts_index.search(query_vector, limit, self.FACT_SEARCH_THRESHOLD)
+            ]
+
         async with self.pool.acquire() as conn:
             results = []
             try:
-                rows = await conn.fetch("""
-                    SELECT user_id, fact, 1 - (embedding <=> $1) as similarity
-                    FROM facts
-                    WHERE embedding IS NOT NULL
-                    AND 1 - (embedding <=> $1) > 0.5
-                    ORDER BY embedding <=> $1
-                    LIMIT $2
-                """, str(query_vector), limit)
+                candidates = max(self.vector_candidates, limit)
+                async with conn.transaction():
+                    await self._set_ef_search(conn, candidates)
+                    rows = await conn.fetch("""
+                        SELECT user_id, fact, similarity FROM (
+                            SELECT user_id, fact, 1 - (embedding <=> $1) as similarity
+                            FROM facts
+                            WHERE embedding IS NOT NULL
+                            ORDER BY embedding <=> $1
+                            LIMIT $3
+                        ) candidates
+                        WHERE similarity > $4
+                        ORDER BY similarity DESC
+                        LIMIT $2
+                    """, str(query_vector), limit, candidates, self.FACT_SEARCH_THRESHOLD)
                 for row in rows:
                     results.append({
                         "user_id": row['user_id'],
@@ -395,31 +740,49 @@ class MemoryManager:
     # 📜 聊天記錄 (Chat History)
     # =========================================================================
 
-    async def log_chat(self, role: str, content: str, session_id: str = "global"):
+    async def log_chat(self, role: str, content: str, session_id: str = "global", author: Optional[str] = None):
         """
-        記錄聊天訊息 (chat_history 表)。
+        記錄聊天訊息 (chat_history 表)。只排入寫入緩衝，不等待 DB。
         """
-        async with self.pool.acquire() as conn:
-            try:
-                await conn.execute("""
-                    INSERT INTO chat_history (role, content, session_id)
-                    VALUES ($1, $2, $3)
-                """, role, content, session_id)
-            except Exception as e:
-                print(f"❌ 聊天記錄錯誤: {e}")
+        self.chat_log.write([{"role": role, "content": content, "author": author}], session_id)
+
+    async def log_chats(self, messages: List[Dict[str, str]], session_id: str = "global"):
+        """
+        批次記錄多則聊天訊息。只排入寫入緩衝 (ChatLogWriter 背景批次 COPY)。
+        messages: [{"role": ..., "content": ..., "author": (選填)}, ...]
+        """
+        if messages:
+            self.chat_log.write(messages, session_id)
 
-    async def get_recent_chat_history(self, limit: int = 10) -> List[Dict[str, str]]:
+    async def get_recent_chat_history(self, limit: int = 10, session_id: Optional[str] = None) -> List[Dict[str, str]]:
         """
         取得近期聊天記錄 (按時間正序)。
+        session_id: 指定頻道 (例如 "discord_123")；None 則不分頻道。
         """
         async with self.pool.acquire() as conn:
             history = []
             try:
-                rows = await conn.fetch("""
-                    SELECT role, content FROM chat_history
-                    ORDER BY timestamp DESC
-                    LIMIT $1
-                """, limit)
+                if session_id is not None:
+                    # 先查最近 N 天 (分區裁剪 + (session_id, timestamp) 索引)，筆數不夠才查全部
+                    rows = await conn.fetch("""
+                        SELECT role, content FROM chat_history
+                        WHERE session_id = $2 AND timestamp >= now() - make_interval(days => $3)
+                        ORDER BY timestamp DESC
+                        LIMIT $1
+                    """, limit, session_id, self.chat_history_lookback_days)
+                    if len(rows) < limit:
+                        rows = await conn.fetch("""
+                            SELECT role, content FROM chat_history
+                            WHERE session_id = $2
+                            ORDER BY timestamp DESC
+                            LIMIT $1
+                        """, limit, session_id)
+                else:
+                    rows = await conn.fetch("""
+                        SELECT role, content FROM chat_history
+                        ORDER BY timestamp DESC
+                        LIMIT $1
+                    """, limit)
                 # 反轉為時間正序
                 for row in reversed(rows):
                     history.append({"role": row['role'], "content": row['content']})
@@ -427,6 +790,39 @@ class MemoryManager:
                 print(f"❌ 聊天記錄查詢錯誤: {e}")
             return history
 
+    async def _init_chat_retention(self):
+        try:
+            async with self.pool.acquire() as conn:
+                await self.chat_retention.detect(conn)
+            await self.run_chat_maintenance()
+        except Exception as e:
+            print(f"⚠️ [ChatLog] 保留機制初始化失敗: {e}")
+
+    async def run_chat_maintenance(self) -> Dict[str, Any]:
+        """
+        chat_history 定期維護：建立下個月分區、重算最近幾天的每日統計、封存過期分區。
+        由 AIChat 的背景任務定期呼叫。
+        """
+        result = await self.chat_retention.run(self.pool)
+        if result["rollup_rows"] or result["created"] or result["archived"]:
+            print(f"🧹 [ChatLog] 維護完成: 統計 {result['rollup_rows']} 筆 | 新分區 {len(result['created'])} | 封存 {len(result['archived'])}")
+        return result
+
+    async def get_chat_daily_stats(self, session_id: Optional[str] = None, days: int = 7) -> List[Dict[str, Any]]:
+        """
+        每日統計 (chat_history_daily)，新到舊。session_id=None 則列出所有頻道。
+        """
+        if not self.chat_retention.has_rollup:
+            return []
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT day, session_id, messages, user_messages, model_messages, participants
+                FROM chat_history_daily
+                WHERE day >= CURRENT_DATE - $1::int AND ($2::text IS NULL OR session_id = $2)
+                ORDER BY day DESC, messages DESC
+            """, days, session_id)
+            return [dict(r) for r in rows]
+
     # =========================================================================
     # 📚 RAG 知識庫 (Knowledge)
     # =========================================================================
@@ -454,38 +850,47 @@ class MemoryManager:
                         created_at = CURRENT_TIMESTAMP
                 """, term, definition, category, str(vector))
                 print(f"📚 知識已儲存: [{category}] {term} -> {definition}")
+                if self.knowledge_index.ready:
+                    self.knowledge_index.upsert(term, vector, {"term": term, "definition": definition, "category": category})
             except Exception as e:
                 print(f"❌ 知識寫入錯誤: {e}")
 
+    # 知識庫搜尋的相似度閾值
+    KNOWLEDGE_SEARCH_THRESHOLD = 0.65
+
     async def search_knowledge(self, query: str, limit: int = 3) -> str:
         """
         混合搜尋知識庫：Vector + 關鍵字。
         回傳格式化字串供 System Prompt 注入。
+        相似度閾值在 HNSW 取出候選之後才過濾。
+        本地 knowledge 索引就緒時直接在記憶體搜尋，不查 DB。
         """
-        try:
-            response = self.client.models.embed_content(
-                model=self.embedding_model,
-                contents=query,
-                config=types.EmbedContentConfig(
-                    task_type="RETRIEVAL_QUERY",
-                    output_dimensionality=768
-                )
-            )
-            query_vector = response.embeddings[0].values
-        except Exception as e:
-            print(f"❌ 知識搜尋 Embedding 錯誤: {e}")
+        query_vector = await self.get_embedding(query, task_type="RETRIEVAL_QUERY")
+        if not query_vector:
+            print("❌ 知識搜尋 Embedding 錯誤")
             return ""
 
+        if self.knowledge_index.ready:
+            hits = self.knowledge_index.search(query_vector, limit, self.KNOWLEDGE_SEARCH_THRESHOLD)
+            return "\n".join(f"- [{p['category']}] {p['term']}: {p['definition']}" for p, _ in hits)
+
         async with self.pool.acquire() as conn:
             results = []
             try:
-                rows = await conn.fetch("""
-                    SELECT term, definition, category, 1 - (embedding <=> $1) as similarity
-                    FROM knowledge
-                    WHERE 1 - (embedding <=> $1) > 0.65
-                    ORDER BY embedding <=> $1
-                    LIMIT $2
-                """, str(query_vector), limit)
+                candidates = max(self.vector_candidates, limit)
+                async with conn.transaction():
+                    await self._set_ef_search(conn, candidates)
+                    rows = await conn.fetch("""
+                        SELECT term, definition, category, similarity FROM (
+                            SELECT term, definition, category, 1 - (embedding <=> $1) as similarity
+                            FROM knowledge
+                            ORDER BY embedding <=> $1
+                            LIMIT $3
+                        ) candidates
+                        WHERE similarity > $4
+                        ORDER BY similarity DESC
+                        LIMIT $2
+                    """, str(query_vector), limit, candidates, self.KNOWLEDGE_SEARCH_THRESHOLD)
                 for row in rows:
                     results.append(f"- [{row['category']}] {row['term']}: {row['definition']}")
             except Exception as e:
@@ -493,44 +898,155 @@ class MemoryManager:
 
         return "\n".join(results) if results else ""
 
+    # =========================================================================
+    # 🧩 回合上下文 (Turn Context)
+    # =========================================================================
+
+    async def build_turn_context(self, users: List[str], query_text: str, messages: List[Dict[str, str]],
+                                 session_id: str = "global") -> Dict[str, Any]:
+        """
+        一次組好 AI 回覆前需要的所有上下文 (取代逐一 get_facts / search_knowledge / log_chat)：
+        1. 所有使用者的事實 — 單一 ANY($1) 查詢
+        2. 知識庫搜尋 — 與事實查詢同時進行 (asyncio.gather)
+        3. 聊天記錄 — 排入延後寫入緩衝 (不佔用連線)
+        回傳 {"facts": {user_id: [fact, ...]}, "knowledge": str}
+        """
+        async def _knowledge():
+            if not query_text or not query_text.strip():
+                return ""
+            return await self.search_knowledge(query_text)
+
+        await self.log_chats(messages, session_id=session_id)
+        facts, knowledge = await asyncio.gather(
+            self.get_facts_bulk(users),
+            _knowledge(),
+            return_exceptions=True
+        )
+
+        if isinstance(facts, BaseException):
+            print(f"⚠️ 上下文事實載入失敗: {facts}")
+            facts = {}
+        if isinstance(knowledge, BaseException):
+            print(f"⚠️ 上下文知識搜尋失敗: {knowledge}")
+            knowledge = ""
+
+        return {"facts": facts, "knowledge": knowledge}
+
     # =========================================================================
     # 🖼️ 圖片雜湊 (Image Hashing)
     # =========================================================================
 
+    async def _load_image_index(self):
+        """啟動時把所有 phash 載入記憶體 BK-tree"""
+        async with self.pool.acquire() as conn:
+            try:
+                rows = await conn.fetch("""
+                    SELECT hash, phash, user_id, created_at FROM image_memory
+                    WHERE phash IS NOT NULL
+                """)
+            except Exception as e:
+                print(f"⚠️ [Image] 感知雜湊索引載入失敗 (尚未執行 add_image_phash_column.py？): {e}")
+                return
+        self.image_index.clear()
+        for row in rows:
+            self.image_index.add(row['phash'], {
+                "hash": row['hash'], "user_id": row['user_id'], "created_at": row['created_at']
+            })
+        print(f"🖼️ [Image] 感知雜湊索引已載入 ({len(self.image_index)} 張)")
+
+    def find_similar_image(self, phash: int) -> Optional[Dict[str, Any]]:
+        """
+        在記憶體 BK-tree 中找最相近的舊圖片 (不查 DB)。
+        回傳 {"user_id", "created_at", "distance"}，沒有相近圖片時回傳 None。
+        """
+        matches = self.image_index.search(phash, self.image_dup_distance)
+        if not matches:
+            return None
+        # 距離相同時以最早傳送的為準 (「原 po」)
+        distance = matches[0][0]
+        first = min((v for d, v in matches if d == distance), key=lambda v: v['created_at'])
+        return {"user_id": first['user_id'], "created_at": first['created_at'], "distance": distance}
+
+    async def find_duplicate_image(self, img_hash: str, phash: int) -> Optional[Dict[str, Any]]:
+        """
+        先查記憶體 BK-tree (近似比對)；沒有相近圖片時再以 sha256 精確查 DB，
+        涵蓋遷移前沒有 phash 的舊圖片。精確命中的舊圖片會補上 phash 並加入索引，
+        下次就不必再查 DB。回傳格式同 find_similar_image。
+        """
+        existing = self.find_similar_image(phash)
+        if existing:
+            return existing
+        row = await self.check_image_hash(img_hash)
+        if not row:
+            return None
+        if row.get("phash") is None:
+            self.image_index.add(phash, {"hash": img_hash, "user_id": row['user_id'], "created_at": row['created_at']})
+            self._spawn_image_write(self.add_image_hash(img_hash, row['user_id'], phash=phash))
+        return {"user_id": row['user_id'], "created_at": row['created_at'], "distance": 0}
+
+    def remember_image(self, img_hash: str, phash: int, user_id: str, description: str = ""):
+        """
+        立即加入記憶體索引 (同一批訊息的後續圖片馬上就比對得到)，
+        DB 寫入則在背景進行，與模型呼叫並行。
+        """
+        entry = {
+            "hash": img_hash, "user_id": user_id,
+            "created_at": datetime.datetime.now(datetime.timezone.utc)
+        }
+        self.image_index.add(phash, entry)
+        self._spawn_image_write(self._persist_image(entry, description, phash))
+
+    async def _persist_image(self, entry: Dict[str, Any], description: str, phash: int):
+        # DB 已有同一張圖 (例如另一個 Bot 實例先寫入) → 索引改回原 po，不覆蓋
+        stored = await self.add_image_hash(entry["hash"], entry["user_id"], description, phash=phash)
+        if stored:
+            entry.update(stored)
+
+    def _spawn_image_write(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._image_writes.add(task)
+        task.add_done_callback(self._image_writes.discard)
+
     async def check_image_hash(self, img_hash: str) -> Optional[Dict[str, Any]]:
         """
-        檢查圖片是否已存在 (重複偵測)。
+        檢查圖片是否已存在 (精確 sha256 比對；近似比對請用 find_similar_image)。
         """
         async with self.pool.acquire() as conn:
             try:
                 row = await conn.fetchrow("""
-                    SELECT user_id, created_at, description FROM image_memory
+                    SELECT user_id, created_at, description, phash FROM image_memory
                     WHERE hash = $1
                 """, img_hash)
                 if row:
                     return {
                         "user_id": row['user_id'],
                         "created_at": row['created_at'],
-                        "description": row['description']
+                        "description": row['description'],
+                        "phash": row['phash']
                     }
             except Exception as e:
                 print(f"❌ 圖片雜湊查詢錯誤: {e}")
         return None
 
-    async def add_image_hash(self, img_hash: str, user_id: str, description: str = ""):
+    async def add_image_hash(self, img_hash: str, user_id: str, description: str = "", phash: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """
-        儲存圖片雜湊 (重複偵測用)。
+        儲存圖片雜湊 (重複偵測用)。phash: 64-bit 感知雜湊 (BIGINT)
+        已存在時只補上 phash，保留原本的上傳者與時間。
+        回傳 DB 中的 {"user_id", "created_at"} (原 po)，失敗時回傳 None。
         """
         async with self.pool.acquire() as conn:
             try:
-                await conn.execute("""
-                    INSERT INTO image_memory (hash, user_id, description)
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT (hash) DO NOTHING
-                """, img_hash, user_id, description)
-                print(f"🖼️ 圖片雜湊已儲存: {img_hash[:8]}... (使用者: {user_id})")
+                row = await conn.fetchrow("""
+                    INSERT INTO image_memory (hash, user_id, description, phash)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (hash) DO UPDATE SET phash = COALESCE(image_memory.phash, EXCLUDED.phash)
+                    RETURNING user_id, created_at
+                """, img_hash, user_id, description, phash)
+                print(f"🖼️ 圖片雜湊已儲存: {img_hash[:8]}... (使用者: {row['user_id']})")
+                return {"user_id": row['user_id'], "created_at": row['created_at']}
             except Exception as e:
                 print(f"❌ 圖片雜湊寫入錯誤: {e}")
+                return None
 
 
 # 單元測試
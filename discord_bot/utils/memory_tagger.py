@@ -0,0 +1,231 @@
+"""
+HiHi 記憶標籤器 (Memory Tagger)
+延遲 + 批次的 AI 自動標籤
+
+功能：
+- 延遲標籤 (Deferred Enrichment) — 記憶先寫入 DB (metadata_status = 'pending')，標籤稍後補上
+- 批次請求 — 多筆待標籤記憶合併成一次結構化輸出 (JSON) 請求
+- 非阻塞 — 使用 client.aio 非同步 API，不卡事件迴圈
+- 背壓 (Backpressure) — 佇列滿時不排隊，留在 DB 由下次掃描 (sweep) 補標
+"""
+
+import json
+import asyncio
+import time
+from google.genai import types
+from typing import List, Dict, Any, Optional, Tuple
+
+# metadata_status 欄位的狀態值
+STATUS_PENDING = "pending"
+STATUS_TAGGED = "tagged"
+STATUS_FAILED = "failed"
+
+
+class MemoryTagger:
+    def __init__(self, client, model: str, batch_size: int = 8, batch_window: float = 2.0,
+                 max_pending: int = 200, max_retries: int = 2):
+        """
+        batch_size: 單次請求最多標籤幾筆記憶
+        batch_window: 收到第一筆後等待其他記憶加入同一批的秒數
+        max_pending: 佇列上限 (超過時交給 sweep 處理)
+        """
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self.pool = None  # 由 MemoryManager.init_pool 設定
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._needs_sweep = False  # 曾因背壓略過記憶 → 佇列清空後需回 DB 撿回
+
+        self.stats = {"queued": 0, "tagged": 0, "failed": 0, "deferred": 0, "batches": 0}
+
+    # =========================================================================
+    # 🔌 生命週期
+    # =========================================================================
+
+    def start(self, pool):
+        self.pool = pool
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._batch_loop())
+
+    async def close(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        # 佇列中未處理的記憶仍是 pending，下次啟動時由 sweep 補標
+
+    async def flush(self, timeout: float = 60.0):
+        """等待目前佇列中的記憶都標籤完成 (測試腳本用)"""
+        if self._queue is not None:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+
+    # =========================================================================
+    # 📥 排入 / 掃描
+    # =========================================================================
+
+    def enqueue(self, memory_id: int, content: str) -> bool:
+        """
+        排入待標籤記憶。佇列已滿時回傳 False (記憶保持 pending，等 sweep)。
+        """
+        if self._queue is None:
+            self.stats["deferred"] += 1
+            return False
+        try:
+            self._queue.put_nowait((memory_id, content))
+            self.stats["queued"] += 1
+            return True
+        except asyncio.QueueFull:
+            self.stats["deferred"] += 1
+            self._needs_sweep = True
+            return False
+
+    async def sweep(self, limit: int = 100) -> int:
+        """
+        把 DB 中仍為 pending 的記憶排入佇列 (啟動時、或背壓後補標)。
+        """
+        if self.pool is None or self._queue is None:
+            return 0
+        room = self._queue.maxsize - self._queue.qsize()
+        if room <= 0:
+            return 0
+        async with self.pool.acquire() as conn:
+            try:
+                rows = await conn.fetch("""
+                    SELECT id, content FROM memories
+                    WHERE metadata_status = $1
+                    ORDER BY id
+                    LIMIT $2
+                """, STATUS_PENDING, min(limit, room))
+            except Exception as e:
+                print(f"⚠️ [Tagger] 掃描 pending 記憶失敗: {e}")
+                return 0
+        count = sum(1 for row in rows if self.enqueue(row['id'], row['content']))
+        if count:
+            print(f"🏷️ [Tagger] 補標 {count} 筆 pending 記憶")
+        return count
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["queue_depth"] = self._queue.qsize() if self._queue else 0
+        return stats
+
+    # =========================================================================
+    # ⚙️ 批次處理
+    # =========================================================================
+
+    async def _batch_loop(self):
+        while True:
+            first = await self._queue.get()
+            batch: List[Tuple[int, str]] = [first]
+
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._tag_batch(batch)
+            except Exception as e:
+                print(f"❌ [Tagger] 批次處理錯誤: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            # 佇列清空時，順便撿回因背壓而延後的記憶
+            if self._queue.empty() and self._needs_sweep:
+                self._needs_sweep = False
+                await self.sweep()
+
+    async def _tag_batch(self, batch: List[Tuple[int, str]]):
+        results: Dict[int, Dict[str, Any]] = {}
+        for attempt in range(self.max_retries + 1):
+            try:
+                results = await self._analyze_batch(batch)
+                break
+            except Exception as e:
+                print(f"⚠️ [Tagger] 標籤請求失敗 (第 {attempt + 1} 次): {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(2 ** attempt)
+        self.stats["batches"] += 1
+
+        tagged = [(json.dumps(results[mid], ensure_ascii=False), mid) for mid, _ in batch if mid in results]
+        failed = [mid for mid, _ in batch if mid not in results]
+
+        async with self.pool.acquire() as conn:
+            if tagged:
+                await conn.executemany("""
+                    UPDATE memories
+                    SET metadata = COALESCE(metadata, '{}'::jsonb) || $1::jsonb,
+                        metadata_status = $3
+                    WHERE id = $2
+                """, [(meta, mid, STATUS_TAGGED) for meta, mid in tagged])
+            if failed:
+                await conn.execute("""
+                    UPDATE memories SET metadata_status = $2 WHERE id = ANY($1::int[])
+                """, failed, STATUS_FAILED)
+
+        self.stats["tagged"] += len(tagged)
+        self.stats["failed"] += len(failed)
+        print(f"🏷️ [Tagger] 已標籤 {len(tagged)} 筆記憶" + (f"，失敗 {len(failed)} 筆" if failed else ""))
+
+    async def _analyze_batch(self, batch: List[Tuple[int, str]]) -> Dict[int, Dict[str, Any]]:
+        """
+        使用 Gemini Flash 一次分析多筆記憶，回傳 {memory_id: metadata}。
+        """
+        items = "\n".join(json.dumps({"id": mid, "content": content}, ensure_ascii=False) for mid, content in batch)
+        prompt = f"""
+        分析以下每一筆記憶內容，萃取結構化 metadata (JSON 格式)。
+        記憶 (每行一筆 JSON)：
+        {items}
+
+        回傳 JSON 陣列，每筆記憶一個物件，並保留原本的 id：
+        [
+            {{
+                "id": 記憶 id,
+                "topics": ["主題1", "主題2"],
+                "entities": ["人物/物品1", "人物/物品2"],
+                "sentiment": "positive" | "negative" | "neutral",
+                "category": "FACT" | "OPINION" | "EVENT" | "KNOWLEDGE",
+                "keywords": ["關鍵字1", "關鍵字2"]
+            }}
+        ]
+
+        只回傳 JSON 陣列。
+        """
+
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=prompt,
+            config=types.GenerateContentConfig(response_mime_type="application/json")
+        )
+        parsed = json.loads(response.text)
+        if isinstance(parsed, dict):
+            parsed = [parsed]
+
+        valid_ids = {mid for mid, _ in batch}
+        results = {}
+        for entry in parsed:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                mid = int(entry.pop("id"))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if mid in valid_ids:
+                results[mid] = entry
+        return results
@@ -0,0 +1,157 @@
+"""
+HiHi System Prompt 快取 (Prompt Prefix Cache)
+靜態前綴只組一次，動態內容每回合另外附加
+
+功能：
+- StaticPromptCache — 核心記憶 + 表情資料庫等靜態前綴預先組好，來源檔案 (mtime/size) 變更時才重建
+- ContextCacheManager — 可選的伺服器端 Context Cache：靜態前綴 + 工具宣告上傳一次，之後以 cache name 引用
+  (建立失敗時 — 例如內容低於模型的最小快取 token 數 — 退回一般模式，10 分鐘後再試)
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+from google.genai import types
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+
+class StaticPromptCache:
+    def __init__(self, paths: List[str], build: Callable[[], str], check_interval: float = 5.0):
+        """
+        paths: 需要監看的來源檔案
+        build: 重新讀檔並組出靜態前綴 (來源變更時呼叫)
+        check_interval: 兩次檢查 mtime 的最短間隔 (秒)，避免每一步都 stat
+        """
+        self.paths = paths
+        self.build = build
+        self.check_interval = check_interval
+
+        self.text = ""
+        self.version = ""
+        self._signature: Optional[Tuple] = None
+        self._last_check = 0.0
+        self.stats = {"hits": 0, "rebuilds": 0}
+
+    def _current_signature(self) -> Tuple:
+        sig = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                sig.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append((path, None, None))
+        return tuple(sig)
+
+    def get(self) -> str:
+        now = time.monotonic()
+        if self._signature is not None and now - self._last_check < self.check_interval:
+            self.stats["hits"] += 1
+            return self.text
+
+        self._last_check = now
+        signature = self._current_signature()
+        if signature == self._signature:
+            self.stats["hits"] += 1
+            return self.text
+
+        self.text = self.build()
+        self.version = hashlib.sha256(self.text.encode('utf-8')).hexdigest()[:12]
+        self._signature = signature
+        self.stats["rebuilds"] += 1
+        print(f"🧾 [Prompt] 靜態前綴已重建 (v{self.version}, {len(self.text)} 字)")
+        return self.text
+
+    def invalidate(self):
+        self._signature = None
+
+
+class ContextCacheManager:
+    def __init__(self, client, model: str, ttl_seconds: int = 3600, retry_after: float = 600.0):
+        self.client = client
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.retry_after = retry_after
+
+        self._name: Optional[str] = None
+        self._version: Optional[str] = None
+        self._expires_at = 0.0
+        self._disabled_until = 0.0
+        # 換新後的舊 cache：其他頻道進行中的 Agent 迴圈可能還在用，不立即刪除，等 TTL 自然過期
+        self._retired: Dict[str, float] = {}  # name -> 到期時間
+        self._lock = asyncio.Lock()
+        self.stats = {"created": 0, "reused": 0, "errors": 0}
+
+    def _valid(self, version: str) -> bool:
+        # 提前 60 秒換新，避免請求途中過期
+        return self._name is not None and self._version == version and time.time() < self._expires_at - 60
+
+    async def get_name(self, version: str, system_instruction: str, tools: List[types.Tool]) -> Optional[str]:
+        """
+        取得對應此版本靜態前綴的 cache name；失敗時回傳 None (呼叫端改用一般模式)。
+        """
+        if self._valid(version):
+            self.stats["reused"] += 1
+            return self._name
+        if time.time() < self._disabled_until:
+            return None
+
+        async with self._lock:
+            if self._valid(version):
+                self.stats["reused"] += 1
+                return self._name
+
+            try:
+                cache = await self.client.aio.caches.create(
+                    model=self.model,
+                    config=types.CreateCachedContentConfig(
+                        display_name=f"hihi-system-{version}",
+                        system_instruction=system_instruction,
+                        tools=tools,
+                        ttl=f"{self.ttl_seconds}s"
+                    )
+                )
+            except Exception as e:
+                self.stats["errors"] += 1
+                self._disabled_until = time.time() + self.retry_after
+                print(f"⚠️ [Prompt] Context Cache 建立失敗，改用一般模式: {e}")
+                return None
+
+            if self._name and self._name != cache.name:
+                self._retired[self._name] = self._expires_at
+            now = time.time()
+            self._retired = {name: exp for name, exp in self._retired.items() if exp > now}
+            self._name = cache.name
+            self._version = version
+            self._expires_at = now + self.ttl_seconds
+            self.stats["created"] += 1
+            print(f"🧾 [Prompt] Context Cache 已建立: {cache.name} (v{version})")
+
+        return self._name
+
+    def invalidate(self):
+        """請求因 cache 失效而失敗時呼叫，下一次會重新建立"""
+        self._name = None
+
+    async def close(self):
+        # 關閉時已沒有進行中的請求，尚未過期的舊 cache 一併刪除
+        now = time.time()
+        names = [name for name, exp in self._retired.items() if exp > now]
+        if self._name:
+            names.append(self._name)
+        for name in names:
+            await self._delete(name)
+        self._name = None
+        self._retired.clear()
+
+    async def _delete(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception as e:
+            print(f"⚠️ [Prompt] 刪除舊 Context Cache 失敗 ({name}): {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["active"] = self._name is not None
+        stats["retired"] = len(self._retired)
+        return stats
@@ -0,0 +1,171 @@
+"""
+HiHi 串流回覆 (Reply Streamer)
+模型一邊生成，Discord 訊息一邊更新
+
+功能：
+- 提早發送 — 收到第一段文字就先送出訊息，之後以編輯 (edit) 補上後續內容
+- 編輯合併 (Coalescing) — 兩次編輯至少間隔 min_interval 秒，期間到達的片段合併成一次編輯
+- 速率限制退避 — 編輯遇到 429 時自動拉長間隔
+- 部分內容渲染 — 每次都以目前全文做 [emoji] 替換，結尾還沒打完的 [xxx 先不顯示
+- 超過 2000 字自動分成多則訊息
+- 中斷 (abort) — 回覆被新訊息打斷時刪除已送出的半成品
+"""
+
+import re
+import time
+import asyncio
+import discord
+from typing import List, Callable, Optional, Dict, Any
+
+DISCORD_MESSAGE_LIMIT = 2000
+STREAM_CURSOR = " ▌"
+
+# 結尾尚未閉合的 [placeholder (例如 "[smi")
+_OPEN_PLACEHOLDER_RE = re.compile(r'\[[^\[\]\n]{0,40}$')
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """依 Discord 字數上限切段，優先在換行處切"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class ReplyStreamer:
+    def __init__(self, channel, render: Callable[[str], str], min_interval: float = 1.2):
+        """
+        render: 文字 → 實際顯示內容 (emoji 替換)
+        min_interval: 兩次編輯的最短間隔 (秒)
+        """
+        self.channel = channel
+        self.render = render
+        self.min_interval = min_interval
+
+        self._text = ""
+        self._messages: List[discord.Message] = []
+        self._shown: List[str] = []  # 各訊息目前顯示的內容 (相同就不重送)
+        self._dirty = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._last_push = 0.0
+        self._started = time.monotonic()
+
+        self.stats: Dict[str, Any] = {"sends": 0, "edits": 0, "coalesced": 0, "rate_limited": 0, "first_token_ms": None}
+
+    # =========================================================================
+    # 📥 串流輸入
+    # =========================================================================
+
+    def feed(self, delta: str):
+        """收到新的文字片段 (同步呼叫，實際送出由背景 flusher 處理)"""
+        if not delta:
+            return
+        if self.stats["first_token_ms"] is None:
+            self.stats["first_token_ms"] = round((time.monotonic() - self._started) * 1000)
+        self._text += delta
+        if self._dirty.is_set():
+            self.stats["coalesced"] += 1
+        self._dirty.set()
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def reset(self):
+        """
+        模型改為呼叫工具 → 已顯示的文字不是最終回覆。
+        保留已送出的訊息 (之後直接覆寫)，只清掉內容。
+        """
+        self._text = ""
+        self._dirty.clear()
+
+    # =========================================================================
+    # 🏁 結束
+    # =========================================================================
+
+    async def finish(self, final_text: str):
+        """以最終全文覆寫 (完整渲染，不加游標)"""
+        await self._stop_flusher()
+        self._text = final_text
+        await self._push(partial=False)
+
+    async def abort(self):
+        """回覆被中斷：停止更新並刪除已送出的半成品"""
+        await self._stop_flusher()
+        for message in self._messages:
+            try:
+                await message.delete()
+            except discord.HTTPException:
+                pass
+        self._messages.clear()
+        self._shown.clear()
+
+    # =========================================================================
+    # ⚙️ 內部
+    # =========================================================================
+
+    async def _stop_flusher(self):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            wait = self._last_push + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._dirty.clear()
+            try:
+                await self._push(partial=True)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    # 超過速率限制 → 放慢編輯頻率，下一輪再送最新內容
+                    self.stats["rate_limited"] += 1
+                    self.min_interval = min(self.min_interval * 2, 10.0)
+                    self._dirty.set()
+                else:
+                    print(f"⚠️ [Stream] 訊息更新失敗: {e}")
+
+    async def _push(self, partial: bool):
+        async with self._lock:
+            text = _OPEN_PLACEHOLDER_RE.sub("", self._text) if partial else self._text
+            rendered = self.render(text) if text.strip() else ""
+            chunks = split_message(rendered)
+            if partial and chunks and len(chunks[-1]) + len(STREAM_CURSOR) <= DISCORD_MESSAGE_LIMIT:
+                chunks[-1] += STREAM_CURSOR
+            if partial and not chunks:
+                return  # 還沒有可顯示的內容 (例如只收到 "[smi")
+            await self._sync(chunks)
+            self._last_push = time.monotonic()
+
+    async def _sync(self, chunks: List[str]):
+        for i, chunk in enumerate(chunks):
+            if i < len(self._messages):
+                if self._shown[i] != chunk:
+                    await self._messages[i].edit(content=chunk)
+                    self._shown[i] = chunk
+                    self.stats["edits"] += 1
+            else:
+                message = await self.channel.send(chunk)
+                self._messages.append(message)
+                self._shown.append(chunk)
+                self.stats["sends"] += 1
+
+        # 內容變短 (reset 後) → 多出來的訊息刪掉
+        for message in self._messages[len(chunks):]:
+            try:
+                await message.delete()
+            except discord.HTTPException:
+                pass
+        del self._messages[len(chunks):]
+        del self._shown[len(chunks):]
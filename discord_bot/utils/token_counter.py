@@ -0,0 +1,203 @@
+"""
+HiHi Token 計算 (Token Accounting)
+增量式 + CJK 感知版
+
+功能：
+- estimate_text_tokens — 中日韓文字 1 字 ≈ 1 token，其他文字約 4 字元 ≈ 1 token
+- estimate_part_tokens — 支援 text / inline_data (圖片依尺寸切塊計價) / functionCall / functionResponse
+- TokenHistory — 對話歷史容器，append / 刪除時同步更新總 token 數，每則訊息的成本只算一次
+- 精確模式 (可選) — 透過模型的 count_tokens 端點校正，結果依內容雜湊快取
+"""
+
+import re
+import json
+import math
+import base64
+import asyncio
+import hashlib
+from io import BytesIO
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Iterator
+
+# 中日韓文字、假名、諺文、全形標點 → 每字約 1 token
+_CJK_RE = re.compile(
+    r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]'
+)
+
+# Gemini 圖片計價：兩邊都 ≤ 384px 為 258 tokens，否則每個 768x768 區塊 258 tokens
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE_SIZE = 768
+IMAGE_SMALL_SIZE = 384
+
+# 每則訊息的固定開銷 (role 標記等)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 精確計數快取 (內容雜湊 -> tokens)，跨 session 共用
+_exact_cache: "OrderedDict[str, int]" = OrderedDict()
+_EXACT_CACHE_SIZE = 4096
+
+
+def estimate_text_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + math.ceil(other / 4)
+
+
+def estimate_image_tokens(data_b64: str) -> int:
+    """依圖片尺寸估算 (只讀檔頭，不解碼像素)；失敗時以單一區塊計"""
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(base64.b64decode(data_b64))) as img:
+            width, height = img.size
+        if width <= IMAGE_SMALL_SIZE and height <= IMAGE_SMALL_SIZE:
+            return IMAGE_TILE_TOKENS
+        tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+        return IMAGE_TILE_TOKENS * max(tiles, 1)
+    except Exception:
+        return IMAGE_TILE_TOKENS
+
+
+def estimate_part_tokens(part: Dict[str, Any]) -> int:
+    if not isinstance(part, dict):
+        return estimate_text_tokens(str(part))
+
+    tokens = 0
+    if part.get("text"):
+        tokens += estimate_text_tokens(part["text"])
+
+    inline = part.get("inline_data") or part.get("inlineData")
+    if inline:
+        mime = inline.get("mime_type") or inline.get("mimeType") or ""
+        if mime.startswith("image/"):
+            tokens += estimate_image_tokens(inline.get("data", ""))
+        else:
+            tokens += IMAGE_TILE_TOKENS
+
+    for key in ("functionCall", "function_call", "functionResponse", "function_response"):
+        if part.get(key):
+            tokens += estimate_text_tokens(json.dumps(part[key], ensure_ascii=False, default=str))
+
+    return tokens
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    parts = message.get("parts", []) if isinstance(message, dict) else []
+    return MESSAGE_OVERHEAD_TOKENS + sum(estimate_part_tokens(p) for p in parts)
+
+
+def _message_hash(message: Dict[str, Any]) -> str:
+    raw = json.dumps(message, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TokenHistory:
+    """
+    對話歷史容器：維護訊息 list 與對應的 token 成本，總數隨增刪即時更新 (O(1))。
+    """
+
+    def __init__(self, messages: Optional[List[Dict[str, Any]]] = None):
+        self._messages: List[Dict[str, Any]] = []
+        self._costs: List[int] = []
+        self._exact: List[bool] = []  # 該則成本是否已由 count_tokens 校正
+        self.total_tokens = 0
+        if messages:
+            self.extend(messages)
+
+    # --- list 相容介面 ---
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._messages)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self._messages)
+
+    # --- 增刪 ---
+
+    def append(self, message: Dict[str, Any]):
+        cost = estimate_message_tokens(message)
+        self._messages.append(message)
+        self._costs.append(cost)
+        self._exact.append(False)
+        self.total_tokens += cost
+
+    def extend(self, messages: List[Dict[str, Any]]):
+        for message in messages:
+            self.append(message)
+
+    def insert_front(self, messages: List[Dict[str, Any]]):
+        """把較舊的訊息插到最前面 (延遲載入 DB 歷史用)"""
+        costs = [estimate_message_tokens(m) for m in messages]
+        self._messages[0:0] = list(messages)
+        self._costs[0:0] = costs
+        self._exact[0:0] = [False] * len(costs)
+        self.total_tokens += sum(costs)
+
+    def drop_front(self, count: int):
+        """刪除最舊的 count 則訊息"""
+        if count <= 0:
+            return
+        self.total_tokens -= sum(self._costs[:count])
+        del self._messages[:count]
+        del self._costs[:count]
+        del self._exact[:count]
+
+    # --- 查詢 ---
+
+    def cost(self, index: int) -> int:
+        return self._costs[index]
+
+    def split_index_for(self, target_tokens: int) -> int:
+        """回傳累積成本首次達到 target_tokens 的訊息索引 (找不到則為 0)"""
+        running = 0
+        for i, cost in enumerate(self._costs):
+            running += cost
+            if running >= target_tokens:
+                return i
+        return 0
+
+    # --- 精確計數 (可選) ---
+
+    async def refine_exact(self, client, model: str):
+        """
+        用 count_tokens 端點校正尚未校正的訊息成本 (並行呼叫，結果依內容雜湊快取)。
+        """
+        pending = [i for i, exact in enumerate(self._exact) if not exact]
+        if not pending:
+            return
+
+        snapshot = [(i, self._messages[i]) for i in pending]
+
+        async def _count(message):
+            key = _message_hash(message)
+            if key in _exact_cache:
+                _exact_cache.move_to_end(key)
+                return _exact_cache[key]
+            response = await client.aio.models.count_tokens(model=model, contents=[message])
+            tokens = response.total_tokens
+            _exact_cache[key] = tokens
+            while len(_exact_cache) > _EXACT_CACHE_SIZE:
+                _exact_cache.popitem(last=False)
+            return tokens
+
+        results = await asyncio.gather(*[_count(m) for _, m in snapshot], return_exceptions=True)
+
+        for (i, message), tokens in zip(snapshot, results):
+            if isinstance(tokens, BaseException) or tokens is None:
+                continue
+            # 等待期間 history 可能已被裁切，以物件身分重新定位
+            if i >= len(self._messages) or self._messages[i] is not message:
+                try:
+                    i = next(j for j, m in enumerate(self._messages) if m is message)
+                except StopIteration:
+                    continue
+            self.total_tokens += tokens - self._costs[i]
+            self._costs[i] = tokens
+            self._exact[i] = True
@@ -0,0 +1,83 @@
+"""
+HiHi 工具延遲統計 (Tool Metrics)
+每個 Agent 工具一份延遲直方圖，找出哪個工具拖慢回合
+
+功能：
+- 固定邊界的直方圖 (ms) — 記憶體用量固定，不保存原始樣本
+- 百分位數估計 — 由累積分桶推算 p50 / p95 (取桶的上界)
+- 結果分類 — ok / error / timeout 分開計數
+"""
+
+from typing import List, Dict, Any
+
+# 直方圖桶的上界 (毫秒)，最後一桶為 +Inf
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        for i, bound in enumerate(self.buckets):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct: float) -> float:
+        """回傳第 pct 百分位所在桶的上界 (不超過觀測到的最大值)"""
+        if not self.count:
+            return 0.0
+        target = pct / 100 * self.count
+        running = 0
+        for i, n in enumerate(self.counts):
+            running += n
+            if running >= target and n:
+                return min(float(self.buckets[i]), self.max_ms) if i < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 1),
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": {f"le_{b}": n for b, n in zip(self.buckets, self.counts)} | {"le_inf": self.counts[-1]},
+        }
+
+
+class ToolMetrics:
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._outcomes: Dict[str, Dict[str, int]] = {}
+        self.steps = 0
+        self.parallel_steps = 0  # 同一步驟中有 2 個以上工具並行
+
+    def observe(self, tool_name: str, ms: float, outcome: str = "ok"):
+        self._histograms.setdefault(tool_name, LatencyHistogram()).observe(ms)
+        outcomes = self._outcomes.setdefault(tool_name, {"ok": 0, "error": 0, "timeout": 0})
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def observe_step(self, tool_count: int):
+        self.steps += 1
+        if tool_count > 1:
+            self.parallel_steps += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """依總耗時排序 (最花時間的工具在前)"""
+        tools = {
+            name: {**hist.to_dict(), **self._outcomes.get(name, {})}
+            for name, hist in sorted(self._histograms.items(), key=lambda kv: kv[1].total_ms, reverse=True)
+        }
+        return {"steps": self.steps, "parallel_steps": self.parallel_steps, "tools": tools}
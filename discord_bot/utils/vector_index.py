@@ -0,0 +1,177 @@
+"""
+HiHi 本地向量索引 (Local Vector Index)
+小型、以讀取為主的表 (knowledge / facts) 的程序內向量搜尋
+
+功能：
+- NumPy float32 矩陣 — 每列預先正規化，cosine 相似度 = 一次矩陣乘法
+- 向量化 top-k — argpartition 取前 k 名，不排序整個結果
+- 寫入同步 (Write-Through) — upsert / remove 即時更新，不必重新載入
+- 容量倍增 — 新增時攤銷 O(1)，刪除以最後一列補位
+- NumPy 未安裝時 available = False，呼叫端改走 SQL
+"""
+
+import json
+import time
+from typing import List, Dict, Any, Optional, Callable, Hashable, Iterable, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 沒有 NumPy → 停用本地索引
+    np = None
+
+
+def parse_vector(value) -> Optional["np.ndarray"]:
+    """pgvector 文字格式 '[0.1,0.2,...]' 或 list → float32 陣列 (失敗回傳 None)"""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, str):
+            value = json.loads(value)
+        return np.asarray(value, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+
+
+class LocalVectorIndex:
+    available = np is not None
+
+    def __init__(self, name: str, dim: int = 768):
+        self.name = name
+        self.dim = dim
+        self.ready = False  # load() 完成後才可查詢
+
+        self._keys: List[Hashable] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._pos: Dict[Hashable, int] = {}
+        self._matrix = np.zeros((0, dim), dtype=np.float32) if np is not None else None
+
+        self.stats = {"queries": 0, "upserts": 0, "removes": 0, "last_query_us": 0.0}
+
+    def __len__(self):
+        return len(self._keys)
+
+    # =========================================================================
+    # ✏️ 載入 / 增刪
+    # =========================================================================
+
+    def load(self, rows: Iterable[Tuple[Hashable, Any, Dict[str, Any]]]):
+        """整批載入 (取代現有內容)。rows: (key, vector, payload)；向量無效的列略過。"""
+        self.swap(self.build(rows))
+
+    def build(self, rows: Iterable[Tuple[Hashable, Any, Dict[str, Any]]]) -> tuple:
+        """
+        只建立新內容、不動現有索引 (CPU 密集，可放在 asyncio.to_thread 執行)。
+        回傳值交給 swap() 在事件迴圈上一次替換，查詢不會讀到新舊混雜的狀態。
+        """
+        keys, payloads, vectors = [], [], []
+        for key, vector, payload in rows:
+            vec = self._normalize(parse_vector(vector))
+            if vec is None:
+                continue
+            keys.append(key)
+            payloads.append(payload)
+            vectors.append(vec)
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, self.dim), dtype=np.float32)
+        return keys, payloads, {key: i for i, key in enumerate(keys)}, matrix
+
+    def swap(self, built: tuple):
+        self._keys, self._payloads, self._pos, self._matrix = built
+        self.ready = True
+
+    def upsert(self, key: Hashable, vector, payload: Dict[str, Any]) -> bool:
+        vec = self._normalize(parse_vector(vector))
+        if vec is None:
+            return False
+        i = self._pos.get(key)
+        if i is None:
+            i = len(self._keys)
+            self._grow(i + 1)
+            self._keys.append(key)
+            self._payloads.append(payload)
+            self._pos[key] = i
+        else:
+            self._payloads[i] = payload
+        self._matrix[i] = vec
+        self.stats["upserts"] += 1
+        return True
+
+    def remove(self, key: Hashable) -> bool:
+        i = self._pos.pop(key, None)
+        if i is None:
+            return False
+        last = len(self._keys) - 1
+        if i != last:
+            # 最後一列搬到被刪的位置
+            self._keys[i] = self._keys[last]
+            self._payloads[i] = self._payloads[last]
+            self._matrix[i] = self._matrix[last]
+            self._pos[self._keys[i]] = i
+        self._keys.pop()
+        self._payloads.pop()
+        self.stats["removes"] += 1
+        return True
+
+    def remove_where(self, predicate: Callable[[Dict[str, Any]], bool]) -> int:
+        keys = [key for key, payload in zip(self._keys, self._payloads) if predicate(payload)]
+        for key in keys:
+            self.remove(key)
+        return len(keys)
+
+    # =========================================================================
+    # 🔍 查詢
+    # =========================================================================
+
+    def search(self, vector, k: int, threshold: Optional[float] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        回傳 [(payload, similarity), ...]，依相似度由高到低。
+        threshold: 只保留 similarity > threshold 的結果
+        """
+        start = time.perf_counter()
+        query = self._normalize(parse_vector(vector))
+        size = len(self._keys)
+        if query is None or size == 0 or k <= 0:
+            return []
+
+        scores = self._matrix[:size] @ query
+        if k < size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(size)
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if threshold is not None and score <= threshold:
+                break
+            results.append((self._payloads[i], score))
+
+        self.stats["queries"] += 1
+        self.stats["last_query_us"] = round((time.perf_counter() - start) * 1e6, 1)
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["size"] = len(self._keys)
+        stats["ready"] = self.ready
+        return stats
+
+    # =========================================================================
+    # ⚙️ 內部
+    # =========================================================================
+
+    def _normalize(self, vec):
+        if vec is None or vec.shape != (self.dim,):
+            return None
+        norm = float(np.linalg.norm(vec))
+        if norm == 0.0:
+            return None
+        return vec / norm
+
+    def _grow(self, needed: int):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        matrix = np.zeros((max(needed, capacity * 2, 64), self.dim), dtype=np.float32)
+        matrix[:len(self._keys)] = self._matrix[:len(self._keys)]
+        self._matrix = matrix
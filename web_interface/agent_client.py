@@ -0,0 +1,258 @@
+# agent_client.py — VM2 Agent 非同步連線 (Async Agent Client)
+"""
+控制面板 → VM2 remote_api 的非同步客戶端，取代每次都新開連線的 requests.post
+
+功能：
+- 共用連線池 — 單一 aiohttp ClientSession + TCPConnector (Keep-Alive)，不再佔用 FastAPI 的執行緒池
+- 每個 action 各自的逾時 — 讀狀態幾秒即可，上傳 / 更新伺服器給到數分鐘
+- 重試 + 抖動 (Jitter) — 只有可重複執行的 action (讀取類、覆寫檔案) 在連線錯誤 / 逾時時重試
+- 斷路器 (Circuit Breaker) — 連續失敗達門檻後直接回錯誤，冷卻後只放一個探測請求 (half-open)
+- 回傳格式與舊版 proxy_to_agent 相同：成功時為 Agent 回傳的 dict，失敗時 {"status": "error", "message": ...}
+"""
+
+import time
+import random
+import asyncio
+import aiohttp
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+# action → 逾時設定 (秒)
+ACTION_TIMEOUTS: Dict[str, aiohttp.ClientTimeout] = {
+    "default": aiohttp.ClientTimeout(total=5, connect=2),
+    "ping": aiohttp.ClientTimeout(total=2, connect=1),
+    "get_stats": aiohttp.ClientTimeout(total=3, connect=1),
+    "get_system_status": aiohttp.ClientTimeout(total=3, connect=1),
+    "write_file": aiohttp.ClientTimeout(total=10, connect=2),
+    "reset_world": aiohttp.ClientTimeout(total=120, connect=2),
+    "upload_zip": aiohttp.ClientTimeout(total=300, connect=2),
+    "upload_addon": aiohttp.ClientTimeout(total=300, connect=2),
+    "download_world": aiohttp.ClientTimeout(total=300, connect=2),
+    "update_server": aiohttp.ClientTimeout(total=600, connect=2),
+    "batch": aiohttp.ClientTimeout(total=30, connect=2),
+}
+
+# 重送不會造成副作用的 action (execute_command / start_screen 等絕不重試)
+IDEMPOTENT_ACTIONS = {
+    "get_stats", "get_system_status", "read_file", "read_log_tail",
+    "list_worlds", "list_addons", "write_file",
+}
+
+# 與 remote_api.BATCH_MAX_ITEMS 相同：超過時 Agent 會拒絕整批，call_batch 自動切段
+BATCH_MAX_ITEMS = 64
+
+# 斷路器狀態
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class AgentClient:
+    def __init__(self, ip_provider: Callable[[], Awaitable[Optional[str]]], port: int, secret: str,
+                 retries: int = 2, backoff_base: float = 0.2, backoff_max: float = 2.0,
+                 failure_threshold: int = 3, cooldown: float = 15.0,
+                 limit_per_host: int = 8, keepalive_timeout: float = 30.0):
+        """
+        ip_provider: 取得 VM2 內網 IP 的 async 函式 (VM2 關機時回傳 None)
+        retries: 可重試 action 的額外嘗試次數
+        backoff_base / backoff_max: 指數退避 (Full Jitter) 的基準與上限秒數
+        failure_threshold / cooldown: 連續幾次連線失敗後斷路、斷路多久後再探測
+        """
+        self.ip_provider = ip_provider
+        self.port = port
+        self.secret = secret
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        self.stats = {
+            "calls": 0, "errors": 0, "retries": 0, "short_circuits": 0,
+            "breaker_trips": 0, "new_connections": 0, "reused_connections": 0,
+        }
+
+    # =========================================================================
+    # 🔌 生命週期
+    # =========================================================================
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._count("new_connections"))
+            trace.on_connection_reuseconn.append(self._count("reused_connections"))
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.limit_per_host,
+                                               keepalive_timeout=self.keepalive_timeout),
+                headers={"Authorization": f"Bearer {self.secret}"},
+                timeout=ACTION_TIMEOUTS["default"],
+                trace_configs=[trace],
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def reset(self):
+        """VM2 重新開機 (IP 可能改變) 後清除斷路狀態"""
+        self._state = CLOSED
+        self._failures = 0
+        self._probing = False
+
+    # =========================================================================
+    # 📡 呼叫
+    # =========================================================================
+
+    async def call(self, action: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """POST {"action": action, **payload} 到 Agent"""
+        self.stats["calls"] += 1
+        ip = await self.ip_provider()
+        if not ip:
+            return {"status": "error", "message": "VM2 offline"}
+        if not self._allow():
+            self.stats["short_circuits"] += 1
+            return {"status": "error", "message": "VM2 agent unavailable (circuit open)"}
+
+        body = {"action": action, **(payload or {})}
+        timeout = ACTION_TIMEOUTS.get(action, ACTION_TIMEOUTS["default"])
+        attempts = 1 + (self.retries if self._idempotent(action, body) else 0)
+        last_error: Exception = RuntimeError("no attempt")
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(self._backoff(attempt))
+                try:
+                    async with self._get_session().post(f"http://{ip}:{self.port}/", json=body, timeout=timeout) as resp:
+                        result = await self._read(resp)
+                    self._on_success()
+                    return result
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    last_error = e
+                except Exception as e:
+                    # 非連線問題 (例如回應不是 JSON) → Agent 活著，不計入斷路
+                    self._on_success()
+                    self.stats["errors"] += 1
+                    return {"status": "error", "message": str(e)}
+        finally:
+            # 探測請求被取消 (例如瀏覽器斷線) 時也要釋放，否則 half-open 會一直卡住
+            self._probing = False
+
+        self._on_failure()
+        self.stats["errors"] += 1
+        return {"status": "error", "message": str(last_error) or type(last_error).__name__}
+
+    async def call_batch(self, items: List[Dict[str, Any]], stop_on_error: bool = False) -> List[Dict[str, Any]]:
+        """
+        一次往返執行多個子動作 (Agent 端 batch action)，回傳與 items 同順序的結果。
+        超過 BATCH_MAX_ITEMS 時依序分段送出；某段整批失敗 (連線錯誤等) 時該段每個項目都回傳同一個錯誤。
+        stop_on_error 時，前段有失敗則後段不送出，標記為 skipped (與 Agent 端相同)。
+        """
+        results: List[Dict[str, Any]] = []
+        for start in range(0, len(items), BATCH_MAX_ITEMS):
+            chunk = items[start:start + BATCH_MAX_ITEMS]
+            if stop_on_error and any(r.get("status") != "success" for r in results):
+                results.extend({"action": item.get("action"), "code": 424, "status": "skipped",
+                                "message": "Skipped after a previous failure"} for item in chunk)
+                continue
+            results.extend(await self._call_batch_chunk(chunk, stop_on_error))
+        return results
+
+    async def _call_batch_chunk(self, items: List[Dict[str, Any]], stop_on_error: bool) -> List[Dict[str, Any]]:
+        res = await self.call("batch", {"items": items, "stop_on_error": stop_on_error})
+        results = res.get("results")
+        if res.get("status") != "success" or not isinstance(results, list) or len(results) != len(items):
+            error = {"status": "error", "message": res.get("message", "Invalid batch response")}
+            return [dict(error) for _ in items]
+        return results
+
+    async def ping(self) -> bool:
+        """GET / 確認 Agent 已啟動 (不受斷路器限制，成功時關閉斷路器)"""
+        ip = await self.ip_provider()
+        if not ip:
+            return False
+        try:
+            async with self._get_session().get(f"http://{ip}:{self.port}/", timeout=ACTION_TIMEOUTS["ping"]) as resp:
+                ok = resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+        if ok:
+            self.reset()
+        return ok
+
+    @staticmethod
+    async def _read(resp: aiohttp.ClientResponse) -> Dict[str, Any]:
+        if resp.status >= 400:
+            text = await resp.text()
+            try:
+                data = await resp.json(content_type=None)
+                if isinstance(data, dict) and data.get("message"):
+                    return {"status": "error", "message": data["message"]}
+            except ValueError:
+                pass
+            return {"status": "error", "message": f"HTTP {resp.status}: {text[:200]}"}
+        return await resp.json(content_type=None)
+
+    @staticmethod
+    def _idempotent(action: str, body: Dict[str, Any]) -> bool:
+        if action == "batch":
+            return all(isinstance(i, dict) and i.get("action") in IDEMPOTENT_ACTIONS for i in body.get("items") or [])
+        return action in IDEMPOTENT_ACTIONS
+
+    def _backoff(self, attempt: int) -> float:
+        # Full Jitter：避免多個請求在同一時間點一起重試
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    # =========================================================================
+    # 🔌 斷路器
+    # =========================================================================
+
+    def _allow(self) -> bool:
+        if self._state == CLOSED:
+            return True
+        if self._state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._state = HALF_OPEN
+        # HALF_OPEN：同一時間只放一個探測請求
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def _on_success(self):
+        if self._state != CLOSED:
+            print("🟢 [Agent] VM2 Agent 恢復連線，斷路器關閉")
+        self.reset()
+
+    def _on_failure(self):
+        self._probing = False
+        self._failures += 1
+        if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+            if self._state == CLOSED:
+                print(f"🔴 [Agent] 連續 {self._failures} 次連線失敗，斷路 {self.cooldown:.0f} 秒")
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+            self.stats["breaker_trips"] += 1
+
+    # =========================================================================
+    # 📊 統計
+    # =========================================================================
+
+    def _count(self, key: str):
+        async def _inc(session, ctx, params):
+            self.stats[key] += 1
+        return _inc
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["breaker"] = self._state
+        stats["consecutive_failures"] = self._failures
+        return stats
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 import os
 import sys
 import base64
+import asyncio
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
 import proxy_helpers
@@ -10,7 +11,7 @@ from dependencies import get_instance_or_404, verify_key
 
 router = APIRouter(tags=["addons"])
 
-def get_instance(key: str, instance_id: str = "main"):
+async def get_instance(key: str, instance_id: str = "main"):
     verify_key(key)
     return get_instance_or_404(instance_id)
 
@@ -19,12 +20,12 @@ class DeleteAddonRequest(BaseModel):
     type: str = "behavior_packs"
 
 @router.get("/addons")
-def list_addons(instance = Depends(get_instance)):
+async def list_addons(instance = Depends(get_instance)):
     """列出所有已安裝模組"""
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         return {"addons": []}
 
-    res = proxy_helpers.proxy_to_agent("list_addons", path=instance.path)
+    res = await proxy_helpers.proxy_to_agent_async("list_addons", path=instance.path)
     if res.get('status') == 'success':
         return {"addons": res.get("addons", [])}
     else:
@@ -38,17 +39,17 @@ async def upload_addon(
     file: UploadFile = File(...)
 ):
     """上傳模組檔案"""
-    instance = get_instance(key, instance_id)
+    instance = await get_instance(key, instance_id)
 
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         raise HTTPException(status_code=409, detail="VM2 is offline")
     try:
         file_data = await file.read()
         original_filename = file.filename or "addon.zip"
         
-        encoded_data = base64.b64encode(file_data).decode('utf-8')
+        encoded_data = await asyncio.to_thread(lambda: base64.b64encode(file_data).decode('utf-8'))
 
-        res = proxy_helpers.proxy_to_agent("upload_addon",
+        res = await proxy_helpers.proxy_to_agent_async("upload_addon",
             path=instance.path, addon_type=type,
             original_filename=original_filename, file_data_base64=encoded_data)
 
@@ -64,16 +65,16 @@ async def upload_addon(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/addon/delete")
-def delete_addon(req: DeleteAddonRequest, instance = Depends(get_instance)):
+async def delete_addon(req: DeleteAddonRequest, instance = Depends(get_instance)):
     """刪除模組"""
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         raise HTTPException(status_code=409, detail="VM2 is offline")
 
     if not req.name:
         raise HTTPException(status_code=400, detail="No addon name")
 
     try:
-        proxy_helpers.proxy_to_agent("delete_dir", path=os.path.join(instance.path, req.type, req.name))
+        await proxy_helpers.proxy_to_agent_async("delete_dir", path=os.path.join(instance.path, req.type, req.name))
         return {"status": "deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -9,7 +9,7 @@ from dependencies import get_instance_or_404, verify_key
 
 router = APIRouter(tags=["files"])
 
-def get_instance(key: str, instance_id: str = "main"):
+async def get_instance(key: str, instance_id: str = "main"):
     verify_key(key)
     return get_instance_or_404(instance_id)
 
@@ -18,7 +18,7 @@ class WriteRequest(BaseModel):
     content: str
 
 @router.get("/read")
-def read_file(file: str, lines: str = "", instance = Depends(get_instance)):
+async def read_file(file: str, lines: str = "", instance = Depends(get_instance)):
     """讀取設定檔 (server.properties, allowlist.json 等)"""
     allowed_files = ['server.properties', 'whitelist.json', 'permissions.json', 'allowlist.json', 'bedrock_screen.log']
     if file not in allowed_files:
@@ -31,11 +31,11 @@ def read_file(file: str, lines: str = "", instance = Depends(get_instance)):
     if cached_content is not None:
         return {"content": cached_content, "source": "offline_cache"}
 
-    if proxy_helpers.is_vm2_running():
+    if await proxy_helpers.is_vm2_running_async():
         if lines and lines.isdigit():
-            res = proxy_helpers.proxy_to_agent("read_log_tail", filepath=fpath, lines=int(lines))
+            res = await proxy_helpers.proxy_to_agent_async("read_log_tail", filepath=fpath, lines=int(lines))
         else:
-            res = proxy_helpers.proxy_to_agent("read_file", filepath=fpath)
+            res = await proxy_helpers.proxy_to_agent_async("read_file", filepath=fpath)
 
         if res.get('status') == 'success':
             return {"content": res.get('content', '')}
@@ -45,7 +45,7 @@ def read_file(file: str, lines: str = "", instance = Depends(get_instance)):
         raise HTTPException(status_code=404, detail="VM2 is offline and no cache available")
 
 @router.post("/write")
-def write_file(req: WriteRequest, instance = Depends(get_instance)):
+async def write_file(req: WriteRequest, instance = Depends(get_instance)):
     """覆寫設定檔"""
     allowed_files = ['server.properties', 'whitelist.json', 'permissions.json', 'allowlist.json']
     if req.file not in allowed_files:
@@ -54,8 +54,8 @@ def write_file(req: WriteRequest, instance = Depends(get_instance)):
     full_dest = os.path.join(instance.path, req.file)
 
     try:
-        if proxy_helpers.is_vm2_running():
-            res = proxy_helpers.proxy_to_agent("write_file", filepath=full_dest, content=req.content)
+        if await proxy_helpers.is_vm2_running_async():
+            res = await proxy_helpers.proxy_to_agent_async("write_file", filepath=full_dest, content=req.content)
             if res.get('status') == 'success':
                 return {"status": "saved"}
             else:
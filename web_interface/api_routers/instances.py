@@ -4,6 +4,7 @@ import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+import proxy_helpers
 from dependencies import instance_manager, verify_key
 
 router = APIRouter(tags=["instances"], prefix="/instances")
@@ -27,12 +28,16 @@ class UpdateInstanceReq(BaseModel):
     discord_channel_id: str = ""
 
 @router.get("/list", dependencies=[Depends(require_key)])
-def list_instances():
+async def list_instances():
     """列出所有伺服器實例"""
+    # 所有實例共用一次 get_system_status 查詢
+    status = None
+    if await proxy_helpers.is_vm2_running_async():
+        status = await proxy_helpers.proxy_to_agent_async("get_system_status")
     insts = []
     for i in instance_manager.get_all_instances():
         d = i.to_dict()
-        d['is_running'] = i.is_running()
+        d['is_running'] = await i.is_running_async(status)
         insts.append(d)
     return {"instances": insts}
 
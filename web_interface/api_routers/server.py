@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 import subprocess
+import asyncio
 import time
 import re
 import os
@@ -17,43 +18,32 @@ class CommandRequest(BaseModel):
     cmd: str
 
 # 依賴注入：驗證 Key 並取得當前實例
-def get_instance(key: str, instance_id: str = "main"):
+async def get_instance(key: str, instance_id: str = "main"):
     verify_key(key)
     return get_instance_or_404(instance_id)
 
 @router.post("/start")
-def start_server_post(instance = Depends(get_instance)):
+async def start_server_post(instance = Depends(get_instance)):
     """透過 VM2 啟動伺服器"""
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         # 如果 VM2 離線，發起自動開機並等待
-        started = proxy_helpers.start_vm2_and_wait()
+        started = await proxy_helpers.start_vm2_and_wait_async()
         if not started:
             raise HTTPException(status_code=500, detail="嘗試啟動 Google Cloud 虛擬主機失敗，請稍後再試。")
     
+    # 重試等待伺服器內的 Proxy Agent 起床 (最多等待 30 秒)
+    if not await proxy_helpers.wait_for_agent():
+        raise HTTPException(status_code=500, detail="已啟動 VM2，但無法連線至內部的管理代理程式。")
+
     # 將離線編輯的檔案寫回伺服器
-    proxy_helpers.flush_offline_cache()
+    await proxy_helpers.flush_offline_cache_async()
     
-    try:
-        # 重試等待伺服器內的 Proxy Agent 起床 (最多等待 30 秒)
-        agent_ready = False
-        for i in range(15):
-            res = proxy_helpers.proxy_to_agent("execute_command", screen_name=instance.screen_name, command="")
-            if res.get('status') == 'success':
-                agent_ready = True
-                break
-            time.sleep(2)
-            
-        if not agent_ready:
-            raise HTTPException(status_code=500, detail="已啟動 VM2，但無法連線至內部的管理代理程式。")
-            
-        # 執行開機腳本
-        res = proxy_helpers.proxy_to_agent("start_screen", screen_name=instance.screen_name, path=instance.path)
-        if res.get('status') == 'success':
-            return {"status": "started"}
-        else:
-            raise HTTPException(status_code=500, detail=res.get("message"))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # 執行開機腳本
+    res = await proxy_helpers.proxy_to_agent_async("start_screen", screen_name=instance.screen_name, path=instance.path)
+    if res.get('status') == 'success':
+        return {"status": "started"}
+    else:
+        raise HTTPException(status_code=500, detail=res.get("message"))
 
 @router.get("/start")
 def start_server_get(instance = Depends(get_instance)):
@@ -68,23 +58,23 @@ def start_server_get(instance = Depends(get_instance)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/stop")
-def stop_server_post(instance = Depends(get_instance)):
+async def stop_server_post(instance = Depends(get_instance)):
     """透過 VM2 關閉伺服器並標記準備斷電"""
     try:
-        if proxy_helpers.is_vm2_running():
+        if await proxy_helpers.is_vm2_running_async():
             # 寫入狀態標記
             pending_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../.pending_vm_shutdown')
             with open(pending_file, 'w') as f:
                 f.write('manual_web')
                 
             try:
-                proxy_helpers.backup_all_instances_to_cache()
+                await proxy_helpers.backup_all_instances_to_cache_async()
             except Exception as e:
                 print(f"[Web Shutdown] Backup failed: {e}")
             
-            proxy_helpers.proxy_to_agent("execute_command", screen_name=instance.screen_name, command="say 網頁面板發起安全關機指令，系統執行存檔並準備斷電...\r")
-            time.sleep(1)
-            proxy_helpers.proxy_to_agent("execute_command", screen_name=instance.screen_name, command="stop\r")
+            await proxy_helpers.proxy_to_agent_async("execute_command", screen_name=instance.screen_name, command="say 網頁面板發起安全關機指令，系統執行存檔並準備斷電...\r")
+            await asyncio.sleep(1)
+            await proxy_helpers.proxy_to_agent_async("execute_command", screen_name=instance.screen_name, command="stop\r")
             
         return {"status": "stopping_and_powering_off"}
     except Exception as e:
@@ -102,16 +92,16 @@ def stop_server_get(instance = Depends(get_instance)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/command")
-def send_command(req: CommandRequest, instance = Depends(get_instance)):
+async def send_command(req: CommandRequest, instance = Depends(get_instance)):
     """發送指令到伺服器"""
     cmd = req.cmd
     if not cmd:
         raise HTTPException(status_code=400, detail="No command provided")
     try:
-        if proxy_helpers.is_vm2_running():
-            proxy_helpers.proxy_to_agent("execute_command", screen_name=instance.screen_name, command=cmd)
+        if await proxy_helpers.is_vm2_running_async():
+            await proxy_helpers.proxy_to_agent_async("execute_command", screen_name=instance.screen_name, command=cmd)
             if cmd.strip() in ['list', 'gamerule ']:
-                time.sleep(1.0)
+                await asyncio.sleep(1.0)
         return {"result": "sent"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -134,11 +124,14 @@ def exec_command(req: CommandRequest, instance = Depends(get_instance)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/server_status")
-def get_server_status(instance = Depends(get_instance)):
+async def get_server_status(instance = Depends(get_instance)):
     """查詢 VM2 虛擬機與遊戲伺服器的運行狀態"""
-    vm2_online = proxy_helpers.is_vm2_running()
-    game_running = instance.is_running() if vm2_online else False
-    public_ip = proxy_helpers.get_vm2_public_ip() if vm2_online else None
+    vm2_online = await proxy_helpers.is_vm2_running_async()
+    game_running, public_ip = False, None
+    if vm2_online:
+        game_running, public_ip = await asyncio.gather(
+            instance.is_running_async(), proxy_helpers.get_vm2_public_ip_async()
+        )
     
     return {
         "vm2_online": vm2_online,
@@ -147,7 +140,7 @@ def get_server_status(instance = Depends(get_instance)):
     }
 
 @router.get("/stats")
-def get_stats(instance = Depends(get_instance)):
+async def get_stats(instance = Depends(get_instance)):
     """查詢系統資源 (CPU/RAM/Disk/Network)"""
     # 預設空值 (VM2 離線時的回傳)
     default_stats = {
@@ -163,8 +156,8 @@ def get_stats(instance = Depends(get_instance)):
     }
 
     try:
-        if proxy_helpers.is_vm2_running():
-            res = proxy_helpers.proxy_to_agent("get_stats")
+        if await proxy_helpers.is_vm2_running_async():
+            res = await proxy_helpers.proxy_to_agent_async("get_stats")
             if res.get("status") == "success" and "stats" in res:
                 return res["stats"]
             
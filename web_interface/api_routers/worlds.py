@@ -4,6 +4,7 @@ from pydantic import BaseModel
 import os
 import sys
 import base64
+import asyncio
 import io
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
@@ -12,7 +13,7 @@ from dependencies import get_instance_or_404, verify_key
 
 router = APIRouter(tags=["worlds"])
 
-def get_instance(key: str, instance_id: str = "main"):
+async def get_instance(key: str, instance_id: str = "main"):
     verify_key(key)
     return get_instance_or_404(instance_id)
 
@@ -23,28 +24,28 @@ class UpdateRequest(BaseModel):
     url: str
 
 @router.get("/worlds")
-def list_worlds(instance = Depends(get_instance)):
+async def list_worlds(instance = Depends(get_instance)):
     """列出所有世界"""
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         return {"worlds": [], "active": "Offline"}
 
-    res = proxy_helpers.proxy_to_agent("list_worlds", path=instance.path)
+    res = await proxy_helpers.proxy_to_agent_async("list_worlds", path=instance.path)
     if res.get('status') == 'success':
         return {"worlds": res.get("worlds", []), "active": res.get("active", "")}
     else:
         raise HTTPException(status_code=500, detail=res.get("message"))
 
 @router.post("/switch_world")
-def switch_world(req: WorldRequest, instance = Depends(get_instance)):
+async def switch_world(req: WorldRequest, instance = Depends(get_instance)):
     """切換使用的世界"""
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         raise HTTPException(status_code=409, detail="VM2 is offline")
     if not req.world:
         raise HTTPException(status_code=400, detail="No world name provided")
     
     try:
         props_path = os.path.join(instance.path, 'server.properties')
-        res = proxy_helpers.proxy_to_agent("read_file", filepath=props_path)
+        res = await proxy_helpers.proxy_to_agent_async("read_file", filepath=props_path)
 
         if res.get('status') == 'success':
             content = res.get('content', '')
@@ -59,34 +60,34 @@ def switch_world(req: WorldRequest, instance = Depends(get_instance)):
             if not found:
                 new_content += f"level-name={req.world}\n"
 
-            proxy_helpers.proxy_to_agent("write_file", filepath=props_path, content=new_content)
+            await proxy_helpers.proxy_to_agent_async("write_file", filepath=props_path, content=new_content)
 
         return {"status": "switched"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/delete_world")
-def delete_world(req: WorldRequest, instance = Depends(get_instance)):
+async def delete_world(req: WorldRequest, instance = Depends(get_instance)):
     """刪除世界"""
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         raise HTTPException(status_code=409, detail="VM2 is offline")
 
     if req.world:
-        proxy_helpers.proxy_to_agent("delete_dir", path=os.path.join(instance.path, 'worlds', req.world))
+        await proxy_helpers.proxy_to_agent_async("delete_dir", path=os.path.join(instance.path, 'worlds', req.world))
         return {"status": "deleted"}
     raise HTTPException(status_code=400, detail="No world name provided")
 
 @router.post("/reset_world")
-def reset_world(instance = Depends(get_instance)):
+async def reset_world(instance = Depends(get_instance)):
     """重置世界地形 (保留設定與模組)"""
     try:
-        if not proxy_helpers.is_vm2_running():
+        if not await proxy_helpers.is_vm2_running_async():
             raise HTTPException(status_code=409, detail="VM2 is offline")
 
         # 讀取使用中的世界名稱
         active_world = ''
         props_path = os.path.join(instance.path, 'server.properties')
-        res_props = proxy_helpers.proxy_to_agent("read_file", filepath=props_path)
+        res_props = await proxy_helpers.proxy_to_agent_async("read_file", filepath=props_path)
         if res_props.get('status') == 'success':
             content = res_props.get('content', '')
             for line in content.splitlines():
@@ -97,7 +98,7 @@ def reset_world(instance = Depends(get_instance)):
         if not active_world:
             raise HTTPException(status_code=400, detail="Cannot determine active world")
 
-        res = proxy_helpers.proxy_to_agent("reset_world",
+        res = await proxy_helpers.proxy_to_agent_async("reset_world",
             path=os.path.join(instance.path, 'worlds', active_world),
             screen_name=instance.screen_name)
 
@@ -119,14 +120,14 @@ async def upload_world(
     file: UploadFile = File(...)
 ):
     """上傳世界地圖 (.mcworld / .zip)"""
-    instance = get_instance(key, instance_id)
+    instance = await get_instance(key, instance_id)
     
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         raise HTTPException(status_code=409, detail="VM2 is offline")
     try:
         file_data = await file.read()
-        encoded_data = base64.b64encode(file_data).decode('utf-8')
-        res = proxy_helpers.proxy_to_agent("upload_zip",
+        encoded_data = await asyncio.to_thread(lambda: base64.b64encode(file_data).decode('utf-8'))
+        res = await proxy_helpers.proxy_to_agent_async("upload_zip",
             path=os.path.join(instance.path, 'worlds'), file_data_base64=encoded_data)
 
         if res.get('status') == 'success':
@@ -137,17 +138,17 @@ async def upload_world(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/download")
-def download_world(world: str, instance = Depends(get_instance)):
+async def download_world(world: str, instance = Depends(get_instance)):
     """下載世界地圖為 zip"""
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         raise HTTPException(status_code=409, detail="VM2 is offline")
     if not world:
         raise HTTPException(status_code=400, detail="No world specified")
 
     try:
-        res = proxy_helpers.proxy_to_agent("download_world", path=os.path.join(instance.path, 'worlds', world))
+        res = await proxy_helpers.proxy_to_agent_async("download_world", path=os.path.join(instance.path, 'worlds', world))
         if res.get('status') == 'success' and 'base64_data' in res:
-            data = base64.b64decode(res['base64_data'])
+            data = await asyncio.to_thread(base64.b64decode, res['base64_data'])
             return StreamingResponse(
                 io.BytesIO(data), 
                 media_type="application/zip",
@@ -159,15 +160,15 @@ def download_world(world: str, instance = Depends(get_instance)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/update")
-def update_server(req: UpdateRequest, instance = Depends(get_instance)):
+async def update_server(req: UpdateRequest, instance = Depends(get_instance)):
     """更新伺服器版本"""
     if not req.url:
         raise HTTPException(status_code=400, detail="No URL provided")
-    if not proxy_helpers.is_vm2_running():
+    if not await proxy_helpers.is_vm2_running_async():
         raise HTTPException(status_code=409, detail="VM2 is offline")
 
     try:
-        res = proxy_helpers.proxy_to_agent("update_server",
+        res = await proxy_helpers.proxy_to_agent_async("update_server",
             path=instance.path, url=req.url, screen_name=instance.screen_name)
         if res.get('status') == 'success':
             return {"status": "updated"}
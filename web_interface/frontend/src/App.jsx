@@ -49,7 +49,7 @@ function App() {
   const [publicIp, setPublicIp] = useState(window.location.hostname);
 
   // === 智慧型連線 (Smart Connection) ===
-  const { isConnected, serverState, logs: wsLogs, sendCommand } = useSmartSocket();
+  const { isConnected, serverState, logs: wsLogs, sendCommand } = useSmartSocket(currentInstance);
 
   const loadInstances = async () => {
       try {
@@ -15,11 +15,13 @@ const getWsUrl = () => {
     return `${protocol}//${host}:${port}/ws?key=${apiKey}`;
 };
 
-export function useSmartSocket() {
+// instanceId: 目前檢視的實例 (VM2 會推播所有實例的 log，這裡只保留該實例的)
+export function useSmartSocket(instanceId = 'main') {
     const [isConnected, setIsConnected] = useState(false);
     const [serverState, setServerState] = useState(null);
     const [logs, setLogs] = useState([]);
 
+    const instanceRef = useRef(instanceId);
     const wsRef = useRef(null);
     const reconnectTimeoutRef = useRef(null);
     const pingIntervalRef = useRef(null);
@@ -57,9 +59,15 @@ export function useSmartSocket() {
                     setServerState(message.data);
                 }
                 else if (message.type === 'console_log') {
-                    // 新增收到的 log
+                    // 沒有 instance 欄位的是舊版 Agent 的推播，一律顯示
+                    if (message.instance && message.instance !== instanceRef.current) return;
                     setLogs(prev => [...prev, message.data]);
                 }
+                else if (message.type === 'stream_gap') {
+                    // VM2 推播過載時丟棄的 log 行數
+                    if (message.instance && message.instance !== instanceRef.current) return;
+                    setLogs(prev => [...prev, `[WARN] 串流過載，略過 ${message.dropped} 行 log`]);
+                }
             } catch (err) {
                 console.error('[useSmartSocket] Parse Error:', err);
             }
@@ -84,6 +92,12 @@ export function useSmartSocket() {
         wsRef.current = ws;
     }, []);
 
+    // 切換實例時清空 log (其他實例的 log 不再顯示)
+    useEffect(() => {
+        instanceRef.current = instanceId;
+        setLogs([]);
+    }, [instanceId]);
+
     // 掛載時啟動連線，卸載時關閉
     useEffect(() => {
         connect();
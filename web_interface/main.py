@@ -34,6 +34,12 @@ from api_routers import websocket_router
 app.include_router(websocket_router.router)
 app.include_router(server_router.router)
 
+@app.on_event("shutdown")
+async def close_agent_client():
+    # 關閉與 VM2 Agent 的共用連線池
+    import proxy_helpers
+    await proxy_helpers.agent.close()
+
 @app.get("/debug_ping")
 def debug_ping():
     return {"status": "ok_from_main"}
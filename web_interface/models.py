@@ -59,6 +59,17 @@ class Instance:
         # 退而求其次回傳 True (反映「VM2 開機中」而非絕對離線)
         return True
 
+    async def is_running_async(self, status=None):
+        """is_running 的非同步版本；status 可傳入已查好的 get_system_status 結果 (多個實例共用一次查詢)"""
+        import proxy_helpers
+        if not await proxy_helpers.is_vm2_running_async():
+            return False
+        if status is None:
+            status = await proxy_helpers.proxy_to_agent_async("get_system_status")
+        if isinstance(status, dict) and status.get("status") == "success":
+            return self.screen_name in status.get("screens", [])
+        return True
+
 
 class InstanceManager:
     """管理所有伺服器實例的新增、刪除、更新"""
@@ -49,9 +49,14 @@ def get_vm2_public_ip():
         _vm_cache['public_ip_time'] = time.time()
     return _vm_cache['public_ip']
 
+def _invalidate_vm_cache():
+    # 強制清除快取，以取得新 IP
+    _vm_cache['status_time'] = 0
+    _vm_cache['ip_time'] = 0
+    _vm_cache['public_ip_time'] = 0
+
 def start_vm2_and_wait():
     """發送開機指令並等待 VM 進入 RUNNING 狀態"""
-    global _vm_cache
     if is_vm2_running(): return True
     
     # 送出開機請求
@@ -63,17 +68,70 @@ def start_vm2_and_wait():
         time.sleep(2)
         status = gcp.get_instance_status(VM_NAME)
         if status == "RUNNING":
-            # 強制清除快取，以取得新 IP
-            _vm_cache['status_time'] = 0
-            _vm_cache['ip_time'] = 0
-            _vm_cache['public_ip_time'] = 0
+            _invalidate_vm_cache()
             return True
             
     return False
 
+# ==========================================
+# 非同步版本 (FastAPI 路由使用，不佔用執行緒池)
+# ==========================================
+_gcp_lock = asyncio.Lock()
+
+async def _cached_async(fn, key):
+    """快取有效時直接回傳；過期時只讓一個請求到執行緒裡查 GCP，其餘等同一次結果"""
+    if time.time() - _vm_cache[key + '_time'] <= CACHE_TTL:
+        return _vm_cache[key]
+    async with _gcp_lock:
+        return await asyncio.to_thread(fn)
+
+async def is_vm2_running_async():
+    return await _cached_async(is_vm2_running, 'status')
+
+async def get_vm2_ip_async():
+    return await _cached_async(get_vm2_ip, 'ip')
+
+async def get_vm2_public_ip_async():
+    return await _cached_async(get_vm2_public_ip, 'public_ip')
+
+async def start_vm2_and_wait_async():
+    """start_vm2_and_wait 的非同步版本 (以 asyncio.sleep 輪詢)"""
+    if await is_vm2_running_async(): return True
+    if not await asyncio.to_thread(gcp.start_instance, VM_NAME): return False
+
+    for _ in range(15):
+        await asyncio.sleep(2)
+        status = await asyncio.to_thread(gcp.get_instance_status, VM_NAME)
+        if status == "RUNNING":
+            _invalidate_vm_cache()
+            agent.reset()
+            return True
+    return False
+
+from agent_client import AgentClient, BATCH_MAX_ITEMS
+
+# 共用的 Agent 連線 (Keep-Alive 連線池 + 斷路器)
+agent = AgentClient(ip_provider=get_vm2_ip_async, port=AGENT_PORT, secret=AGENT_SECRET)
+
+async def proxy_to_agent_async(action, **kwargs):
+    return await agent.call(action, kwargs)
+
+async def proxy_batch_async(items, stop_on_error=False):
+    """多個動作合併成一次 batch 請求，回傳與 items 同順序的結果"""
+    return await agent.call_batch(items, stop_on_error=stop_on_error)
+
+async def wait_for_agent(attempts=15, interval=2):
+    """等待 VM2 內的 Agent 起床 (開機後最多約 30 秒)"""
+    for _ in range(attempts):
+        if await agent.ping():
+            return True
+        await asyncio.sleep(interval)
+    return False
+
 import requests
 
 def proxy_to_agent(action, **kwargs):
+    """同步版本：給 Discord Bot 等不在面板事件迴圈裡的呼叫端使用"""
     ip = get_vm2_ip()
     if not ip:
         return {"status": "error", "message": "VM2 offline"}
@@ -141,29 +199,66 @@ def backup_all_instances_to_cache():
         return
 
     allowed_files = ['server.properties', 'whitelist.json', 'permissions.json', 'allowlist.json']
-    for inst in mgr.get_all_instances():
-        for fname in allowed_files:
-            fpath = os.path.join(inst.path, fname)
-            res = proxy_to_agent("read_file", filepath=fpath)
-            if isinstance(res, dict) and res.get("status") == "success":
-                save_offline_backup(inst.path, fname, res.get("content"))
+    targets = [(inst.path, fname) for inst in mgr.get_all_instances() for fname in allowed_files]
+    # Agent 單次 batch 最多 BATCH_MAX_ITEMS 項，超過就分段
+    for start in range(0, len(targets), BATCH_MAX_ITEMS):
+        chunk = targets[start:start + BATCH_MAX_ITEMS]
+        res = proxy_to_agent("batch", items=[
+            {"action": "read_file", "filepath": os.path.join(path, fname)} for path, fname in chunk
+        ])
+        for (path, fname), item in zip(chunk, res.get("results") or []):
+            if isinstance(item, dict) and item.get("status") == "success":
+                save_offline_backup(path, fname, item.get("content"))
 
-def flush_offline_cache():
-    clear_offline_backup() # 通電開機後備份即無效
-    if not is_vm2_running(): return
-    if not os.path.exists(SYNC_DIR): return
-    
+async def backup_all_instances_to_cache_async():
+    """關機前以 batch 拉取所有實例的設定檔備份 (超過上限時 call_batch 自動分段)"""
+    if not await is_vm2_running_async(): return
+    try:
+        from models import InstanceManager
+        mgr = InstanceManager()
+    except Exception as e:
+        print("[ProxyHelper] Cannot load models: ", e)
+        return
+
+    allowed_files = ['server.properties', 'whitelist.json', 'permissions.json', 'allowlist.json']
+    targets = [(inst.path, fname) for inst in mgr.get_all_instances() for fname in allowed_files]
+    results = await proxy_batch_async([
+        {"action": "read_file", "filepath": os.path.join(path, fname)} for path, fname in targets
+    ])
+    for (path, fname), res in zip(targets, results):
+        if isinstance(res, dict) and res.get("status") == "success":
+            save_offline_backup(path, fname, res.get("content"))
+
+def _pending_sync_files():
     import base64
     for fname in os.listdir(SYNC_DIR):
         if '_' not in fname: continue
         safe_path, real_filename = fname.split('_', 1)
         instance_path = base64.urlsafe_b64decode(safe_path).decode()
-        
         with open(os.path.join(SYNC_DIR, fname), 'r', encoding='utf-8') as f:
             content = f.read()
-            
-        full_dest = os.path.join(instance_path, real_filename)
-        res = proxy_to_agent("write_file", filepath=full_dest, content=content)
+        yield fname, os.path.join(instance_path, real_filename), content
+
+async def flush_offline_cache_async():
+    """flush_offline_cache 的非同步版本 (以 batch 寫回，超過上限時 call_batch 自動分段)"""
+    clear_offline_backup()
+    if not await is_vm2_running_async(): return
+    if not os.path.exists(SYNC_DIR): return
+
+    pending = list(_pending_sync_files())
+    results = await proxy_batch_async([
+        {"action": "write_file", "filepath": dest, "content": content} for _, dest, content in pending
+    ])
+    for (fname, _, _), res in zip(pending, results):
         if res.get("status") == "success":
             os.remove(os.path.join(SYNC_DIR, fname))
 
+def flush_offline_cache():
+    clear_offline_backup() # 通電開機後備份即無效
+    if not is_vm2_running(): return
+    if not os.path.exists(SYNC_DIR): return
+    
+    for fname, full_dest, content in _pending_sync_files():
+        res = proxy_to_agent("write_file", filepath=full_dest, content=content)
+        if res.get("status") == "success":
+            os.remove(os.path.join(SYNC_DIR, fname))
@@ -1,5 +1,4 @@
 import http.server
-import socketserver
 import json
 import subprocess
 import os
@@ -9,32 +8,84 @@ import threading
 import time
 import re
 import glob
+import uuid
+import zlib
+import socket
+import base64
+import hashlib
+import collections
+import select
+import struct
+import ctypes
+import ctypes.util
+from concurrent.futures import ThreadPoolExecutor
 
 PORT = 9999
 API_KEY = "hihi_secret_key_2026"  # Simple security token
 
+# VM1 控制面板 (必須走內網 IP，見 docs/VM_ARCHITECTURE.md)；關機 Webhook 與即時串流共用
+VM1_ADDRESS = "10.140.0.2:24445"
+VM1_KEY = "AdminKey123456"
+
+KEEPALIVE_TIMEOUT = 60  # 閒置的 Keep-Alive 連線保留秒數 (需大於 VM1 連線池的 keepalive)
+SLOW_WORKERS = 4  # 慢速動作 (檔案讀寫、tail) 的同時執行上限
+SLOW_QUEUE_LIMIT = 32  # 執行中 + 排隊中的慢速動作上限，超過回 503
+CPU_SAMPLE_INTERVAL = 1.0
+
 # ==========================================
-# 智慧型串流全域變數 (Smart Connection)
+# CPU 取樣 (背景執行緒定期取樣，查詢時直接讀快取)
 # ==========================================
-STREAM_URL = "http://39.12.35.16:24446/internal_stream?key=AdminKey123456"
-is_streaming = False
-stream_thread = None
-stream_log_process = None
+
+class CpuSampler:
+    def __init__(self, interval=CPU_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.percent = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="cpu-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        import psutil
+        psutil.cpu_percent(interval=None)  # 第一次呼叫只建立基準
+        while True:
+            # interval 模式在本執行緒內阻塞取樣，其他呼叫端只讀取結果
+            self.percent = psutil.cpu_percent(interval=self.interval)
+
+cpu_sampler = CpuSampler()
+
+# ==========================================
+# 智慧型串流設定 (Smart Connection)
+# ==========================================
+STREAM_WS_URL = f"ws://{VM1_ADDRESS}/internal_stream_ws?key={VM1_KEY}"
+STREAM_MAX_BATCH_BYTES = 64 * 1024  # 單一訊框的資料量上限
+STREAM_MIN_DELAY = 0.02  # 批次等待時間下限 / 上限 (秒)，依 ack 往返延遲在兩者間調整
+STREAM_MAX_DELAY = 0.5
+STREAM_WINDOW_BYTES = 1024 * 1024  # 未確認 (未 ack) 的資料上限，超過就暫停送出
+STREAM_PENDING_MAX_BYTES = 2 * 1024 * 1024  # 待送資料上限，超過時丟棄最舊的 log
+STREAM_COMPRESS_MIN = 1024  # 批次超過此大小才嘗試 zlib 壓縮
+STREAM_STATUS_INTERVAL = 1.0
+STREAM_FLAG_ZLIB = 0x01
+STREAM_FRAME_HEADER = struct.Struct("!BQ")  # 旗標, 序號
 
 class AgentHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 Keep-Alive：VM1 的連線池可重複使用同一條連線 (每個回應都必須帶 Content-Length)
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT  # 閒置連線逾時後關閉，釋放執行緒
+
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "running", "version": "1.0"}).encode())
+        self._send_json({"status": "running", "version": "1.0"})
 
     def do_POST(self):
         # Basic Auth
         auth_header = self.headers.get('Authorization')
         if not auth_header or auth_header != f"Bearer {API_KEY}":
-            self.send_response(401)
-            self.end_headers()
-            self.wfile.write(b"Unauthorized")
+            # 未讀取的 body 會污染同一條連線的下一個請求 → 直接關閉
+            self.close_connection = True
+            self._send_text(401, b"Unauthorized")
             return
 
         content_length = int(self.headers.get('Content-Length', 0))
@@ -43,369 +94,1043 @@ class AgentHandler(http.server.BaseHTTPRequestHandler):
         try:
             data = json.loads(post_data)
         except:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Invalid JSON")
+            self._send_text(400, b"Invalid JSON")
             return
 
-        action = data.get('action')
-        
-        if action == "execute_command":
-            screen_name = data.get('screen_name')
-            command = data.get('command')
-            if not screen_name or not command:
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"Missing parameters")
-                return
-
-            try:
-                # Inject command into screen
-                full_cmd = f"{command}\r"
-                subprocess.run(
-                    ["screen", "-S", screen_name, "-p", "0", "-X", "stuff", full_cmd],
-                    check=True
-                )
-                self._send_json({"status": "success"})
-            except Exception as e:
-                self._send_json({"status": "error", "message": str(e)}, 500)
-
-        elif action == "get_system_status":
-            try:
-                output = subprocess.check_output("screen -ls", shell=True, text=True, stderr=subprocess.STDOUT)
-            except subprocess.CalledProcessError as e:
-                output = e.output
-            active_screens = []
-            for line in output.split("\n"):
-                if "Detached" in line or "Attached" in line:
-                    parts = line.split("\t")
-                    if len(parts) > 1:
-                        screen_full = parts[1].strip()
-                        if "." in screen_full:
-                            name = screen_full.split(".", 1)[1]
-                            active_screens.append(name.strip())
-                        else:
-                            active_screens.append(screen_full)
-            self._send_json({"status": "success", "screens": active_screens})
-
-        elif action == "get_stats":
-            import psutil
-            import shutil
-            try:
-                mem = psutil.virtual_memory()
-                cpu_percent = psutil.cpu_percent(interval=0.5)
-                disk = shutil.disk_usage("/")
-                net_io = psutil.net_io_counters()
-
-                stats = {
-                    "cpu_percent": cpu_percent,
-                    "ram_used_mb": mem.used // (1024*1024),
-                    "ram_total_mb": mem.total // (1024*1024),
-                    "ram_percent": mem.percent,
-                    "disk_used_gb": round(disk.used / (1024**3), 2),
-                    "disk_total_gb": round(disk.total / (1024**3), 2),
-                    "disk_percent": round((disk.used / disk.total) * 100, 1),
-                    "net_rx_mb": round(net_io.bytes_recv / (1024*1024), 2),
-                    "net_tx_mb": round(net_io.bytes_sent / (1024*1024), 2)
-                }
-                self._send_json({"status": "success", "stats": stats})
-            except Exception as e:
-                self._send_json({"status": "error", "message": str(e)}, 500)
-
-        elif action == "read_log_tail":
-            filepath = data.get('filepath')
-            lines = data.get('lines', 50)
-            if not filepath or ".." in filepath:
-                self.send_response(400)
-                self.end_headers()
-                return
-            try:
-                output = subprocess.check_output(["tail", "-n", str(lines), filepath], text=True)
-                self._send_json({"status": "success", "content": output})
-            except Exception as e:
-                self._send_json({"status": "error", "message": str(e)}, 500)
-
-        elif action == "read_file":
-            filepath = data.get('filepath')
-            if not filepath or ".." in filepath:
-                self.send_response(400)
-                self.end_headers()
-                return
-            try:
-                with open(filepath, 'r') as f:
-                    content = f.read()
-                self._send_json({"status": "success", "content": content})
-            except Exception as e:
-                self._send_json({"status": "error", "message": str(e)}, 500)
-                
-        elif action == "write_file":
-            filepath = data.get('filepath')
-            content = data.get('content')
-            if not filepath or content is None or ".." in filepath:
-                self.send_response(400)
-                self.end_headers()
-                return
-            try:
-                with open(filepath, 'w') as f:
-                    f.write(content)
-                self._send_json({"status": "success"})
-            except Exception as e:
-                self._send_json({"status": "error", "message": str(e)}, 500)
-                
-        elif action == "start_stream":
-            screen_name = data.get('screen_name', 'main')
-            filepath = f"/home/terraria/servers/instances/{screen_name}/bedrock_screen.log"
-            start_streaming_to_vm1(filepath)
-            self._send_json({"status": "success", "message": "Streaming started"})
-
-        elif action == "stop_stream":
-            stop_streaming_to_vm1()
-            self._send_json({"status": "success", "message": "Streaming stopped"})
-                
+        if data.get('action') == "batch":
+            status_code, result = run_batch(data)
         else:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Unknown action")
+            status_code, result = dispatch_action(data)
+        self._send_json(result, status_code)
 
     def _send_json(self, data, status_code=200):
+        self._send_text(status_code, json.dumps(data).encode(), 'application/json')
+
+    def _send_text(self, status_code, body, content_type='text/plain'):
         self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(body)
+
+
+class AgentServer(http.server.ThreadingHTTPServer):
+    """每條連線一個執行緒：慢速動作不會卡住其他呼叫端 (例如 get_stats 不再擋住指令注入)"""
+    daemon_threads = True
+    allow_reuse_address = True
 
 # ==========================================
-# 智慧型連線背景推播 (Smart Connection Streamer)
+# 動作處理 (每個 action 回傳 (HTTP 狀態碼, JSON))
 # ==========================================
 
-import psutil # Ensure this is available
+def _error(message, status_code=400):
+    return status_code, {"status": "error", "message": message}
 
-def stream_worker(filepath):
-    global is_streaming, stream_log_process
-    print(f"[Streamer] Started pushing logs from {filepath} to VM1")
-    
-    # 開啟 tail -F 監控特定伺服器的 log
+def act_execute_command(data):
+    screen_name = data.get('screen_name')
+    command = data.get('command')
+    if not screen_name or not command:
+        return _error("Missing parameters")
     try:
-        stream_log_process = subprocess.Popen(["tail", "-n", "0", "-F", filepath], stdout=subprocess.PIPE, text=True)
+        # Inject command into screen
+        full_cmd = f"{command}\r"
+        subprocess.run(
+            ["screen", "-S", screen_name, "-p", "0", "-X", "stuff", full_cmd],
+            check=True
+        )
+        return 200, {"status": "success"}
     except Exception as e:
-        print(f"[Streamer] Failed to start tail: {e}")
-        return
+        return _error(str(e), 500)
 
-    # 定期回報資源使用率的非阻塞檢查時間
-    last_status_time = time.time()
+def act_get_system_status(data):
+    try:
+        output = subprocess.check_output("screen -ls", shell=True, text=True, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        output = e.output
+    active_screens = []
+    for line in output.split("\n"):
+        if "Detached" in line or "Attached" in line:
+            parts = line.split("\t")
+            if len(parts) > 1:
+                screen_full = parts[1].strip()
+                if "." in screen_full:
+                    name = screen_full.split(".", 1)[1]
+                    active_screens.append(name.strip())
+                else:
+                    active_screens.append(screen_full)
+    return 200, {"status": "success", "screens": active_screens}
 
+def act_get_stats(data):
+    import psutil
+    import shutil
     try:
-        # non-blocking 讀取，配合頻率控制
-        os.set_blocking(stream_log_process.stdout.fileno(), False)
-        
-        while is_streaming:
-            # 1. 發送日誌更新
-            log_batch = ""
-            for _ in range(50): # 一次最多處理 50 行避免卡住
-                line = stream_log_process.stdout.readline()
-                if not line:
-                    break
-                log_batch += line
-            
-            if log_batch:
-                payload = {
-                    "type": "console_log",
-                    "data": log_batch
-                }
-                _post_to_vm1_stream(payload)
-
-            # 2. 每秒發送一次 CPU/RAM 狀態
-            now = time.time()
-            if now - last_status_time >= 1.0:
-                mem = psutil.virtual_memory()
-                cpu_percent = psutil.cpu_percent(interval=None)
-                status_payload = {
-                    "type": "server_status",
-                    "data": {
-                        "system": {
-                            "cpu_percent": cpu_percent,
-                            "ram_used_mb": mem.used // (1024*1024),
-                            "ram_total_mb": mem.total // (1024*1024),
-                            "ram_percent": mem.percent
-                        },
-                        "timestamp": int(now * 1000)
-                    }
-                }
-                _post_to_vm1_stream(status_payload)
-                last_status_time = now
-
-            time.sleep(0.1) # 100ms cycle
+        mem = psutil.virtual_memory()
+        cpu_percent = cpu_sampler.percent
+        disk = shutil.disk_usage("/")
+        net_io = psutil.net_io_counters()
 
+        stats = {
+            "cpu_percent": cpu_percent,
+            "ram_used_mb": mem.used // (1024*1024),
+            "ram_total_mb": mem.total // (1024*1024),
+            "ram_percent": mem.percent,
+            "disk_used_gb": round(disk.used / (1024**3), 2),
+            "disk_total_gb": round(disk.total / (1024**3), 2),
+            "disk_percent": round((disk.used / disk.total) * 100, 1),
+            "net_rx_mb": round(net_io.bytes_recv / (1024*1024), 2),
+            "net_tx_mb": round(net_io.bytes_sent / (1024*1024), 2)
+        }
+        return 200, {"status": "success", "stats": stats, "stream": stream_publisher.get_stats()}
     except Exception as e:
-        print(f"[Streamer] Worker crashed: {e}")
-    finally:
-        if stream_log_process:
-            stream_log_process.kill()
-            stream_log_process = None
-        print("[Streamer] Stopped.")
+        return _error(str(e), 500)
+
+def act_read_log_tail(data):
+    filepath = data.get('filepath')
+    lines = data.get('lines', 50)
+    if not filepath or ".." in filepath:
+        return _error("Invalid filepath")
+    try:
+        output = subprocess.check_output(["tail", "-n", str(lines), filepath], text=True)
+        return 200, {"status": "success", "content": output}
+    except Exception as e:
+        return _error(str(e), 500)
+
+def act_read_file(data):
+    filepath = data.get('filepath')
+    if not filepath or ".." in filepath:
+        return _error("Invalid filepath")
+    try:
+        with open(filepath, 'r') as f:
+            content = f.read()
+        return 200, {"status": "success", "content": content}
+    except Exception as e:
+        return _error(str(e), 500)
 
-def _post_to_vm1_stream(payload):
+def act_write_file(data):
+    filepath = data.get('filepath')
+    content = data.get('content')
+    if not filepath or content is None or ".." in filepath:
+        return _error("Invalid filepath or content")
     try:
-        req = urllib.request.Request(STREAM_URL, method="POST")
-        req.add_header('Content-Type', 'application/json')
-        data = json.dumps(payload).encode('utf-8')
-        urllib.request.urlopen(req, data=data, timeout=1)
+        with open(filepath, 'w') as f:
+            f.write(content)
+        return 200, {"status": "success"}
     except Exception as e:
-        # 暫時忽略連線錯誤以防止阻塞
-        pass 
+        return _error(str(e), 500)
+
+def _stream_paths(data):
+    """paths = 實例目錄陣列；相容舊版只帶 screen_name 的呼叫 (instances/<screen_name>/)"""
+    paths = data.get('paths')
+    if paths is None and data.get('screen_name'):
+        paths = [os.path.join(INSTANCES_BASE_DIR, data['screen_name'])]
+    if paths is not None and (not isinstance(paths, list) or any(not isinstance(p, str) or ".." in p for p in paths)):
+        raise ValueError("Invalid paths")
+    return [p.rstrip('/') for p in paths] if paths is not None else None
+
+def act_start_stream(data):
+    try:
+        paths = _stream_paths(data) or [os.path.join(INSTANCES_BASE_DIR, 'main')]
+    except ValueError as e:
+        return _error(str(e))
+    for path in paths:
+        log_follower.add(os.path.join(path, LOG_FILENAME))
+    stream_publisher.subscribe(paths)
+    return 200, {"status": "success", "message": "Streaming started", "instances": sorted(stream_publisher.paths)}
+
+def act_stop_stream(data):
+    try:
+        paths = _stream_paths(data)
+    except ValueError as e:
+        return _error(str(e))
+    stream_publisher.unsubscribe(paths)
+    return 200, {"status": "success", "message": "Streaming stopped", "instances": sorted(stream_publisher.paths)}
+
+def act_get_players(data):
+    """各實例的線上玩家名單 (由 log 事件即時維護)；paths / path 可指定實例目錄，尚未追蹤的會立即加入"""
+    paths = data.get('paths') or ([data['path']] if data.get('path') else None)
+    if paths is not None and (not isinstance(paths, list) or any(not isinstance(p, str) or ".." in p for p in paths)):
+        return _error("Invalid paths")
+    for path in paths or []:
+        log_follower.add(os.path.join(path, LOG_FILENAME))
+    return 200, {"status": "success", "instances": player_tracker.snapshot(paths)}
+
+ACTIONS = {
+    "execute_command": act_execute_command,
+    "get_system_status": act_get_system_status,
+    "get_stats": act_get_stats,
+    "read_log_tail": act_read_log_tail,
+    "read_file": act_read_file,
+    "write_file": act_write_file,
+    "start_stream": act_start_stream,
+    "stop_stream": act_stop_stream,
+    "get_players": act_get_players,
+}
+
+# 會碰磁碟 / 子程序的慢速動作：交給有上限的工作池，避免大量讀檔拖垮整台 Agent
+SLOW_ACTIONS = {"read_file", "read_log_tail", "write_file"}
+slow_executor = ThreadPoolExecutor(max_workers=SLOW_WORKERS, thread_name_prefix="slow")
+slow_slots = threading.BoundedSemaphore(SLOW_QUEUE_LIMIT)
+
+def dispatch_action(data):
+    action = data.get('action')
+    handler = ACTIONS.get(action)
+    if handler is None:
+        return _error("Unknown action")
+    try:
+        if action not in SLOW_ACTIONS:
+            return handler(data)
+        if not slow_slots.acquire(blocking=False):
+            return _error("Agent busy, retry later", 503)
+        try:
+            return slow_executor.submit(handler, data).result()
+        finally:
+            slow_slots.release()
+    except Exception as e:
+        return _error(str(e), 500)
+
+# ==========================================
+# 批次動作 (Batch)：一次往返執行多個子動作
+# ==========================================
+# 依序處理 items：連續的唯讀動作併發執行；會改變狀態的動作 (指令注入、寫檔等)
+# 視為屏障 —— 等前面全部完成後才單獨執行，後面的項目也等它完成，確保副作用順序不變。
+
+READ_ONLY_ACTIONS = {"get_system_status", "get_stats", "read_log_tail", "read_file", "get_players"}
+BATCH_MAX_ITEMS = 64
+BATCH_MAX_DELAY = 5.0  # 單一項目 delay 上限 (秒)
+batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="batch")
+
+def _run_batch_item(item):
+    if not isinstance(item, dict) or not item.get('action'):
+        return _error("Invalid item")
+    if item['action'] == "batch":
+        return _error("Nested batch is not allowed")
+    # delay：開始前先等待 (例如 execute_command list 之後讓 log 有時間寫入)
+    try:
+        delay = min(float(item.get('delay') or 0), BATCH_MAX_DELAY)
+    except (TypeError, ValueError):
+        delay = 0
+    if delay > 0:
+        time.sleep(delay)
+    return dispatch_action(item)
+
+def _batch_item_failed(status_code, result):
+    return status_code >= 400 or result.get('status') != 'success'
+
+def run_batch(data):
+    """
+    data = {"action": "batch", "items": [{"action": ...}, ...], "stop_on_error": false}
+    回傳 {"status": "success", "results": [...]}，每個結果帶有自己的 code / status (順序與 items 相同)
+    """
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return _error("Missing items")
+    if len(items) > BATCH_MAX_ITEMS:
+        return _error(f"Too many items (max {BATCH_MAX_ITEMS})")
+    stop_on_error = bool(data.get('stop_on_error'))
+
+    results = [None] * len(items)
+    failed = False
+
+    def record(index, outcome):
+        nonlocal failed
+        status_code, result = outcome
+        results[index] = {"action": items[index].get('action') if isinstance(items[index], dict) else None,
+                          "code": status_code, **result}
+        if _batch_item_failed(status_code, result):
+            failed = True
+
+    def flush(group):
+        futures = [(i, batch_executor.submit(_run_batch_item, items[i])) for i in group]
+        for i, future in futures:
+            try:
+                record(i, future.result())
+            except Exception as e:
+                record(i, _error(str(e), 500))
+        group.clear()
+
+    group = []
+    for i, item in enumerate(items):
+        if failed and stop_on_error:
+            break
+        action = item.get('action') if isinstance(item, dict) else None
+        if action in READ_ONLY_ACTIONS:
+            group.append(i)
+            continue
+        flush(group)
+        if failed and stop_on_error:
+            break
+        record(i, _run_batch_item(item))
+    flush(group)
+
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = {"action": items[i].get('action') if isinstance(items[i], dict) else None,
+                          "code": 424, "status": "skipped", "message": "Skipped after a previous failure"}
+    return 200, {"status": "success", "results": results}
+
+# ==========================================
+# 智慧型連線背景推播 (Smart Connection Streamer)
+# ==========================================
+import psutil # Ensure this is available
+
+# Agent 主動連上 VM1 的 /internal_stream_ws (WebSocket)，一條連線持續推送：
+# - 訊框 (Frame)：1 byte 旗標 + 8 bytes 序號 + JSON 批次 ({"items": [...]})，較大的批次以 zlib 壓縮
+# - 序號與續傳：VM1 回 ack；斷線重連時 VM1 回報最後收到的序號，未確認的訊框依序重送
+# - 自適應批次：累積到 STREAM_MAX_BATCH_BYTES 或等待時間到就送出；等待時間依 ack 往返延遲調整
+# - 背壓 (Backpressure)：未確認資料超過視窗就暫停送出；待送資料超過上限時丟棄最舊的 log 並送出 stream_gap 通知
+# - 多實例：每個 console_log 帶有 instance (實例目錄)，可同時訂閱多個實例
+
+class _WebSocketClient:
+    """最小的 RFC 6455 WebSocket 客戶端 (Agent 只依賴標準函式庫)"""
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def __init__(self, url, timeout=10):
+        parts = urllib.parse.urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((
+            f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        buf = b""
+        while b"\r\n\r\n" not in buf:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Handshake closed")
+            buf += chunk
+        head, self._buf = buf.split(b"\r\n\r\n", 1)
+        lines = head.decode(errors="replace").split("\r\n")
+        if " 101 " not in lines[0] + " ":
+            raise ConnectionError(f"Handshake rejected: {lines[0]}")
+        expected = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:])}
+        if headers.get("sec-websocket-accept") != expected:
+            raise ConnectionError("Handshake accept mismatch")
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def has_buffered(self):
+        return bool(self._buf)
+
+    def send(self, payload, opcode=0x2):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | n)
+        elif n < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, n)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, n)
+        mask = os.urandom(4)
+        # 以大整數 XOR 一次完成遮罩 (逐 byte 迴圈對 64KB 批次太慢)
+        key = (mask * (n // 4 + 1))[:n]
+        masked = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big") if n else b""
+        self.sock.sendall(header + mask + masked)
+
+    def send_json(self, data):
+        self.send(json.dumps(data).encode(), opcode=0x1)
+
+    def recv(self):
+        """讀取一則訊息 (呼叫前應確認可讀)；自動回應 ping，收到 close 時拋出 ConnectionError"""
+        message = b""
+        while True:
+            b1, b2 = self._read(2)
+            opcode, n = b1 & 0x0F, b2 & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", self._read(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", self._read(8))[0]
+            payload = self._read(n)
+            if opcode == 0x8:
+                raise ConnectionError("Closed by peer")
+            if opcode == 0x9:
+                self.send(payload, opcode=0xA)
+                continue
+            if opcode == 0xA:
+                continue
+            message += payload
+            if b1 & 0x80:
+                return message
+
+    def _read(self, n):
+        while len(self._buf) < n:
+            chunk = self.sock.recv(max(65536, n - len(self._buf)))
+            if not chunk:
+                raise ConnectionError("Connection closed")
+            self._buf += chunk
+        data, self._buf = self._buf[:n], self._buf[n:]
+        return data
+
+    def close(self):
+        try:
+            self.send(b"", opcode=0x8)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class StreamPublisher:
+    def __init__(self, url=STREAM_WS_URL):
+        self.url = url
+        self.stream_id = uuid.uuid4().hex  # 每次 Agent 啟動一個新的串流 ID，VM1 依此記錄已收到的序號
+        self.paths = set()  # 訂閱中的實例目錄
+        self.lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_w, False)
+
+        self.seq = 0
+        self.pending = collections.deque()  # (建立時間, item, 大小)
+        self.pending_bytes = 0
+        self.dropped = {}  # 實例目錄 -> 丟棄的行數 (背壓)
+        self.unacked = collections.OrderedDict()  # seq -> (訊框, 送出時間)
+        self.unacked_bytes = 0
+        self.delay = STREAM_MIN_DELAY
+        self.rtt = None
+        self.next_status = 0.0
+        self.stats = {"frames": 0, "bytes": 0, "raw_bytes": 0, "resent": 0, "dropped_lines": 0, "reconnects": 0}
+
+    # ---------- 訂閱 ----------
+
+    def subscribe(self, paths):
+        with self.lock:
+            self.paths.update(paths)
+            self._stop.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="streamer", daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self, paths=None):
+        with self.lock:
+            if paths is None:
+                self.paths.clear()
+            else:
+                self.paths.difference_update(paths)
+            if not self.paths:
+                # 沒有人在看：清掉待送資料，串流執行緒結束並關閉連線
+                self._stop.set()
+                self.pending.clear()
+                self.pending_bytes = 0
+                self.dropped.clear()
+                self.unacked.clear()
+                self.unacked_bytes = 0
+        self._wake()
 
-def start_streaming_to_vm1(filepath):
-    global is_streaming, stream_thread
-    if is_streaming:
-        return
-    is_streaming = True
-    stream_thread = threading.Thread(target=stream_worker, args=(filepath,), daemon=True)
-    stream_thread.start()
+    # ---------- 資料來源 ----------
 
-def stop_streaming_to_vm1():
-    global is_streaming
-    is_streaming = False
+    def publish_lines(self, log_path, lines):
+        path = os.path.dirname(log_path)
+        if path not in self.paths or not lines:
+            return
+        data = "".join(line + "\n" for line in lines)
+        item = {"type": "console_log", "instance": path, "data": data}
+        with self.lock:
+            self.pending.append((time.monotonic(), item, len(data)))
+            self.pending_bytes += len(data)
+            # 背壓：VM1 跟不上時丟棄最舊的 log，之後送出 stream_gap 讓前端知道有缺漏
+            while self.pending_bytes > STREAM_PENDING_MAX_BYTES and self.pending:
+                _, old, size = self.pending.popleft()
+                self.pending_bytes -= size
+                if old["type"] == "console_log":
+                    lost = old["data"].count("\n")
+                    self.dropped[old["instance"]] = self.dropped.get(old["instance"], 0) + lost
+                    self.stats["dropped_lines"] += lost
+        self._wake()
+
+    def _queue_status(self):
+        mem = psutil.virtual_memory()
+        item = {
+            "type": "server_status",
+            "data": {
+                "system": {
+                    "cpu_percent": cpu_sampler.percent,
+                    "ram_used_mb": mem.used // (1024*1024),
+                    "ram_total_mb": mem.total // (1024*1024),
+                    "ram_percent": mem.percent
+                },
+                "timestamp": int(time.time() * 1000)
+            }
+        }
+        with self.lock:
+            # 狀態只保留最新一筆，尚未送出的舊狀態直接取代
+            self.pending = collections.deque(p for p in self.pending if p[1]["type"] != "server_status")
+            self.pending.append((time.monotonic(), item, 200))
+            self.pending_bytes = sum(p[2] for p in self.pending)
+
+    # ---------- 串流主迴圈 ----------
+
+    def _run(self):
+        print("[Streamer] Started.")
+        backoff = 1
+        while True:
+            with self.lock:
+                if self._stop.is_set() or not self.paths:
+                    self._thread = None
+                    break
+            ws = None
+            try:
+                ws = _WebSocketClient(self.url)
+                backoff = 1
+                self._session(ws)
+            except (OSError, ConnectionError, ValueError) as e:
+                self.stats["reconnects"] += 1
+                print(f"[Streamer] Connection lost ({e}), retrying in {backoff}s")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if ws is not None:
+                    ws.close()
+        print("[Streamer] Stopped.")
+
+    def _session(self, ws):
+        # 續傳：告訴 VM1 串流 ID，VM1 回報最後收到的序號，未確認的訊框依序重送
+        ws.send_json({"type": "hello", "stream": self.stream_id, "next_seq": self.seq + 1})
+        ready, _, _ = select.select([ws], [], [], 10)
+        reply = json.loads(ws.recv()) if ready or ws.has_buffered() else {}
+        if reply.get("type") != "resume":
+            raise ConnectionError("No resume from VM1")
+        with self.lock:
+            self._ack(int(reply.get("last_seq", 0)), rtt_sample=False)
+            resend = [frame for frame, _ in self.unacked.values()]
+        for frame in resend:
+            ws.send(frame)
+        self.stats["resent"] += len(resend)
+        if resend:
+            print(f"[Streamer] Resumed, resent {len(resend)} frames.")
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= self.next_status:
+                self._queue_status()
+                self.next_status = now + STREAM_STATUS_INTERVAL
+
+            frame = self._next_frame()
+            if frame is not None:
+                ws.send(frame)  # 阻塞送出 (socket 逾時)：TCP 緩衝滿時自然減速
+                continue
+
+            if ws.has_buffered():
+                timeout = 0
+            else:
+                timeout = self._wait_timeout()
+            ready, _, _ = select.select([ws, self._wake_r], [], [], timeout)
+            if self._wake_r in ready:
+                os.read(self._wake_r, 4096)
+            if ws in ready or ws.has_buffered():
+                msg = json.loads(ws.recv())
+                if msg.get("type") == "ack":
+                    with self.lock:
+                        self._ack(int(msg.get("seq", 0)))
+
+    def _next_frame(self):
+        """批次條件成立時打包一個訊框 (大小到了、或最舊的資料已等待超過 delay)"""
+        with self.lock:
+            if not self.pending and not self.dropped:
+                return None
+            if self.unacked_bytes >= STREAM_WINDOW_BYTES:
+                return None  # 視窗已滿，等 ack
+            age = time.monotonic() - self.pending[0][0] if self.pending else self.delay
+            if self.pending_bytes < STREAM_MAX_BATCH_BYTES and age < self.delay:
+                return None
+
+            items = [{"type": "stream_gap", "instance": path, "dropped": n} for path, n in self.dropped.items()]
+            self.dropped.clear()
+            size = 0
+            while self.pending and size < STREAM_MAX_BATCH_BYTES:
+                _, item, item_size = self.pending.popleft()
+                self.pending_bytes -= item_size
+                size += item_size
+                # 同一實例連續的 log 合併成一個項目
+                if (item["type"] == "console_log" and items and items[-1]["type"] == "console_log"
+                        and items[-1]["instance"] == item["instance"]):
+                    items[-1] = dict(items[-1], data=items[-1]["data"] + item["data"])
+                else:
+                    items.append(item)
+
+            self.seq += 1
+            body = json.dumps({"items": items}).encode()
+            flags = 0
+            if len(body) >= STREAM_COMPRESS_MIN:
+                compressed = zlib.compress(body, 6)
+                if len(compressed) < len(body):
+                    body, flags = compressed, STREAM_FLAG_ZLIB
+            frame = STREAM_FRAME_HEADER.pack(flags, self.seq) + body
+            self.unacked[self.seq] = (frame, time.monotonic())
+            self.unacked_bytes += len(frame)
+            self.stats["frames"] += 1
+            self.stats["bytes"] += len(frame)
+            self.stats["raw_bytes"] += size
+            return frame
+
+    def _ack(self, seq, rtt_sample=True):
+        while self.unacked:
+            first = next(iter(self.unacked))
+            if first > seq:
+                break
+            frame, sent_at = self.unacked.pop(first)
+            self.unacked_bytes -= len(frame)
+            if rtt_sample and first == seq:
+                rtt = time.monotonic() - sent_at
+                self.rtt = rtt if self.rtt is None else self.rtt * 0.8 + rtt * 0.2
+        # 自適應：往返越慢，每批等越久 (送得少、批次大)；視窗吃緊時直接用最長等待
+        if self.rtt is not None:
+            self.delay = min(STREAM_MAX_DELAY, max(STREAM_MIN_DELAY, self.rtt / 2))
+        if self.unacked_bytes > STREAM_WINDOW_BYTES // 2:
+            self.delay = STREAM_MAX_DELAY
+
+    def _wait_timeout(self):
+        with self.lock:
+            timeout = max(0.0, self.next_status - time.monotonic())
+            if self.pending and self.unacked_bytes < STREAM_WINDOW_BYTES:
+                timeout = min(timeout, max(0.0, self.pending[0][0] + self.delay - time.monotonic()))
+            return timeout
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update({
+                "active": self._thread is not None,
+                "instances": sorted(self.paths),
+                "seq": self.seq,
+                "pending_bytes": self.pending_bytes,
+                "unacked_frames": len(self.unacked),
+                "delay_ms": round(self.delay * 1000),
+                "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            })
+            return stats
+
+
+stream_publisher = StreamPublisher()
 
 # ==========================================
-# 背景事件驅動機制 (自動關機與智慧存檔偵測)
+# 背景事件驅動機制 (玩家名單、閒置關機與智慧存檔偵測)
 # ==========================================
+# 以 inotify 追蹤每個實例的 bedrock_screen.log，解析 Player connected / disconnected
+# 維護各實例的線上名單；名單清空後啟動「該實例」的閒置計時器，到期只關閉該實例。
+# 所有實例都 Quit correctly 之後才通知 VM1 切斷 VM2 電源。
 
-VM1_WEBHOOK_URL = "http://10.140.0.2:24445/webhook/shutdown_vm2?key=AdminKey123456"
+VM1_WEBHOOK_URL = f"http://{VM1_ADDRESS}/webhook/shutdown_vm2?key={VM1_KEY}"
 SHUTDOWN_DELAY_SECONDS = 600  # 10 分鐘 = 600 秒
+INSTANCES_BASE_DIR = "/home/terraria/servers/instances"
+LOG_FILENAME = "bedrock_screen.log"
+LOG_REPLAY_BYTES = 2 * 1024 * 1024  # 啟動 / 新增追蹤時重播 log 尾端，重建目前名單
+LOG_SWEEP_INTERVAL = 5.0  # 定期檢查一次所有檔案 (補漏掉的事件；無 inotify 時為輪詢間隔)
 
-shutdown_timer = None
-shutdown_lock = threading.Lock()
-auto_reason_flag = None
+CONNECT_PATTERN = re.compile(r'Player connected:\s*(.+?),\s*xuid:\s*(\d*)')
+DISCONNECT_PATTERN = re.compile(r'Player disconnected:\s*(.+?),\s*xuid:\s*(\d*)')
+ADDON_JOIN_PATTERN = re.compile(r'\[PlayerJoin\]\s*(.+)')
+ADDON_LEAVE_PATTERN = re.compile(r'\[PlayerLeave\]\s*(.+)')
+LOG_TIME_PATTERN = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
 
-def trigger_auto_shutdown():
-    """計時炸彈引爆，執行智慧安全關機"""
-    global shutdown_timer, auto_reason_flag
-    try:
-        # 1. 廣播關機警告並發送 stop 給所有 Minecraft 螢幕
-        output = subprocess.check_output("screen -ls", shell=True, text=True, stderr=subprocess.STDOUT)
-        active_screens = []
-        for line in output.split('\n'):
-            if "Detached" in line or "Attached" in line:
-                parts = line.split('\t')
-                if len(parts) > 1:
-                    screen_name = parts[1].strip()
-                    active_screens.append(screen_name)
-                    # 踢出可能卡住的玩家並執行安全存檔
-                    subprocess.run(["screen", "-S", screen_name, "-p", "0", "-X", "stuff", "say 伺服器閒置達 10 分鐘，正在執行自動安全存檔並關機...\r"])
-                    time.sleep(1)
-                    subprocess.run(["screen", "-S", screen_name, "-p", "0", "-X", "stuff", "stop\r"])
-
-        # 標記為自動關機，等待 log_monitor_thread 捕捉到 Quit correctly 即可發送 webhook
-        auto_reason_flag = "auto"
 
-    except Exception as e:
-        print(f"[AutoShutdown] Error during shutdown sequence: {e}")
-    finally:
-        with shutdown_lock:
-            shutdown_timer = None
-
-def reset_timer():
-    """重置或啟動 10 分鐘計時炸彈"""
-    global shutdown_timer
-    with shutdown_lock:
-        if shutdown_timer is not None:
-            shutdown_timer.cancel()
-        print("[AutoShutdown] Server empty! Starting 10-minute countdown bomb...")
-        shutdown_timer = threading.Timer(SHUTDOWN_DELAY_SECONDS, trigger_auto_shutdown)
-        shutdown_timer.start()
-
-def cancel_timer():
-    """有人進入伺服器，拆除炸彈"""
-    global shutdown_timer
-    with shutdown_lock:
-        if shutdown_timer is not None:
-            print("[AutoShutdown] Player joined! Canceling countdown bomb.")
-            shutdown_timer.cancel()
-            shutdown_timer = None
-
-def get_active_screens():
-    """取得所有目前活躍的 screen"""
-    screens = []
+def screens_by_path():
+    """目前的 screen 對應到實例目錄 (screen 是在實例目錄 cd 之後啟動的，以 /proc/<pid>/cwd 判斷)"""
+    screens = {}
     try:
         output = subprocess.check_output("screen -ls", shell=True, text=True, stderr=subprocess.STDOUT)
-        for line in output.split('\n'):
-            if "Detached" in line or "Attached" in line:
-                parts = line.split('\t')
-                if len(parts) > 1:
-                    screens.append(parts[1].strip())
-    except:
-        pass
+    except subprocess.CalledProcessError as e:
+        output = e.output or ""
+    except Exception:
+        return screens
+    for line in output.split('\n'):
+        if "Detached" in line or "Attached" in line:
+            parts = line.split('\t')
+            if len(parts) > 1:
+                screen_full = parts[1].strip()
+                pid, _, name = screen_full.partition('.')
+                try:
+                    cwd = os.path.realpath(os.readlink(f"/proc/{pid}/cwd"))
+                except OSError:
+                    cwd = None
+                screens[cwd or name] = name or screen_full
     return screens
 
-def trigger_server_list_cmd():
-    """向所有遊戲伺服器索取目前人數 (寫入日誌)"""
-    for screen_name in get_active_screens():
-        subprocess.run(["screen", "-S", screen_name, "-p", "0", "-X", "stuff", "list\r"], stderr=subprocess.DEVNULL)
 
-def log_monitor_thread():
-    """被動監聽 Minecraft 日誌"""
-    time.sleep(3) # 等待主程式與伺服器暖機
-    
-    # 確保有 log 檔案可以 tail
-    base_dir = "/home/terraria/servers/instances"
-    main_log = f"{base_dir}/main/bedrock_screen.log"
-    if not os.path.exists(main_log):
-        os.makedirs(os.path.dirname(main_log), exist_ok=True)
-        open(main_log, 'a').close()
-
-    list_pattern = re.compile(r'(?:There are|共有)\s+(\d+)/(\d+)')
-    
-    # 開機時先戳一次確認目前有沒有人（有的話取消，沒有的話直接啟動計時器）
-    trigger_server_list_cmd()
+def find_screen(instance_dir):
+    screens = screens_by_path()
+    real = os.path.realpath(instance_dir)
+    if real in screens:
+        return screens[real]
+    # 退而求其次：目錄名稱與 screen 名稱相同 (instances/<screen_name>/)
+    name = os.path.basename(real)
+    return name if name in screens.values() else None
 
-    # 使用 tail -F 監控所有 instances 底下的 bedrock log
-    cmd = ["bash", "-c", f"tail -F {base_dir}/*/bedrock_screen.log 2>/dev/null"]
-    
-    try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        for line in iter(process.stdout.readline, ''):
-            if not line:
-                break
-                
-            # 偵測玩家連線
-            if "Player connected:" in line or "PlayerJoin" in line:
-                cancel_timer()
-                
-            # 偵測玩家離線 (不直接開始倒數，而是觸發一次精準的人數查詢)
-            elif "Player disconnected:" in line or "PlayerLeave" in line:
-                trigger_server_list_cmd()
-                
-            # 偵測 Minecraft 伺服器順利結束存檔
-            elif "Quit correctly" in line:
-                global auto_reason_flag
-                reason = auto_reason_flag or "manual"
+
+class InstanceState:
+    def __init__(self, path):
+        self.path = path
+        self.running = None  # None = 尚未從 log 得知
+        self.players = {}  # 名稱 (小寫) -> {"name", "xuid", "since"}
+        self.idle_timer = None
+        self.idle_deadline = None
+        self.auto_stopping = False
+
+
+class PlayerTracker:
+    """各實例的線上玩家名單與閒置計時器 (log 事件驅動，不再注入 list 指令輪詢)"""
+
+    def __init__(self, idle_seconds=SHUTDOWN_DELAY_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.instances = {}
+        self.lock = threading.RLock()
+
+    # ---------- log 事件 ----------
+
+    def feed(self, log_path, lines, replay=False):
+        path = os.path.dirname(log_path)
+        with self.lock:
+            state = self.instances.setdefault(path, InstanceState(path))
+            for line in lines:
+                self._apply(state, line, replay)
+            if replay:
+                # log 只代表上次的狀態 (當機 / VM 強制關機時不會有 Quit correctly)，以 screen 是否存在為準
+                if find_screen(path) is None:
+                    state.running = False
+                    state.players.clear()
+                elif state.running is None:
+                    state.running = True
+                self._update_idle(state)
+
+    def _apply(self, state, line, replay):
+        if "Server started." in line:
+            state.running = True
+            state.players.clear()
+            state.auto_stopping = False
+            if not replay:
+                self._update_idle(state)
+            return
+        if "Quit correctly" in line:
+            state.running = False
+            state.players.clear()
+            self._cancel_idle(state)
+            if not replay:
+                self._on_quit(state)
+            return
+
+        m = CONNECT_PATTERN.search(line) or ADDON_JOIN_PATTERN.search(line)
+        if m:
+            name = m.group(1).strip()
+            xuid = m.group(2) if m.re is CONNECT_PATTERN else None
+            entry = state.players.get(name.lower())
+            if entry is None:
+                state.players[name.lower()] = {"name": name, "xuid": xuid or None, "since": self._line_time(line, replay)}
+            elif xuid:
+                entry["xuid"] = xuid
+            state.running = True
+            if not replay:
+                self._update_idle(state)
+            return
+
+        m = DISCONNECT_PATTERN.search(line) or ADDON_LEAVE_PATTERN.search(line)
+        if m:
+            state.players.pop(m.group(1).strip().lower(), None)
+            if not replay:
+                self._update_idle(state)
+
+    @staticmethod
+    def _line_time(line, replay):
+        if replay:
+            m = LOG_TIME_PATTERN.match(line)
+            if m:
                 try:
-                    url = f"{VM1_WEBHOOK_URL}&reason={reason}"
-                    req = urllib.request.Request(url, method="POST")
-                    urllib.request.urlopen(req, timeout=5)
-                except Exception as e:
-                    print(f"Webhook error: {e}")
-                auto_reason_flag = None
-
-            # 偵測 list 指令的回傳結果
+                    return time.mktime(time.strptime(m.group(1), "%Y-%m-%d %H:%M:%S"))
+                except ValueError:
+                    pass
+        return time.time()
+
+    # ---------- 閒置計時 ----------
+
+    def _update_idle(self, state):
+        if state.running and not state.players and not state.auto_stopping:
+            if state.idle_timer is None:
+                print(f"[AutoShutdown] {state.path} is empty, starting {self.idle_seconds // 60}-minute countdown.")
+                state.idle_deadline = time.time() + self.idle_seconds
+                state.idle_timer = threading.Timer(self.idle_seconds, self._on_idle, args=(state,))
+                state.idle_timer.daemon = True
+                state.idle_timer.start()
+        else:
+            if state.idle_timer is not None and state.players:
+                print(f"[AutoShutdown] Player joined {state.path}, countdown canceled.")
+            self._cancel_idle(state)
+
+    def _cancel_idle(self, state):
+        if state.idle_timer is not None:
+            state.idle_timer.cancel()
+        state.idle_timer = None
+        state.idle_deadline = None
+
+    def _on_idle(self, state):
+        """閒置到期：只對這個實例執行安全存檔並關閉"""
+        with self.lock:
+            if state.idle_timer is None or state.players:
+                return
+            state.idle_timer = None
+            state.idle_deadline = None
+            state.auto_stopping = True
+        screen_name = find_screen(state.path)
+        if not screen_name:
+            print(f"[AutoShutdown] No screen found for {state.path}, skipping.")
+            return
+        try:
+            subprocess.run(["screen", "-S", screen_name, "-p", "0", "-X", "stuff", "say 伺服器閒置達 10 分鐘，正在執行自動安全存檔並關機...\r"])
+            time.sleep(1)
+            subprocess.run(["screen", "-S", screen_name, "-p", "0", "-X", "stuff", "stop\r"])
+        except Exception as e:
+            print(f"[AutoShutdown] Error stopping {screen_name}: {e}")
+
+    def _on_quit(self, state):
+        """某個實例存檔結束；全部實例都停了才請 VM1 切斷電源"""
+        for other in self.instances.values():
+            if other is state or not other.running:
+                continue
+            if find_screen(other.path) is not None:
+                return
+            # log 沒有 Quit correctly 但 screen 已不存在 (當機) → 視為已停止
+            print(f"[AutoShutdown] {other.path} has no screen, marking as stopped.")
+            other.running = False
+            other.players.clear()
+            self._cancel_idle(other)
+        reason = "auto" if state.auto_stopping else "manual"
+        state.auto_stopping = False
+        threading.Thread(target=self._send_shutdown_webhook, args=(reason,), daemon=True).start()
+
+    @staticmethod
+    def _send_shutdown_webhook(reason):
+        try:
+            url = f"{VM1_WEBHOOK_URL}&reason={reason}"
+            req = urllib.request.Request(url, method="POST")
+            urllib.request.urlopen(req, timeout=5)
+        except Exception as e:
+            print(f"Webhook error: {e}")
+
+    # ---------- 查詢 ----------
+
+    def snapshot(self, paths=None):
+        with self.lock:
+            states = list(self.instances.values())
+            if paths:
+                wanted = {os.path.realpath(p) for p in paths}
+                states = [s for s in states if os.path.realpath(s.path) in wanted]
+            result = []
+            for s in states:
+                players = sorted(s.players.values(), key=lambda p: p["since"])
+                result.append({
+                    "path": s.path,
+                    "running": bool(s.running),
+                    "players": [dict(p) for p in players],
+                    "count": len(players),
+                    "max_players": _read_max_players(s.path),
+                    "idle_shutdown_in": round(s.idle_deadline - time.time()) if s.idle_deadline else None,
+                })
+            return result
+
+
+def _read_max_players(instance_dir):
+    try:
+        with open(os.path.join(instance_dir, 'server.properties'), 'r') as f:
+            for line in f:
+                if line.strip().startswith('max-players='):
+                    return int(line.strip().split('=', 1)[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# ---------- inotify 檔案追蹤 ----------
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _FollowedFile:
+    def __init__(self):
+        self.f = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b""
+
+
+class LogFollower:
+    """
+    追蹤多個 log 檔的新增內容：監看檔案所在目錄 (inotify)，因此檔案被輪替 (rename)、
+    截斷或刪除後重建都能接續；新的實例目錄出現時自動加入。沒有 inotify 時改為定期輪詢。
+    """
+
+    def __init__(self, on_lines, base_dir=INSTANCES_BASE_DIR, sweep_interval=LOG_SWEEP_INTERVAL):
+        self.on_lines = on_lines  # on_lines(log_path, lines, replay)
+        self.base_dir = base_dir
+        self.sweep_interval = sweep_interval
+        self.files = {}
+        self.lock = threading.RLock()
+        self._inotify_fd = None
+        self._watches = {}  # wd -> 目錄
+        self._watched_dirs = set()
+        self._libc = None
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = self._libc.inotify_init()
+            if fd >= 0:
+                self._inotify_fd = fd
+        except (OSError, AttributeError):
+            self._libc = None
+        if self._inotify_fd is None:
+            print("[LogMonitor] inotify unavailable, falling back to polling.")
+
+    def add(self, log_path):
+        """開始追蹤 (重播尾端以重建名單)；已在追蹤中則忽略"""
+        with self.lock:
+            if log_path in self.files:
+                return
+            self.files[log_path] = _FollowedFile()
+            self._watch_dir(os.path.dirname(log_path))
+            self._check(log_path, replay=True)
+
+    def discover(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._watch_dir(self.base_dir)
+        for log_path in glob.glob(os.path.join(self.base_dir, "*", LOG_FILENAME)):
+            self.add(log_path)
+
+    def run(self):
+        self.discover()
+        last_sweep = time.time()
+        while True:
+            if self._inotify_fd is not None:
+                ready, _, _ = select.select([self._inotify_fd], [], [], self.sweep_interval)
+                if ready:
+                    self._handle_events(os.read(self._inotify_fd, 64 * 1024))
             else:
-                m = list_pattern.search(line)
-                if m:
-                    current_players = int(m.group(1))
-                    if current_players == 0:
-                        reset_timer()
-                    elif current_players > 0:
-                        cancel_timer()
+                time.sleep(self.sweep_interval)
+            if time.time() - last_sweep >= self.sweep_interval:
+                last_sweep = time.time()
+                self.discover()
+                with self.lock:
+                    for log_path in list(self.files):
+                        self._check(log_path)
+
+    def _watch_dir(self, directory):
+        if self._inotify_fd is None or directory in self._watched_dirs or not os.path.isdir(directory):
+            return
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        wd = self._libc.inotify_add_watch(self._inotify_fd, directory.encode(), mask)
+        if wd < 0:
+            print(f"[LogMonitor] inotify_add_watch failed for {directory} (errno {ctypes.get_errno()})")
+            return
+        self._watches[wd] = directory
+        self._watched_dirs.add(directory)
 
+    def _handle_events(self, buf):
+        touched = set()
+        pos = 0
+        while pos + _INOTIFY_EVENT.size <= len(buf):
+            wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(buf, pos)
+            name = buf[pos + _INOTIFY_EVENT.size:pos + _INOTIFY_EVENT.size + name_len].rstrip(b"\0").decode(errors="replace")
+            pos += _INOTIFY_EVENT.size + name_len
+            if mask & IN_Q_OVERFLOW:
+                touched.update(self.files)  # 事件佇列溢位 → 全部檢查
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if directory == self.base_dir and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add(os.path.join(path, LOG_FILENAME))  # 新建立的實例目錄
+            elif path in self.files:
+                touched.add(path)
+        with self.lock:
+            for path in touched:
+                self._check(path)
+
+    def _check(self, log_path, replay=False):
+        """讀出新增的內容；偵測輪替 (inode 改變) 與截斷 (檔案變小)"""
+        state = self.files[log_path]
+        try:
+            st = os.stat(log_path)
+        except OSError:
+            return  # 輪替中 / 尚未建立，等 IN_CREATE
+        lines = []
+        if state.f is None or st.st_ino != state.inode:
+            if state.f is not None:
+                lines += self._read_new(state)  # 舊檔 (已改名) 剩下的內容
+                state.f.close()
+            try:
+                state.f = open(log_path, 'rb')
+            except OSError:
+                state.f = None
+                return
+            state.inode = st.st_ino
+            state.partial = b""
+            state.offset = 0
+            if replay and st.st_size > LOG_REPLAY_BYTES:
+                state.offset = st.st_size - LOG_REPLAY_BYTES
+                state.f.seek(state.offset)
+                state.f.readline()  # 丟掉被切到一半的行
+                state.offset = state.f.tell()
+        elif st.st_size < state.offset:
+            # 被截斷 (例如 screen log 被清空) → 從頭讀
+            state.f.seek(0)
+            state.offset = 0
+            state.partial = b""
+        lines += self._read_new(state)
+        if lines or replay:
+            try:
+                self.on_lines(log_path, lines, replay)
+            except Exception as e:
+                print(f"[LogMonitor] Handler error for {log_path}: {e}")
+
+    @staticmethod
+    def _read_new(state):
+        state.f.seek(state.offset)
+        data = state.f.read()
+        state.offset += len(data)
+        data = state.partial + data
+        *complete, state.partial = data.split(b"\n")
+        return [line.decode('utf-8', errors='replace') for line in complete]
+
+
+player_tracker = PlayerTracker()
+
+
+def _on_log_lines(log_path, lines, replay):
+    player_tracker.feed(log_path, lines, replay)
+    if not replay:
+        stream_publisher.publish_lines(log_path, lines)
+
+
+log_follower = LogFollower(_on_log_lines)
+
+
+def log_monitor_thread():
+    """被動監聽所有實例的 Minecraft 日誌"""
+    time.sleep(3) # 等待主程式與伺服器暖機
+    try:
+        log_follower.run()
     except Exception as e:
         print(f"[LogMonitor] Died with error: {e}")
 
 if __name__ == "__main__":
-    Handler = AgentHandler
+    cpu_sampler.start()
     # 啟動背景事件驅動監聽器
     t = threading.Thread(target=log_monitor_thread, daemon=True)
     t.start()
     
     # Listen on all interfaces so VM1 can reach it via internal IP
-    with socketserver.TCPServer(("0.0.0.0", PORT), Handler) as httpd:
+    with AgentServer(("0.0.0.0", PORT), AgentHandler) as httpd:
         print(f"Agent API running on port {PORT}")
         httpd.serve_forever()